@@ -0,0 +1,129 @@
+import contextlib
+import logging
+import threading
+
+# noinspection PyPackageRequirements
+import pytwitter  # pip 'package' is python-twitter, module is pytwitter -RDP
+
+# Ledger of the API calls made by every bleach action
+#
+# Each bleach action, e.g. unliking one tweet, should cost exactly the calls listed for it in ACTION_ENDPOINTS. The
+# write endpoints have small rate limits, 50 requests per 15 min, so a stray extra call per item halves the
+# throughput of a run. The ledger counts every request by endpoint and by action, and flags a call made inside an
+# action that isn't one of the calls the action needs, or that the action has already made.
+#
+# Retries of the same request by the API object are not new calls and are not counted again.
+#
+
+ACTION_UNLIKE = "unlike"
+ACTION_DELETE_TWEET = "delete_tweet"
+ACTION_REMOVE_RETWEET = "remove_retweet"
+ACTION_UNFOLLOW = "unfollow"
+ACTION_RESTORE_FOLLOW = "restore_follow"
+ACTION_UNBLOCK = "unblock"
+ACTION_UNMUTE = "unmute"
+ACTION_DELETE_LIST = "delete_list"
+
+# Endpoints, as keyed by rate_limit_endpoint_key, each action calls exactly once
+ACTION_ENDPOINTS = {
+    ACTION_UNLIKE: ("DELETE /2/users/:id/likes/:id",),
+    ACTION_DELETE_TWEET: ("DELETE /2/tweets/:id",),
+    ACTION_REMOVE_RETWEET: ("DELETE /2/users/:id/retweets/:id",),
+    ACTION_UNFOLLOW: ("DELETE /2/users/:id/following/:id",),
+    ACTION_RESTORE_FOLLOW: ("POST /2/users/:id/following",),
+    ACTION_UNBLOCK: ("DELETE /2/users/:id/blocking/:id",),
+    ACTION_UNMUTE: ("DELETE /2/users/:id/muting/:id",),
+    ACTION_DELETE_LIST: ("DELETE /2/lists/:id",),
+}
+
+
+class ApiCallLedgerRedundantCallException(pytwitter.PyTwitterError):
+    pass
+
+
+class ApiCallLedger:
+    """
+    Counts the API calls made through a WrappedPyTwitterAPI. Thread safe, the action being done is tracked per thread
+    so threads bleaching different things at the same time are recorded separately.
+    """
+
+    def __init__(self, reject_redundant_calls=False):
+        """
+        :param reject_redundant_calls: True to raise ApiCallLedgerRedundantCallException instead of making a redundant
+        call. Default False, the call is made and logged as a warning
+        """
+        self.reject_redundant_calls = reject_redundant_calls
+
+        self._lock = threading.Lock()
+        self._action_context = threading.local()
+        self._calls_by_endpoint = {}
+        self._calls_by_action = {}
+        self._redundant_calls = {}
+
+    @contextlib.contextmanager
+    def action(self, action, item_id):
+        """
+        Record the calls made inside the with block against an action on one item
+
+        :param action: One of the ACTION_ constants
+        :param item_id: ID of the item the action is done to
+        """
+        previous_action = getattr(self._action_context, "action", None)
+        self._action_context.action = (action, item_id, [])
+        try:
+            yield
+        finally:
+            self._action_context.action = previous_action
+
+    def record(self, endpoint):
+        """
+        Record a call before it is made
+
+        :param endpoint: Key of the endpoint from rate_limit_endpoint_key
+        :return: None
+        :raises ApiCallLedgerRedundantCallException: If reject_redundant_calls is set and the call is redundant
+        """
+        current_action = getattr(self._action_context, "action", None)
+        action_name = current_action[0] if current_action is not None else None
+
+        redundant = False
+        if current_action is not None:
+            action, item_id, endpoints_called = current_action
+            redundant = endpoint not in ACTION_ENDPOINTS.get(action, ()) or endpoint in endpoints_called
+            if redundant:
+                message = f"Redundant call '{endpoint}' in action '{action}' on item {item_id}. " \
+                          f"Already called {endpoints_called}"
+                if self.reject_redundant_calls:
+                    with self._lock:
+                        self._redundant_calls[endpoint] = self._redundant_calls.get(endpoint, 0) + 1
+                    raise ApiCallLedgerRedundantCallException({"status": None, "detail": message})
+                logging.warning(message)
+            endpoints_called.append(endpoint)
+
+        with self._lock:
+            self._calls_by_endpoint[endpoint] = self._calls_by_endpoint.get(endpoint, 0) + 1
+            self._calls_by_action[action_name] = self._calls_by_action.get(action_name, 0) + 1
+            if redundant:
+                self._redundant_calls[endpoint] = self._redundant_calls.get(endpoint, 0) + 1
+
+    def calls_by_endpoint(self):
+        """
+        :return: Dictionary of endpoint key to the number of calls made
+        """
+        with self._lock:
+            return dict(self._calls_by_endpoint)
+
+    def calls_by_action(self):
+        """
+        :return: Dictionary of action to the number of calls made. Calls made outside any action, e.g. reading pages,
+        are counted under None
+        """
+        with self._lock:
+            return dict(self._calls_by_action)
+
+    def redundant_calls(self):
+        """
+        :return: Dictionary of endpoint key to the number of redundant calls flagged or rejected
+        """
+        with self._lock:
+            return dict(self._redundant_calls)
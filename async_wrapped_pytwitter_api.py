@@ -0,0 +1,240 @@
+import asyncio
+import contextvars
+import logging
+
+import aiohttp
+
+from wrapped_pytwitter_api import *
+
+# asyncio version of WrappedPyTwitterAPI for the Twitter v2 endpoints used by the bleach code
+#
+# All requests go through one aiohttp session with a pool of keep-alive connections to the API. Many requests can be
+# in flight at once from a single thread, each one waiting on the rate limit scheduler of its endpoint without
+# blocking the others.
+#
+# The methods raise the same exceptions as WrappedPyTwitterAPI and always return the JSON data of the response, the
+# same as calling the WrappedPyTwitterAPI methods with return_json=True. A dropped connection or a timeout raises
+# WrappedPyTwitterAPIConnectionException, never an aiohttp exception.
+#
+# Authentication is done with WrappedPyTwitterAPI.OAuth2AuthenticationFlowHelper, then the access and refresh tokens
+# are passed to AsyncWrappedPyTwitterAPI
+#
+#   async with AsyncWrappedPyTwitterAPI(client_id, auth_details["access_token"], auth_details["refresh_token"]) as api:
+#       twitter_me = await api.get_me()
+#
+# It is a standalone client, the bleach loops and the benchmark use WrappedPyTwitterAPI. It shares the rate limit
+# scheduler and response validator of WrappedPyTwitterAPI but has none of the rest of it
+#
+#   - No retry policy. A 503 or a dropped connection is raised straight away
+#   - No background refresh of the access token. A 401 is raised, the caller refreshes with refresh_access_token
+#   - No ApiCallLedger, so redundant calls are neither counted nor rejected
+#   - No metrics and no on_access_token_set callback to save refreshed tokens
+#
+
+
+def _comma_separated(value):
+    if value is None or isinstance(value, str):
+        return value
+    return ",".join(value)
+
+
+class AsyncWrappedPyTwitterAPI:
+
+    BASE_URL_V2 = "https://api.twitter.com/2"
+
+    def __init__(self, client_id, access_token=None, refresh_token=None, max_connections=10, timeout=30):
+        """
+        :param client_id: Client ID of the Twitter application
+        :param access_token: Token value from Twitter OAuth2. Default None, set later with set_access_token
+        :param refresh_token: Token for getting the next access_token
+        :param max_connections: Size of the pool of keep-alive connections to the API
+        :param timeout: Total seconds a request can take
+        """
+        self.client_id = client_id
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.rate_limit_scheduler = RateLimitScheduler()
+        self.response_validator = ResponseValidator()
+
+        self._authentication_access_token = access_token
+        self._authentication_refresh_token = refresh_token
+        self._last_refresh_response = None
+
+        # Created on first use so they belong to the running event loop
+        self._session = None
+        self._authentication_lock = None
+
+        # Each asyncio task gets its own copy of the context, so this remembers the access token the current task last
+        # made a request with. Same purpose as the thread local in WrappedPyTwitterAPI
+        self._access_token_last_used = contextvars.ContextVar("access_token_last_used", default=None)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    def set_access_token(self, access_token, refresh_token=None):
+        """
+        Sets the API to use the provided access token for authenticated requests
+        :param access_token: Token value from Twitter OAuth2
+        :param refresh_token: Token for getting the next access_token
+        :return: None
+        """
+        self._authentication_access_token = access_token
+        self._authentication_refresh_token = refresh_token
+
+    async def refresh_access_token(self, refresh_token=None):
+        """
+        Use the refresh_token value to get a new temporary access token. See WrappedPyTwitterAPI.refresh_access_token
+
+        Safe to call from several tasks at once. If another task already refreshed the access token since this task
+        last made a request, the refresh is skipped and the details of that refresh are returned.
+
+        :param refresh_token: The token provided by the last successful authentication or refresh
+        :return: The new auth details, including the next refresh token
+        :raises WrappedPyTwitterAPIRefreshTokenInvalidException: If Twitter rejected the refresh token
+        :raises WrappedPyTwitterAPIConnectionException: If the connection failed or timed out
+        :raises PyTwitterError: If refresh request did not return 200 HTTP status code
+        """
+        if self._authentication_lock is None:
+            self._authentication_lock = asyncio.Lock()
+
+        async with self._authentication_lock:
+            access_token_last_used = self._access_token_last_used.get()
+            if refresh_token is None and access_token_last_used is not None \
+                    and access_token_last_used != self._authentication_access_token:
+                logging.info("Access token was already refreshed by another task")
+                return self._last_refresh_response
+
+            refresh_token_to_use = refresh_token if refresh_token is not None else self._authentication_refresh_token
+            if refresh_token_to_use is None:
+                raise WrappedPyTwitterAPIOAuth2FlowException("Can't refresh authentication. No refresh token specified")
+
+            try:
+                async with self._get_session().post(f"{self.BASE_URL_V2}/oauth2/token",
+                                                    data={
+                                                        "refresh_token": refresh_token_to_use,
+                                                        "grant_type": "refresh_token",
+                                                        "client_id": self.client_id
+                                                    }) as refresh_token_response:
+                    if refresh_token_response.status in (400, 401):
+                        # Twitter answers 400 'invalid_request' for a refresh token that was revoked, expired or
+                        # already used
+                        raise WrappedPyTwitterAPIRefreshTokenInvalidException(
+                            f"Token refresh rejected with status code '{refresh_token_response.status}'")
+                    if refresh_token_response.status != 200:
+                        raise pytwitter.PyTwitterError(
+                            f"Token refresh returned status code '{refresh_token_response.status}'")
+                    auth_details = await refresh_token_response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise WrappedPyTwitterAPIConnectionException({"status": None, "detail": str(e) or type(e).__name__})
+
+            self.set_access_token(auth_details['access_token'], auth_details.get("refresh_token", None))
+            self._last_refresh_response = auth_details
+            return auth_details
+
+    async def _request(self, url, verb="GET", params=None):
+        """
+        Make an authenticated request once the endpoint rate limit window has capacity
+        :return: JSON data of the response
+        :raises WrappedPyTwitterAPIConnectionException: If the connection failed or timed out
+        :raises PyTwitterError: The exceptions of raise_for_twitter_response
+        """
+        if self._authentication_access_token is None:
+            raise pytwitter.PyTwitterError("The AsyncWrappedPyTwitterAPI instance must be authenticated.")
+
+        endpoint = rate_limit_endpoint_key(verb, url)
+        while True:
+            wait_seconds = self.rate_limit_scheduler.reserve(endpoint)
+            if wait_seconds <= 0:
+                break
+            logging.info(f"Rate limit for '{endpoint}' exhausted. "
+                         f"Waiting {wait_seconds:.0f} seconds for window to reset")
+            await asyncio.sleep(wait_seconds)
+
+        if params is not None:
+            params = {key: str(value) for key, value in params.items() if value is not None}
+
+        access_token = self._authentication_access_token
+        self._access_token_last_used.set(access_token)
+
+        try:
+            async with self._get_session().request(verb, url, params=params,
+                                                   headers={"Authorization": f"Bearer {access_token}"}) as resp:
+                self.rate_limit_scheduler.update_from_headers(endpoint, resp.headers)
+                try:
+                    data = await resp.json(content_type=None)
+                except ValueError:
+                    raise pytwitter.PyTwitterError(f"Unknown error: {await resp.read()}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise WrappedPyTwitterAPIConnectionException({"status": None, "detail": str(e) or type(e).__name__})
+
+        if resp.status == 429:
+            reset_at = resp.headers.get("x-rate-limit-reset")
+            self.rate_limit_scheduler.mark_exhausted(endpoint, float(reset_at) if reset_at else None)
+
+        raise_for_twitter_response(resp.status, data)
+
+        if self.response_validator is not None:
+            self.response_validator.validate(endpoint, data)
+
+        return data
+
+    async def get_me(self, *, user_fields=None, expansions=None, tweet_fields=None):
+        return await self._request(f"{self.BASE_URL_V2}/users/me",
+                                   params={"user.fields": _comma_separated(user_fields),
+                                           "expansions": _comma_separated(expansions),
+                                           "tweet.fields": _comma_separated(tweet_fields)})
+
+    async def get_following(self, user_id, *, user_fields=None, expansions=None, tweet_fields=None, max_results=None,
+                            pagination_token=None):
+        return await self._request(f"{self.BASE_URL_V2}/users/{user_id}/following",
+                                   params={"user.fields": _comma_separated(user_fields),
+                                           "expansions": _comma_separated(expansions),
+                                           "tweet.fields": _comma_separated(tweet_fields),
+                                           "max_results": max_results,
+                                           "pagination_token": pagination_token})
+
+    async def get_user_liked_tweets(self, user_id, *, tweet_fields=None, user_fields=None, expansions=None,
+                                    max_results=None, pagination_token=None):
+        return await self._request(f"{self.BASE_URL_V2}/users/{user_id}/liked_tweets",
+                                   params={"tweet.fields": _comma_separated(tweet_fields),
+                                           "user.fields": _comma_separated(user_fields),
+                                           "expansions": _comma_separated(expansions),
+                                           "max_results": max_results,
+                                           "pagination_token": pagination_token})
+
+    async def get_timelines(self, user_id, *, tweet_fields=None, user_fields=None, expansions=None, exclude=None,
+                            max_results=None, pagination_token=None):
+        return await self._request(f"{self.BASE_URL_V2}/users/{user_id}/tweets",
+                                   params={"tweet.fields": _comma_separated(tweet_fields),
+                                           "user.fields": _comma_separated(user_fields),
+                                           "expansions": _comma_separated(expansions),
+                                           "exclude": _comma_separated(exclude),
+                                           "max_results": max_results,
+                                           "pagination_token": pagination_token})
+
+    async def delete_tweet(self, tweet_id):
+        return await self._request(f"{self.BASE_URL_V2}/tweets/{tweet_id}", verb="DELETE")
+
+    async def unlike_tweet(self, user_id, tweet_id):
+        return await self._request(f"{self.BASE_URL_V2}/users/{user_id}/likes/{tweet_id}", verb="DELETE")
+
+    async def unfollow_user(self, user_id, target_user_id):
+        return await self._request(f"{self.BASE_URL_V2}/users/{user_id}/following/{target_user_id}", verb="DELETE")
+
+    async def remove_retweet_tweet(self, user_id, tweet_id):
+        return await self._request(f"{self.BASE_URL_V2}/users/{user_id}/retweets/{tweet_id}", verb="DELETE")
@@ -0,0 +1,171 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import time
+import tracemalloc
+
+import requests
+
+from bleach_archive import BleachArchiveWriter
+
+from wrapped_pytwitter_api import *
+from rate_limit_scheduler import RateLimitScheduler
+from retry_policy import RetryPolicy
+from bleach_twitter_likes import *
+from bleach_twitter_tweets import *
+from bleach_twitter_follows import *
+from bleach_twitter_retweets import *
+from bleach_twitter_blocks import *
+from bleach_twitter_mutes import *
+from bleach_twitter_lists import *
+from mock_twitter_api_server import MockTwitterAccount, MockTwitterAPIConfig, make_mock_twitter_api_server, \
+    twitter_rate_limits
+
+# Throughput benchmark of the bleach loops against the local mock Twitter API
+#
+# Each bleach function is run against its own mock server holding a synthetic account. Rate limit windows are
+# shortened so a run finishes in seconds instead of hours. Results are reported both as measured and projected to
+# the real 15 min windows.
+#
+#   python benchmark_bleach.py --items 1000 --window-seconds 0.5 --bleach likes tweets follows
+#
+# Reported per bleach function
+#   items/hour          items removed per hour of wall clock time, measured and projected to 15 min windows
+#   wasted requests     requests that did not move the bleaching forward: 429, 401 and 503 responses plus writes to
+#                       items that were already gone
+#   peak memory         peak Python memory allocated by the bleach loop, from tracemalloc
+#   redundant calls     calls the ApiCallLedger flagged as not needed by the action they were made in
+#
+# The mock server runs in a separate process so its memory and CPU aren't counted against the bleach loop.
+#
+
+REAL_RATE_LIMIT_WINDOW_SECONDS = 900
+
+BENCHMARKS = {
+    "likes": (bleach_likes, lambda items: MockTwitterAccount(0, items, 0)),
+    "tweets": (bleach_tweets, lambda items: MockTwitterAccount(items, 0, 0)),
+    "follows": (bleach_follows, lambda items: MockTwitterAccount(0, 0, items)),
+    # Every fifth tweet of the mock account is a retweet
+    "retweets": (bleach_retweets, lambda items: MockTwitterAccount(items * 5, 0, 0)),
+    "blocks": (bleach_blocks, lambda items: MockTwitterAccount(0, 0, 0, blocking_count=items)),
+    "mutes": (bleach_mutes, lambda items: MockTwitterAccount(0, 0, 0, muting_count=items)),
+    "lists": (bleach_lists, lambda items: MockTwitterAccount(0, 0, 0, owned_list_count=items)),
+}
+
+
+def _serve_mock_twitter_api(bleach_name, items, config, connection):
+    server, state = make_mock_twitter_api_server(BENCHMARKS[bleach_name][1](items), config)
+    connection.send((server.server_address[1], state.issue_tokens()))
+    server.serve_forever()
+
+
+def run_benchmark(bleach_name, items, window_seconds=0.5, service_unavailable_rate=0.0,
+                  access_token_lifetime_seconds=7200, archive_path=None):
+    """
+    Run one bleach function against a mock server with a synthetic account
+
+    :param bleach_name: One of the BENCHMARKS keys
+    :param items: Number of items in the synthetic account
+    :param window_seconds: Length of the mock rate limit windows
+    :param service_unavailable_rate: Fraction of requests the mock answers with 503
+    :param access_token_lifetime_seconds: Seconds before a mock access token expires and requests get 401
+    :param archive_path: Path of an archive file to archive the removed items to. Default None, no archive
+    :return: Dictionary of results
+    """
+    config = MockTwitterAPIConfig(rate_limits=twitter_rate_limits(window_seconds=window_seconds),
+                                  service_unavailable_rate=service_unavailable_rate,
+                                  access_token_lifetime_seconds=access_token_lifetime_seconds)
+
+    parent_connection, child_connection = multiprocessing.Pipe()
+    server_process = multiprocessing.Process(target=_serve_mock_twitter_api,
+                                             args=(bleach_name, items, config, child_connection),
+                                             daemon=True)
+    server_process.start()
+    try:
+        port, auth_details = parent_connection.recv()
+        mock_url = f"http://127.0.0.1:{port}"
+
+        api = WrappedPyTwitterAPI(client_id="benchmark", oauth_flow=True)
+        api.BASE_URL_V2 = f"{mock_url}/2"
+        api.rate_limit_scheduler = RateLimitScheduler(reset_margin_seconds=min(0.05, window_seconds / 10))
+        api.retry_policy = RetryPolicy(base_delay_seconds=min(0.05, window_seconds / 10),
+                                       max_delay_seconds=window_seconds)
+        api.set_access_token(auth_details["access_token"], auth_details["refresh_token"],
+                             expires_in=auth_details["expires_in"])
+
+        bleach_function = BENCHMARKS[bleach_name][0]
+        archive_writer = BleachArchiveWriter(archive_path) if archive_path is not None else None
+
+        tracemalloc.start()
+        started = time.monotonic()
+        bleach_result = bleach_function(api, archive_writer=archive_writer)
+        elapsed = time.monotonic() - started
+        if archive_writer is not None:
+            archive_writer.close()
+        api.stop_background_refresh()
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        stats = requests.get(f"{mock_url}/mock/stats").json()
+    finally:
+        server_process.terminate()
+        server_process.join()
+
+    statuses = stats["statuses"]
+    wasted_requests = sum(statuses.get(status, 0) for status in ("429", "401", "503")) + stats["redundant_writes"]
+    items_per_hour = stats["items_removed"] / elapsed * 3600 if elapsed > 0 else 0
+
+    return {
+        "bleach": bleach_name,
+        "items": items,
+        "bleach_result": bleach_result,
+        "items_removed": stats["items_removed"],
+        "elapsed_seconds": round(elapsed, 3),
+        "items_per_hour": round(items_per_hour),
+        "projected_items_per_hour": round(items_per_hour * window_seconds / REAL_RATE_LIMIT_WINDOW_SECONDS),
+        "total_requests": sum(statuses.values()),
+        "wasted_requests": wasted_requests,
+        "statuses": statuses,
+        "requests_by_endpoint": stats["requests"],
+        "peak_memory_bytes": peak_memory,
+        "retry_metrics": api.retry_policy.metrics(),
+        "calls_by_endpoint": api.call_ledger.calls_by_endpoint(),
+        "redundant_calls": api.call_ledger.redundant_calls(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the bleach loops against a local mock Twitter API")
+    parser.add_argument("--bleach", nargs="+", choices=list(BENCHMARKS.keys()), default=list(BENCHMARKS.keys()))
+    parser.add_argument("--items", type=int, nargs="+", default=[1000],
+                        help="Synthetic account sizes to run, e.g. 1000 10000 1000000")
+    parser.add_argument("--window-seconds", type=float, default=0.5,
+                        help="Length of the mock rate limit windows. Real windows are 900 seconds")
+    parser.add_argument("--service-unavailable-rate", type=float, default=0.0)
+    parser.add_argument("--access-token-lifetime-seconds", type=float, default=7200)
+    parser.add_argument("--archive", help="Archive removed items to this file, e.g. local/benchmark.jsonl.gz")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON lines")
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    print_header = not arguments.json
+    for benchmark_items in arguments.items:
+        for benchmark_name in arguments.bleach:
+            result = run_benchmark(benchmark_name, benchmark_items,
+                                   window_seconds=arguments.window_seconds,
+                                   service_unavailable_rate=arguments.service_unavailable_rate,
+                                   access_token_lifetime_seconds=arguments.access_token_lifetime_seconds,
+                                   archive_path=arguments.archive)
+            if arguments.json:
+                print(json.dumps(result))
+                continue
+            if print_header:
+                print(f"{'bleach':<8} {'items':>8} {'removed':>8} {'seconds':>9} {'items/hour':>11} "
+                      f"{'proj/hour':>9} {'requests':>9} {'wasted':>7} {'peak MB':>8}")
+                print_header = False
+            print(f"{result['bleach']:<8} {result['items']:>8} {result['items_removed']:>8} "
+                  f"{result['elapsed_seconds']:>9.2f} {result['items_per_hour']:>11} "
+                  f"{result['projected_items_per_hour']:>9} {result['total_requests']:>9} "
+                  f"{result['wasted_requests']:>7} {result['peak_memory_bytes'] / 1024 / 1024:>8.2f}")
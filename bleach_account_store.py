@@ -0,0 +1,189 @@
+import os
+import sqlite3
+import threading
+import time
+
+import cryptography.fernet
+
+# Stored credentials of the Twitter accounts to bleach
+#
+# Each account is authorized once, interactively, and its tokens are saved here. Twitter hands out a new refresh
+# token with every refresh and the old one stops working, so the tokens are saved again every time the API object
+# refreshes them. An account can then be bleached later, or alongside many others, without logging in again.
+#
+# The tokens give full access to the account until they are revoked, so they are encrypted with Fernet before they
+# are written to disk. The key is kept apart from the database, in its own file or in an environment variable.
+#
+
+# Environment variable holding the Fernet key. Takes precedence over the key file
+TOKEN_KEY_ENVIRONMENT_VARIABLE = "TWITTER_BLEACH_TOKEN_KEY"
+
+_account_schema = """
+CREATE TABLE IF NOT EXISTS accounts (
+    account_name TEXT NOT NULL PRIMARY KEY,
+    client_id TEXT NOT NULL,
+    access_token TEXT NOT NULL,
+    refresh_token TEXT,
+    expires_at REAL
+);
+"""
+
+
+class BleachAccountStoreDecryptException(Exception):
+    pass
+
+
+def load_or_create_token_key(key_file_name):
+    """
+    Key to encrypt the stored tokens with. Taken from the TWITTER_BLEACH_TOKEN_KEY environment variable if it is set,
+    otherwise read from the key file. A new key is generated and written to the file, readable only by the owner, if
+    the file doesn't exist yet
+
+    :param key_file_name: Path of the key file
+    :return: Fernet key as bytes
+    """
+    environment_key = os.environ.get(TOKEN_KEY_ENVIRONMENT_VARIABLE)
+    if environment_key:
+        return environment_key.encode()
+
+    if os.path.exists(key_file_name):
+        with open(key_file_name, "rb") as key_file:
+            return key_file.read().strip()
+
+    key = cryptography.fernet.Fernet.generate_key()
+    key_file_descriptor = os.open(key_file_name, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(key_file_descriptor, "wb") as key_file:
+        key_file.write(key)
+    return key
+
+
+class BleachAccount:
+    """
+    Credentials of one stored account
+    """
+
+    def __init__(self, store, account_name, client_id, access_token, refresh_token=None, expires_at=None):
+        self.store = store
+        self.account_name = account_name
+        self.client_id = client_id
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.expires_at = expires_at
+
+    @property
+    def expires_in(self):
+        """
+        :return: Seconds until the access token expires, None if unknown. Negative if it has already expired
+        """
+        if self.expires_at is None:
+            return None
+        return self.expires_at - time.time()
+
+    def save_tokens(self, access_token, refresh_token=None, expires_at=None):
+        """
+        Record new tokens for the account, e.g. after a refresh
+
+        :param access_token: Token value from Twitter OAuth2
+        :param refresh_token: Token for getting the next access_token
+        :param expires_at: Epoch time the access token expires. Default None, unknown
+        :return: None
+        """
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.expires_at = expires_at
+        self.store._execute("UPDATE accounts SET access_token = ?, refresh_token = ?, expires_at = ? "
+                            "WHERE account_name = ?",
+                            (self.store._encrypt(access_token), self.store._encrypt(refresh_token), expires_at,
+                             self.account_name),
+                            commit=True)
+
+
+class BleachAccountStore:
+    """
+    SQLite backed store of account credentials. Tokens are stored encrypted. Can be shared between threads.
+    """
+
+    def __init__(self, database_path=":memory:", encryption_key=None):
+        """
+        :param database_path: Path of the SQLite file. Default is ':memory:', which keeps accounts only for the life
+        of the process
+        :param encryption_key: Fernet key to encrypt the tokens with, see load_or_create_token_key. Default None, a
+        new key for the life of the process
+        """
+        self.database_path = database_path
+        self._fernet = cryptography.fernet.Fernet(encryption_key if encryption_key is not None
+                                                  else cryptography.fernet.Fernet.generate_key())
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(database_path, check_same_thread=False)
+        self._connection.executescript(_account_schema)
+        self._connection.commit()
+
+    def _execute(self, sql, parameters=(), commit=False):
+        with self._lock:
+            rows = self._connection.execute(sql, parameters).fetchall()
+            if commit:
+                self._connection.commit()
+            return rows
+
+    def _encrypt(self, token):
+        if token is None:
+            return None
+        return self._fernet.encrypt(token.encode()).decode()
+
+    def _decrypt(self, encrypted_token):
+        if encrypted_token is None:
+            return None
+        try:
+            return self._fernet.decrypt(encrypted_token.encode()).decode()
+        except cryptography.fernet.InvalidToken:
+            raise BleachAccountStoreDecryptException("Stored token can't be decrypted. The key doesn't match the one "
+                                                     "the account was saved with, authorize the account again")
+
+    def _account_from_row(self, row):
+        account_name, client_id, access_token, refresh_token, expires_at = row
+        return BleachAccount(self, account_name, client_id, self._decrypt(access_token), self._decrypt(refresh_token),
+                             expires_at)
+
+    def save_account(self, account_name, client_id, access_token, refresh_token=None, expires_at=None):
+        """
+        Add an account or replace its credentials
+
+        :param account_name: Name to know the account by, e.g. the Twitter username
+        :param client_id: Client ID of the Twitter application the account authorized
+        :param access_token: Token value from Twitter OAuth2
+        :param refresh_token: Token for getting the next access_token
+        :param expires_at: Epoch time the access token expires. Default None, unknown
+        :return: BleachAccount
+        """
+        self._execute("INSERT OR REPLACE INTO accounts (account_name, client_id, access_token, refresh_token, "
+                      "expires_at) VALUES (?, ?, ?, ?, ?)",
+                      (account_name, client_id, self._encrypt(access_token), self._encrypt(refresh_token),
+                       expires_at),
+                      commit=True)
+        return BleachAccount(self, account_name, client_id, access_token, refresh_token, expires_at)
+
+    def remove_account(self, account_name):
+        self._execute("DELETE FROM accounts WHERE account_name = ?", (account_name,), commit=True)
+
+    def account(self, account_name):
+        """
+        :param account_name: Name the account was saved with
+        :return: BleachAccount, None if there is no account with the name
+        :raises BleachAccountStoreDecryptException: If the tokens were saved with a different key
+        """
+        rows = self._execute("SELECT account_name, client_id, access_token, refresh_token, expires_at FROM accounts "
+                             "WHERE account_name = ?", (account_name,))
+        return self._account_from_row(rows[0]) if rows else None
+
+    def accounts(self):
+        """
+        :return: List of every stored BleachAccount, ordered by name
+        :raises BleachAccountStoreDecryptException: If the tokens were saved with a different key
+        """
+        rows = self._execute("SELECT account_name, client_id, access_token, refresh_token, expires_at FROM accounts "
+                             "ORDER BY account_name")
+        return [self._account_from_row(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
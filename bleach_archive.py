@@ -0,0 +1,257 @@
+import datetime
+import gzip
+import json
+import os
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Append only archive of the tweets, likes and follows removed by the bleach loops
+#
+# One JSON object per line, optionally compressed with gzip or zstd. Each line holds the bleach type, the Twitter ID
+# of the account, the time it was archived and the item as the API or Twitter archive returned it
+#
+#   {"bleach_type": "tweets", "user_id": "2244994945", "archived_at": "2022-02-10T21:04:11+00:00", "item": {...}}
+#
+# Lines are buffered in memory and written in batches. commit writes the buffer out and fsyncs the file. The bleach
+# loops commit the archive before recording the items as done in the checkpoint, see BleachWorkQueue.commit, so an
+# item is never recorded as done without its archive line on disk. If the process dies between the two, the items are
+# done again on the next run and archived a second time. Readers should de-duplicate on the item ID.
+#
+# A compressed archive gets a new gzip member or zstd frame on every commit, so everything committed is in complete
+# members. A crash can only cut short the member of the lines written since the last commit, whose items aren't
+# recorded as done. read_archive skips a member that was cut short, and anything after it up to the next member a
+# later run appended, instead of failing on it.
+#
+
+ARCHIVE_COMPRESSION_GZIP = "gzip"
+ARCHIVE_COMPRESSION_ZSTD = "zstd"
+
+# Buffered lines are written out once they reach this many bytes, even if commit hasn't been called
+DEFAULT_ARCHIVE_BUFFER_BYTES = 256 * 1024
+
+# Bytes read from the archive file at a time
+ARCHIVE_READ_CHUNK_BYTES = 64 * 1024
+
+# Bytes a gzip member and a zstd frame start with
+_GZIP_MEMBER_MAGIC = b"\x1f\x8b\x08"
+_ZSTD_FRAME_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+class BleachArchiveException(Exception):
+    pass
+
+
+def archive_compression_for_path(path):
+    """
+    :param path: Path of the archive file
+    :return: ARCHIVE_COMPRESSION_ constant for a '.gz' or '.zst' extension, None for no compression
+    """
+    if path.endswith(".gz"):
+        return ARCHIVE_COMPRESSION_GZIP
+    if path.endswith(".zst"):
+        return ARCHIVE_COMPRESSION_ZSTD
+    return None
+
+
+class BleachArchiveWriter:
+    """
+    Writes archive lines to a file. Thread safe, one writer can be shared by bleach loops running at the same time.
+    """
+
+    def __init__(self, path, compression=None, buffer_bytes=DEFAULT_ARCHIVE_BUFFER_BYTES):
+        """
+        :param path: Path of the archive file. Appended to if it exists
+        :param compression: One of the ARCHIVE_COMPRESSION_ constants. Default None, which picks the compression from
+        the extension of the path, see archive_compression_for_path
+        :param buffer_bytes: Bytes of lines buffered before they are written out
+        :raises BleachArchiveException: If zstd compression is asked for and the zstandard package isn't installed
+        """
+        self.path = path
+        self.compression = compression if compression is not None else archive_compression_for_path(path)
+        self.buffer_bytes = buffer_bytes
+
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._buffered_bytes = 0
+        self.archived_count = 0
+
+        if self.compression == ARCHIVE_COMPRESSION_ZSTD and zstandard is None:
+            raise BleachArchiveException("zstd compression needs the zstandard package, pip install zstandard")
+
+        if self.compression not in (ARCHIVE_COMPRESSION_GZIP, ARCHIVE_COMPRESSION_ZSTD, None):
+            raise BleachArchiveException(f"Unknown archive compression '{self.compression}'")
+
+        self._file = open(path, "ab")
+        if self.compression is None and self._file.tell() > 0:
+            with open(path, "rb") as existing_file:
+                existing_file.seek(-1, os.SEEK_END)
+                if existing_file.read(1) != b"\n":
+                    # The last line was cut short by a crash. Don't join the next line on to it
+                    self._file.write(b"\n")
+        # Stream of the member or frame being written. Started by the first write after a commit
+        self._stream = None
+
+    def write(self, bleach_type, user_id, item):
+        """
+        Buffer the archive line of an item
+
+        :param bleach_type: One of the BLEACH_TYPE_ values
+        :param user_id: Twitter ID of the user being bleached
+        :param item: Item dictionary from the API or Twitter archive
+        :return: None
+        """
+        line = json.dumps({"bleach_type": bleach_type,
+                           "user_id": user_id,
+                           "archived_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+                           "item": item}, separators=(",", ":")).encode() + b"\n"
+        with self._lock:
+            self._buffer.append(line)
+            self._buffered_bytes += len(line)
+            self.archived_count += 1
+            if self._buffered_bytes >= self.buffer_bytes:
+                self._write_buffer()
+
+    def _start_stream(self):
+        if self.compression == ARCHIVE_COMPRESSION_GZIP:
+            return gzip.GzipFile(fileobj=self._file, mode="ab")
+        if self.compression == ARCHIVE_COMPRESSION_ZSTD:
+            # The checksum lets read_archive tell a frame cut short by a crash from a complete one
+            return zstandard.ZstdCompressor(write_checksum=True).stream_writer(self._file, closefd=False)
+        return self._file
+
+    def _end_stream(self):
+        if self._stream is not None and self._stream is not self._file:
+            # Writes the end of the gzip member or zstd frame. The file itself is left open
+            self._stream.close()
+        self._stream = None
+
+    def _write_buffer(self):
+        if self._buffer:
+            if self._stream is None:
+                self._stream = self._start_stream()
+            self._stream.write(b"".join(self._buffer))
+            self._buffer = []
+            self._buffered_bytes = 0
+
+    def commit(self):
+        """
+        Write out the buffered lines, end the gzip member or zstd frame and fsync the file so they survive a crash and
+        can be read back
+        :return: None
+        """
+        with self._lock:
+            self._write_buffer()
+            self._end_stream()
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self.commit()
+        with self._lock:
+            self._file.close()
+
+
+def _complete_members(archive_file, make_decompressor, member_magic, decompress_errors):
+    """
+    Decompress a file of gzip members or zstd frames. The output of a member is only given once all of it has been
+    read and checked, so a member cut short by a crash is skipped along with anything up to the start of the next one
+
+    :param archive_file: File opened for reading bytes
+    :param make_decompressor: Function returning a decompressor for one member, with decompress, eof and unused_data
+    :param member_magic: Bytes every member starts with
+    :param decompress_errors: Exceptions the decompressor raises for data that isn't a valid member
+    :return: Generator of the decompressed bytes of each complete member
+    """
+    # Bytes of the file from the start of the member being decompressed, kept to look for the next member in if it
+    # turns out to be cut short
+    member = bytearray()
+    decompressor = None
+    fed_bytes = 0
+    output = []
+    while True:
+        chunk = archive_file.read(ARCHIVE_READ_CHUNK_BYTES)
+        member += chunk
+        while True:
+            if decompressor is None:
+                start = member.find(member_magic)
+                if start < 0:
+                    # Keep the bytes that could be the beginning of the next member
+                    del member[:-(len(member_magic) - 1)]
+                    break
+                del member[:start]
+                decompressor, fed_bytes, output = make_decompressor(), 0, []
+            if fed_bytes == len(member):
+                if chunk:
+                    break
+                # The file ended part way through the member. It was cut short, and the decompressor may have taken
+                # the members appended after it for the rest of it. Look for the next member after its start
+                decompressor = None
+                del member[:1]
+                continue
+            try:
+                output.append(decompressor.decompress(member[fed_bytes:]))
+            except decompress_errors:
+                # Cut short and followed by another member. Look for its start after the start of this one
+                decompressor = None
+                del member[:1]
+                continue
+            fed_bytes = len(member)
+            if decompressor.eof:
+                yield b"".join(output)
+                member = bytearray(decompressor.unused_data)
+                decompressor = None
+        if not chunk:
+            return
+
+
+def read_archive(path, compression=None):
+    """
+    Read back the lines of an archive
+
+    :param path: Path of the archive file
+    :param compression: One of the ARCHIVE_COMPRESSION_ constants. Default None, which picks the compression from the
+    extension of the path
+    :return: Generator of the archive line dictionaries. Lines cut short by a crash are left out
+    """
+    compression = compression if compression is not None else archive_compression_for_path(path)
+    if compression == ARCHIVE_COMPRESSION_ZSTD and zstandard is None:
+        raise BleachArchiveException("zstd compression needs the zstandard package, pip install zstandard")
+
+    with open(path, "rb") as archive_file:
+        if compression == ARCHIVE_COMPRESSION_GZIP:
+            chunks = _complete_members(archive_file, lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+                                       _GZIP_MEMBER_MAGIC, (zlib.error,))
+        elif compression == ARCHIVE_COMPRESSION_ZSTD:
+            chunks = _complete_members(archive_file, lambda: zstandard.ZstdDecompressor().decompressobj(),
+                                       _ZSTD_FRAME_MAGIC, (zstandard.ZstdError,))
+        else:
+            chunks = iter(lambda: archive_file.read(ARCHIVE_READ_CHUNK_BYTES), b"")
+
+        pending = b""
+        for chunk in chunks:
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                archive_line = _parse_archive_line(line)
+                if archive_line is not None:
+                    yield archive_line
+        archive_line = _parse_archive_line(pending)
+        if archive_line is not None:
+            yield archive_line
+
+
+def _parse_archive_line(line):
+    """
+    :return: The archive line dictionary, None for an empty line or one cut short by a crash
+    """
+    if not line.strip():
+        return None
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError:
+        return None
@@ -0,0 +1,226 @@
+import json
+import sqlite3
+import threading
+
+# Durable progress for the bleach loops so a run can pick up where the last one left off
+#
+# For each kind of bleaching and each Twitter user the store keeps
+#   - the pagination token of the next page to fetch
+#   - the IDs of items that have already been processed
+#   - items that were fetched but not processed yet, e.g. because of a rate limit
+#   - whether the last run went through every page, so a scheduler can tell a run that needs resuming from one that
+#     finished
+#
+# Changes are committed straight away, except that the bleach loops record the items they have done a page at a
+# time, after the archive of those items has been written, see BleachWorkQueue.commit. If the process dies the worst
+# case is the items done since the last commit are processed again.
+#
+
+BLEACH_TYPE_LIKES = "likes"
+BLEACH_TYPE_TWEETS = "tweets"
+BLEACH_TYPE_FOLLOWS = "follows"
+BLEACH_TYPE_RETWEETS = "retweets"
+BLEACH_TYPE_BLOCKS = "blocks"
+BLEACH_TYPE_MUTES = "mutes"
+BLEACH_TYPE_LISTS = "lists"
+
+_checkpoint_schema = """
+CREATE TABLE IF NOT EXISTS pagination (
+    bleach_type TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    next_token TEXT,
+    PRIMARY KEY (bleach_type, user_id)
+);
+CREATE TABLE IF NOT EXISTS processed_items (
+    bleach_type TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    PRIMARY KEY (bleach_type, user_id, item_id)
+);
+CREATE TABLE IF NOT EXISTS pending_items (
+    bleach_type TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    item_json TEXT NOT NULL,
+    PRIMARY KEY (bleach_type, user_id, item_id)
+);
+CREATE TABLE IF NOT EXISTS run_state (
+    bleach_type TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    finished INTEGER NOT NULL,
+    PRIMARY KEY (bleach_type, user_id)
+);
+"""
+
+
+class BleachCheckpointStore:
+    """
+    SQLite backed store of bleach progress. One store can hold the progress of several users and bleach types and
+    can be shared between threads.
+    """
+
+    def __init__(self, database_path=":memory:"):
+        """
+        :param database_path: Path of the SQLite file. Default is ':memory:', which keeps progress only for the life
+        of the process
+        """
+        self.database_path = database_path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(database_path, check_same_thread=False)
+        self._connection.executescript(_checkpoint_schema)
+        self._connection.commit()
+
+    def checkpoint(self, bleach_type, user_id):
+        """
+        :param bleach_type: One of the BLEACH_TYPE_ values
+        :param user_id: Twitter ID of the user being bleached
+        :return: BleachCheckpoint for the bleach type and user
+        """
+        return BleachCheckpoint(self, bleach_type, user_id)
+
+    def progress(self):
+        """
+        :return: List of (user_id, bleach_type, processed count, pending count, finished) tuples, one for every user
+        and bleach type with any progress recorded. finished is None if no run has recorded it
+        """
+        processed = {(user_id, bleach_type): count for user_id, bleach_type, count in self._execute(
+            "SELECT user_id, bleach_type, COUNT(*) FROM processed_items GROUP BY user_id, bleach_type")}
+        pending = {(user_id, bleach_type): count for user_id, bleach_type, count in self._execute(
+            "SELECT user_id, bleach_type, COUNT(*) FROM pending_items GROUP BY user_id, bleach_type")}
+        finished = {(user_id, bleach_type): bool(run_finished) for user_id, bleach_type, run_finished in self._execute(
+            "SELECT user_id, bleach_type, finished FROM run_state")}
+        return [(user_id, bleach_type, processed.get((user_id, bleach_type), 0), pending.get((user_id, bleach_type), 0),
+                 finished.get((user_id, bleach_type)))
+                for user_id, bleach_type in sorted(set(processed) | set(pending) | set(finished))]
+
+    def unfinished_bleach_types(self, user_id=None):
+        """
+        :param user_id: Twitter ID of the user. Default None, any user
+        :return: Set of the bleach types whose last run stopped before going through every page, or that have pending
+        items
+        """
+        return {bleach_type for progress_user_id, bleach_type, _, pending_count, finished in self.progress()
+                if (user_id is None or progress_user_id == user_id) and (finished is False or pending_count > 0)}
+
+    def _execute(self, sql, parameters=(), commit=False):
+        with self._lock:
+            rows = self._connection.execute(sql, parameters).fetchall()
+            if commit:
+                self._connection.commit()
+            return rows
+
+    def _execute_many(self, statements):
+        with self._lock:
+            with self._connection:
+                for sql, parameters in statements:
+                    self._connection.execute(sql, parameters)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class BleachCheckpoint:
+    """
+    Progress of one bleach type for one user
+    """
+
+    def __init__(self, store, bleach_type, user_id):
+        self.store = store
+        self.bleach_type = bleach_type
+        self.user_id = user_id
+
+    @property
+    def pagination_token(self):
+        """
+        :return: Pagination token of the next page to fetch, None to start from the first page
+        """
+        rows = self.store._execute("SELECT next_token FROM pagination WHERE bleach_type = ? AND user_id = ?",
+                                   (self.bleach_type, self.user_id))
+        return rows[0][0] if rows else None
+
+    def save_pagination_token(self, next_token):
+        """
+        Record the pagination token of the next page. Call once every item of the current page has been processed or
+        added to the pending items
+
+        :param next_token: Token from the 'meta' of the page. None when the last page is done
+        :return: None
+        """
+        self.store._execute("INSERT OR REPLACE INTO pagination (bleach_type, user_id, next_token) VALUES (?, ?, ?)",
+                            (self.bleach_type, self.user_id, next_token),
+                            commit=True)
+
+    @property
+    def finished(self):
+        """
+        :return: True if the last run went through every page, False if it stopped before the end, None if no run has
+        been recorded
+        """
+        rows = self.store._execute("SELECT finished FROM run_state WHERE bleach_type = ? AND user_id = ?",
+                                   (self.bleach_type, self.user_id))
+        return bool(rows[0][0]) if rows else None
+
+    def save_finished(self, finished):
+        """
+        :param finished: False when a run starts, True once it has gone through every page
+        :return: None
+        """
+        self.store._execute("INSERT OR REPLACE INTO run_state (bleach_type, user_id, finished) VALUES (?, ?, ?)",
+                            (self.bleach_type, self.user_id, int(finished)),
+                            commit=True)
+
+    def is_processed(self, item_id):
+        rows = self.store._execute("SELECT 1 FROM processed_items WHERE bleach_type = ? AND user_id = ? AND item_id = ?",
+                                   (self.bleach_type, self.user_id, item_id))
+        return len(rows) > 0
+
+    def mark_processed(self, item_id):
+        """
+        Record the item as done and remove it from the pending items
+
+        :param item_id: Twitter ID of the tweet or user that was processed
+        :return: None
+        """
+        self.mark_processed_batch([item_id])
+
+    def mark_processed_batch(self, item_ids):
+        """
+        Record several items as done and remove them from the pending items, in a single transaction
+
+        :param item_ids: Twitter IDs of the tweets or users that were processed
+        :return: None
+        """
+        statements = []
+        for item_id in item_ids:
+            key = (self.bleach_type, self.user_id, item_id)
+            statements.append(("INSERT OR IGNORE INTO processed_items (bleach_type, user_id, item_id) VALUES (?, ?, ?)",
+                               key))
+            statements.append(("DELETE FROM pending_items WHERE bleach_type = ? AND user_id = ? AND item_id = ?", key))
+        if statements:
+            self.store._execute_many(statements)
+
+    def add_pending(self, item):
+        """
+        Record an item that still needs to be processed
+
+        :param item: Item dictionary from the API, must have an 'id' key
+        :return: None
+        """
+        self.store._execute("INSERT OR REPLACE INTO pending_items (bleach_type, user_id, item_id, item_json) "
+                            "VALUES (?, ?, ?, ?)",
+                            (self.bleach_type, self.user_id, item["id"], json.dumps(item)),
+                            commit=True)
+
+    def pending_items(self):
+        """
+        :return: List of item dictionaries waiting to be processed
+        """
+        rows = self.store._execute("SELECT item_json FROM pending_items WHERE bleach_type = ? AND user_id = ?",
+                                   (self.bleach_type, self.user_id))
+        return [json.loads(row[0]) for row in rows]
+
+    def processed_count(self):
+        rows = self.store._execute("SELECT COUNT(*) FROM processed_items WHERE bleach_type = ? AND user_id = ?",
+                                   (self.bleach_type, self.user_id))
+        return rows[0][0]
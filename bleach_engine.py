@@ -0,0 +1,338 @@
+import abc
+import logging
+
+from wrapped_pytwitter_api import *
+from twitter_archive_import import ArchivePager, is_archive_pagination_token
+from bleach_checkpoint import BleachCheckpointStore
+from bleach_work_queue import BleachWorkQueue
+from page_prefetcher import PagePrefetcher, fetch_page_with_retries
+from bleach_planner import plan_bleach
+from bleach_existence_check import ItemExistenceCheck
+from bleach_metrics import metrics_user_fields, start_bleach_metrics
+from bleach_logging import hot_path_log
+
+# The bleach loop shared by every kind of bleaching
+#
+# A BleachPlugin says how to list one kind of item, e.g. the liked tweets or the blocked users, and how to remove one
+# of them. Everything else is done the same way for every kind by run_bleach_plugin
+#   - the pages are fetched in the background while the items of the current page are removed, see PagePrefetcher
+#   - items are filtered by the bleach rule, queued, de-duplicated and checkpointed, see BleachWorkQueue
+#   - queued items that no longer exist are dropped before a write request is spent on them, see ItemExistenceCheck
+#   - removals are paced by the rate limit scheduler and retried by the API object, a 429 defers the item
+#   - an expired access token is refreshed, a 503 that outlasts the retries stops the run with the checkpoint intact
+#   - removed items are archived and counted in the call ledger and the metrics
+#   - an item the plugin can't remove, see BleachItemSkippedException, is logged and left for a later run
+#
+# Items can come from a downloaded Twitter archive instead of the API for the kinds the archive has a file for.
+#
+# plan_bleach_plugin walks the first pages and counts the calls a run would make, see bleach_planner.py
+#
+
+
+class BleachItemSkippedException(Exception):
+    """
+    Raised by BleachPlugin.remove for an item it can't make the API call for, e.g. a retweet without the ID of the
+    tweet it retweeted. The item isn't counted, archived or recorded as done
+    """
+    pass
+
+
+class BleachPlugin(abc.ABC):
+    """
+    One kind of bleaching. Subclasses set the class attributes and implement list_page, action and remove
+    """
+
+    # One of the BLEACH_TYPE_ values. The checkpoint, archive lines and metrics are keyed by it
+    bleach_type = None
+
+    # Endpoint key of the paginated endpoint list_page reads
+    list_endpoint = None
+
+    # Most items list_page returns in a page. The work queue has room for a page on top of the pending items
+    page_size = 100
+
+    # Count in the public_metrics of the account of the items list_page pages through, e.g. 'like_count'. The plan
+    # estimates from it when it doesn't read every page. None if there is no count
+    listed_items_public_metric = None
+
+    # Items per page read from a downloaded archive
+    archive_page_size = 100
+
+    # Function of twitter_archive_import reading the items from a downloaded archive file. None if the archive has none
+    archived_items = None
+
+    # EXISTENCE_LOOKUP_ constant the queued items are looked up with. None if there is no lookup for the items
+    existence_lookup = None
+
+    # Name of the items in log lines
+    item_name = "items"
+
+    # BleachRule every item removed has to match whatever the rule of the run, e.g. only the retweets of a timeline.
+    # None for every item listed
+    item_rule = None
+
+    def me_user_fields(self, bleach_rule):
+        """
+        :param bleach_rule: BleachRule of the run, None for no rule
+        :return: user_fields for get_me the plugin needs, None for none
+        """
+        return None
+
+    def rule_context(self, twitter_me):
+        """
+        :param twitter_me: get_me response JSON
+        :return: Context for BleachRule.compile
+        """
+        return None
+
+    @abc.abstractmethod
+    def list_page(self, api, twitter_user_id, bleach_rule, pagination_token):
+        """
+        :param api: WrappedPyTwitterAPI
+        :param twitter_user_id: Twitter ID of the account being bleached
+        :param bleach_rule: BleachRule of the run, None for no rule. Its fields should be asked for
+        :param pagination_token: Token of the page. None for the first page
+        :return: Page JSON dictionary with the items in 'data' and the next token in 'meta'
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def action(self, item):
+        """
+        :param item: Item dictionary
+        :return: ACTION_ constant of api_call_ledger that removes the item
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def remove(self, api, twitter_user_id, item, action):
+        """
+        Make the API call that removes the item
+
+        :param api: WrappedPyTwitterAPI
+        :param twitter_user_id: Twitter ID of the account being bleached
+        :param item: Item dictionary
+        :param action: ACTION_ constant returned by action for the item
+        :return: Response JSON
+        :raises BleachItemSkippedException: If the item can't be removed
+        """
+        raise NotImplementedError()
+
+
+def _run_rule(plugin, bleach_rule):
+    if plugin.item_rule is None:
+        return bleach_rule
+    if bleach_rule is None:
+        return plugin.item_rule
+    return plugin.item_rule & bleach_rule
+
+
+def _page_source(api, plugin, twitter_user_id, bleach_rule, pagination_token, twitter_archive_js_file):
+    """
+    :return: Tuple of (fetch_page function, pagination token to start from, ArchivePager or None)
+    """
+    if twitter_archive_js_file is not None:
+        if plugin.archived_items is None:
+            raise ValueError(f"A downloaded Twitter archive has no {plugin.item_name} to bleach")
+        archive_pager = ArchivePager(plugin.archived_items, twitter_archive_js_file,
+                                     page_size=plugin.archive_page_size)
+        return archive_pager.get_page, pagination_token, archive_pager
+
+    if is_archive_pagination_token(pagination_token):
+        # The checkpoint is from a run that used an archive. The API has to start from its first page
+        pagination_token = None
+
+    def fetch_page(page_pagination_token):
+        return plugin.list_page(api, twitter_user_id, bleach_rule, page_pagination_token)
+
+    return fetch_page, pagination_token, None
+
+
+def run_bleach_plugin(api, plugin, item_limit=None, archive_writer=None, checkpoint_store=None,
+                      twitter_archive_js_file=None, bleach_rule=None, existence_cache=None,
+                      _dont_actually_bleach=False):
+    """
+    Remove the items of one kind from the account
+
+    :param api: Instance of an authenticated pytwitter2 WrappedPyTwitterAPI
+    :param plugin: BleachPlugin of the kind of items
+    :param item_limit: Most items to remove. Default is None, which removes all
+    :param archive_writer: BleachArchiveWriter to archive the removed items to. Default is None, which is no archive
+    :param checkpoint_store: BleachCheckpointStore to resume from and record progress in. Default is None, which keeps
+    progress in memory for this run only
+    :param twitter_archive_js_file: Path to the file of a downloaded Twitter archive to take the items from instead of
+    paging through the API. Default is None, which uses the API
+    :param bleach_rule: BleachRule choosing the items to remove. Default is None, which removes all
+    :param existence_cache: ItemExistenceCache to look up queued items with before removing them, so the ones already
+    gone don't use up write requests. Default is None, no lookups
+    :param _dont_actually_bleach: boolean to not actually make the API calls that remove items. For testing. Default
+    False
+    :return: Number of items removed
+    """
+
+    bleach_rule = _run_rule(plugin, bleach_rule)
+    twitter_me = api.get_me(return_json=True, user_fields=metrics_user_fields(api, plugin.me_user_fields(bleach_rule)))
+    twitter_user_id = twitter_me["data"]["id"]
+    start_bleach_metrics(api, plugin.bleach_type, twitter_me)
+
+    item_matches = bleach_rule.compile(plugin.rule_context(twitter_me)) if bleach_rule is not None else None
+
+    if checkpoint_store is None:
+        checkpoint_store = BleachCheckpointStore()
+    checkpoint = checkpoint_store.checkpoint(plugin.bleach_type, twitter_user_id)
+    checkpoint.save_finished(False)
+
+    total_items_removed = 0
+    items_to_do = BleachWorkQueue(checkpoint, max_queued_items=max(plugin.page_size, plugin.archive_page_size),
+                                  archive_writer=archive_writer)
+    existence_check = None
+    if existence_cache is not None and plugin.existence_lookup is not None:
+        existence_check = ItemExistenceCheck(api, plugin.existence_lookup, existence_cache)
+
+    fetch_page, pagination_token, archive_pager = _page_source(api, plugin, twitter_user_id, bleach_rule,
+                                                               checkpoint.pagination_token, twitter_archive_js_file)
+
+    # The next pages are fetched in the background while the items of the current page are removed
+    pages = PagePrefetcher(api, fetch_page, pagination_token)
+
+    try:
+        page = None
+        while item_limit is None or total_items_removed <= item_limit:
+            try:
+                if page is None:
+                    page = pages.next_page()
+                    if page is None:
+                        # Every page has been fetched. Finish the items still to do
+                        page = {"data": [], "meta": {}}
+
+                    listed_items = page.get("data", [])
+                    items = listed_items
+                    if item_matches is not None:
+                        items = [item for item in items if item_matches(item)]
+                    items_queued = items_to_do.add_page(items)
+                    if existence_check is not None:
+                        existence_check.drop_gone(items_to_do,
+                                                  listed_items=listed_items if archive_pager is None else ())
+
+                    logging.debug("User '%s' %s from API %s, matching %s, new to do %s, to do in total %s",
+                                  twitter_user_id, plugin.item_name, len(listed_items), len(items), items_queued,
+                                  len(items_to_do), extra={"bleach_type": plugin.bleach_type})
+
+                item_limit_reached = False
+                while True:
+                    if item_limit is not None and total_items_removed >= item_limit:
+                        item_limit_reached = True
+                        break
+
+                    item = items_to_do.peek()
+                    if item is None:
+                        break
+
+                    try:
+                        if not _dont_actually_bleach:
+                            action = plugin.action(item)
+                            with api.call_ledger.action(action, item["id"]):
+                                response = plugin.remove(api, twitter_user_id, item, action)
+                            hot_path_log.debug("Response to %s of '%s'", action, response,
+                                               extra={"bleach_type": plugin.bleach_type, "item_id": item["id"]})
+                            items_to_do.complete(item["id"])
+                        else:
+                            items_to_do.discard(item["id"])
+                        total_items_removed += 1
+                        if api.metrics is not None:
+                            api.metrics.record_items(plugin.bleach_type)
+
+                    except BleachItemSkippedException as e:
+                        items_to_do.discard(item["id"])
+                        hot_path_log.warning("Skipped %s '%s'. %s", plugin.item_name, item["id"], e,
+                                             extra={"bleach_type": plugin.bleach_type, "item_id": item["id"]})
+                        continue
+                    except WrappedPyTwitterAPIRateLimitExceededException:
+                        # NOTE The write endpoints have a rate limit of 50 requests per 15 min window
+                        items_to_do.defer(item)
+                        # The API scheduler will hold the next removal until the rate limit window resets
+                        hot_path_log.info("Rate limit exceeded removing %s. Waiting for window to reset. "
+                                          "Removed so far %s", plugin.item_name, total_items_removed,
+                                          extra={"bleach_type": plugin.bleach_type, "item_id": item["id"],
+                                                 "status": 429})
+                        continue
+
+                if item_limit_reached:
+                    # Leave the checkpoint on this page so the next run picks up the items not done yet
+                    break
+
+                if 'next_token' not in page.get('meta', {}):
+                    items_to_do.commit()
+                    checkpoint.save_pagination_token(None)
+                    checkpoint.save_finished(True)
+                    break
+
+                pagination_token = page['meta']['next_token']
+                items_to_do.commit()
+                checkpoint.save_pagination_token(pagination_token)
+                page = None
+
+            except WrappedPyTwitterAPIUnauthorizedException:
+                # The page is kept, its items still to do are finished before the next page is fetched so the queue
+                # never holds more than a page on top of the pending items
+                logging.info("Authentication failed. Access token may have expired")
+                api.refresh_access_token()
+                continue
+            except WrappedPyTwitterAPIServiceUnavailableException as sue:
+                # The API object has already retried the request with backoff. The checkpoint keeps the pagination
+                # cursor and the pending items so the next run carries on from here
+                logging.info("API service unavailable after retrying '{}'. Bailing.".format(sue.message))
+                break
+            except pytwitter.error.PyTwitterError as ptw:
+                logging.fatal("PyTwitterError bleaching {} with message '{}'".format(plugin.item_name, ptw.message))
+                break
+    finally:
+        # Archive and record the items done since the last page, whatever stopped the run
+        items_to_do.commit()
+        pages.close()
+
+    logging.debug(f"Total {plugin.item_name} removed {total_items_removed}")
+    return total_items_removed
+
+
+def plan_bleach_plugin(api, plugin, item_limit=None, checkpoint_store=None, twitter_archive_js_file=None,
+                       bleach_rule=None):
+    """
+    Count the API calls run_bleach_plugin would make and the time the rate limits would make it take. Nothing is
+    removed
+
+    :param api: Instance of an authenticated pytwitter2 WrappedPyTwitterAPI
+    :param plugin: BleachPlugin of the kind of items
+    :param item_limit: Most items to remove. Default is None, which removes all
+    :param checkpoint_store: BleachCheckpointStore the run would resume from. Default is None, which plans a fresh run
+    :param twitter_archive_js_file: Path to the file of a downloaded Twitter archive the run would use. Default is
+    None, which pages through the API
+    :param bleach_rule: BleachRule choosing the items to remove. Default is None, which removes all
+    :return: BleachPlan
+    """
+
+    bleach_rule = _run_rule(plugin, bleach_rule)
+    twitter_me = api.get_me(return_json=True,
+                            user_fields=",".join(field for field in (plugin.me_user_fields(bleach_rule),
+                                                                     "public_metrics") if field))
+    twitter_user_id = twitter_me["data"]["id"]
+    listed_item_count = None
+    if plugin.listed_items_public_metric is not None:
+        listed_item_count = twitter_me["data"].get("public_metrics", {}).get(plugin.listed_items_public_metric)
+
+    checkpoint = None
+    pagination_token = None
+    if checkpoint_store is not None:
+        checkpoint = checkpoint_store.checkpoint(plugin.bleach_type, twitter_user_id)
+        pagination_token = checkpoint.pagination_token
+
+    fetch_page, pagination_token, _ = _page_source(api, plugin, twitter_user_id, bleach_rule, pagination_token,
+                                                   twitter_archive_js_file)
+
+    return plan_bleach(plugin.bleach_type,
+                       lambda page_pagination_token: fetch_page_with_retries(api, fetch_page, page_pagination_token),
+                       pagination_token, plugin.list_endpoint, plugin.action,
+                       checkpoint=checkpoint, item_limit=item_limit,
+                       pages_from_api=twitter_archive_js_file is None, listed_item_count=listed_item_count,
+                       item_matches=bleach_rule.compile(plugin.rule_context(twitter_me))
+                       if bleach_rule is not None else None)
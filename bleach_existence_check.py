@@ -0,0 +1,170 @@
+import collections
+import logging
+import threading
+import time
+
+from wrapped_pytwitter_api import *
+
+# Check that queued items still exist before spending a write request on them
+#
+# Items can be gone by the time a bleach loop gets to them. A tweet from a downloaded archive may have been deleted
+# already, a liked tweet may have been deleted by its author or made protected, a followed account may have been
+# suspended, and pending items from a stopped run may have been done by the request that was cut off. Removing an item
+# that isn't there still uses one of the 50 writes in a 15 minute window.
+#
+# The multi-ID lookups, GET /2/tweets and GET /2/users, take up to 100 IDs per call and have a read window of 900
+# requests per 15 min, so one lookup per page of queued items is cheap. IDs the lookup doesn't return are dropped from
+# the queue and recorded as done without being archived. Items the API has just listed on a page exist and aren't
+# looked up, so the lookups are only spent on pending items from a stopped run and items from a downloaded archive.
+#
+# Results are cached with a time to live so IDs already looked up aren't looked up again on the next page, and an item
+# that existed a while ago is looked up again before it is removed. If a lookup fails the items are kept, the write
+# requests find out for themselves.
+#
+
+EXISTENCE_LOOKUP_TWEETS = "tweets"
+EXISTENCE_LOOKUP_USERS = "users"
+
+# Most IDs the multi-ID lookup endpoints take in one call
+MAX_IDS_PER_LOOKUP = 100
+
+DEFAULT_EXISTENCE_TTL_SECONDS = 15 * 60
+DEFAULT_MAX_CACHED_IDS = 100000
+
+
+class ItemExistenceCache:
+    """
+    Results of existence lookups, by lookup kind and ID, that expire after ttl_seconds. Thread safe, one cache can be
+    shared by bleach loops running at the same time.
+    """
+
+    def __init__(self, ttl_seconds=DEFAULT_EXISTENCE_TTL_SECONDS, max_cached_ids=DEFAULT_MAX_CACHED_IDS):
+        """
+        :param ttl_seconds: Seconds a result is used for before the ID is looked up again
+        :param max_cached_ids: Most results held. The oldest are evicted first
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_cached_ids = max_cached_ids
+
+        self._lock = threading.Lock()
+        # Ordered oldest first. Every entry has the same time to live so the expired ones are at the front
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self, now):
+        while self._entries:
+            key, (_, expires_at) = next(iter(self._entries.items()))
+            if expires_at > now and len(self._entries) <= self.max_cached_ids:
+                break
+            del self._entries[key]
+
+    def get(self, lookup, item_id):
+        """
+        :param lookup: One of the EXISTENCE_LOOKUP_ constants
+        :param item_id: Twitter ID of the tweet or user
+        :return: True or False if a result is cached, None if the ID needs looking up
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((lookup, item_id))
+            if entry is None:
+                return None
+            exists, expires_at = entry
+            if expires_at <= now:
+                del self._entries[(lookup, item_id)]
+                return None
+            return exists
+
+    def put(self, lookup, item_id, exists):
+        """
+        :param lookup: One of the EXISTENCE_LOOKUP_ constants
+        :param item_id: Twitter ID of the tweet or user
+        :param exists: True if the lookup returned the item
+        :return: None
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._entries[(lookup, item_id)] = (exists, now + self.ttl_seconds)
+            self._entries.move_to_end((lookup, item_id))
+            self._evict(now)
+
+
+class ItemExistenceCheck:
+
+    def __init__(self, api, lookup, cache=None):
+        """
+        :param api: Instance of an authenticated WrappedPyTwitterAPI
+        :param lookup: EXISTENCE_LOOKUP_TWEETS for tweets and liked tweets, EXISTENCE_LOOKUP_USERS for followed users
+        :param cache: ItemExistenceCache. Default None, a cache for this check only
+        """
+        self.api = api
+        self.lookup = lookup
+        self.cache = cache if cache is not None else ItemExistenceCache()
+        self.lookups = 0
+        self.gone_count = 0
+
+    def _lookup_response(self, item_ids):
+        while True:
+            try:
+                if self.lookup == EXISTENCE_LOOKUP_TWEETS:
+                    return self.api.get_tweets(item_ids, return_json=True)
+                return self.api.get_users(ids=item_ids, return_json=True)
+            except WrappedPyTwitterAPIRateLimitExceededException:
+                # The API scheduler will hold the lookup until the rate limit window resets
+                logging.info(f"Existence lookup of {self.lookup} rate limit exceeded. Waiting for window to reset")
+                continue
+            except pytwitter.PyTwitterError as ptw:
+                # A response with only errors is raised, every ID was not found or not authorized
+                if isinstance(ptw.message, list):
+                    return {"errors": ptw.message}
+                raise
+
+    def _look_up(self, item_ids):
+        self.lookups += 1
+        response = self._lookup_response(item_ids)
+        found_ids = {item["id"] for item in response.get("data", [])}
+        for error in response.get("errors", []):
+            logging.debug(f"Existence lookup of {self.lookup} error '{error.get('detail')}'")
+        for item_id in item_ids:
+            self.cache.put(self.lookup, item_id, item_id in found_ids)
+
+    def gone_ids(self, item_ids):
+        """
+        Look up the IDs not in the cache, up to MAX_IDS_PER_LOOKUP a call
+
+        :param item_ids: Twitter IDs of tweets or users
+        :return: Set of the IDs that don't exist, or that the account isn't authorized to see
+        :raises WrappedPyTwitterAPIUnauthorizedException: If the access token has expired
+        """
+        unknown_ids = [item_id for item_id in dict.fromkeys(item_ids) if self.cache.get(self.lookup, item_id) is None]
+        try:
+            for batch_start in range(0, len(unknown_ids), MAX_IDS_PER_LOOKUP):
+                self._look_up(unknown_ids[batch_start:batch_start + MAX_IDS_PER_LOOKUP])
+        except WrappedPyTwitterAPIUnauthorizedException:
+            raise
+        except pytwitter.PyTwitterError as ptw:
+            logging.warning(f"Existence lookup of {self.lookup} failed '{ptw.message}'. Keeping the items")
+
+        # An ID whose lookup failed has no result and is kept
+        return {item_id for item_id in item_ids if self.cache.get(self.lookup, item_id) is False}
+
+    def drop_gone(self, work_queue, listed_items=()):
+        """
+        Drop the items of a BleachWorkQueue that no longer exist
+
+        :param work_queue: BleachWorkQueue
+        :param listed_items: Items the API has just returned on a page. They exist and aren't looked up
+        :return: Number of items dropped
+        """
+        for item in listed_items:
+            self.cache.put(self.lookup, item["id"], True)
+        gone_ids = self.gone_ids([item["id"] for item in work_queue.queued_items()])
+        for item_id in gone_ids:
+            work_queue.drop(item_id)
+        if gone_ids:
+            self.gone_count += len(gone_ids)
+            logging.info(f"Dropped {len(gone_ids)} {self.lookup} that no longer exist. "
+                         f"Dropped so far {self.gone_count}")
+        return len(gone_ids)
@@ -0,0 +1,136 @@
+import concurrent.futures
+import logging
+
+from wrapped_pytwitter_api import *
+from bleach_checkpoint import BleachCheckpointStore
+from bleach_orchestrator import bleach_concurrently
+from bleach_existence_check import ItemExistenceCache
+from bleach_snapshot import snapshot_bleach_types, take_snapshot
+
+# Bleach many stored accounts at the same time
+#
+# Rate limits are per user. Every account has its own 50 requests per 15 min window for each kind of bleaching, so
+# the windows of one account don't slow down another. Each account gets its own WrappedPyTwitterAPI, which means its
+# own rate limit scheduler, retry policy, call ledger and connection pool. Nothing about the rate limits is shared
+# between accounts.
+#
+# Accounts are run in a pool of threads, each running bleach_concurrently for one account. The threads spend almost
+# all their time waiting for rate limit windows to reopen, so one host can keep the windows of many accounts full.
+#
+# Tokens refreshed during the run are saved back to the account store. Progress is saved in the checkpoint store,
+# keyed by the Twitter ID of each account, so a stopped fleet run picks up where every account left off.
+#
+# Given a snapshot store, each account is snapshotted before it is bleached, the same as a single account run.
+#
+# Whether an item can be seen depends on the account looking, e.g. tweets of protected accounts and users that have
+# blocked it, so each account gets its own ItemExistenceCache in place of the one given with the jobs.
+#
+
+DEFAULT_MAX_PARALLEL_ACCOUNTS = 50
+
+
+def make_account_api(account, configure_api=None):
+    """
+    Create an authenticated API object for a stored account. Refreshed tokens are saved back to the store
+
+    :param account: BleachAccount from a BleachAccountStore
+    :param configure_api: Function called with the API object and the account before it is authenticated. Default
+    None
+    :return: WrappedPyTwitterAPI
+    """
+    api = WrappedPyTwitterAPI(client_id=account.client_id, oauth_flow=True)
+    if configure_api is not None:
+        configure_api(api, account)
+
+    expires_in = account.expires_in
+    if expires_in is not None and expires_in <= 0:
+        # Stored token has already expired. Swap the refresh token for a new one before making any requests
+        api.set_access_token(account.access_token, account.refresh_token)
+        api.on_access_token_set = account.save_tokens
+        api.refresh_access_token()
+    else:
+        api.set_access_token(account.access_token, account.refresh_token, expires_in=expires_in)
+        api.on_access_token_set = account.save_tokens
+
+    return api
+
+
+def account_bleach_jobs(bleach_jobs):
+    """
+    :param bleach_jobs: List of (bleach_type, bleach_function, kwargs) tuples, see bleach_concurrently
+    :return: Copy of the jobs for one account, with a new ItemExistenceCache for each one in the kwargs of the jobs
+    """
+    existence_caches = {}
+    jobs = []
+    for bleach_type, bleach_function, kwargs in bleach_jobs:
+        existence_cache = kwargs.get("existence_cache")
+        if existence_cache is not None:
+            if id(existence_cache) not in existence_caches:
+                existence_caches[id(existence_cache)] = ItemExistenceCache(
+                    ttl_seconds=existence_cache.ttl_seconds, max_cached_ids=existence_cache.max_cached_ids)
+            kwargs = dict(kwargs, existence_cache=existence_caches[id(existence_cache)])
+        jobs.append((bleach_type, bleach_function, kwargs))
+    return jobs
+
+
+def bleach_fleet(account_store, bleach_jobs, checkpoint_store=None, max_parallel_accounts=DEFAULT_MAX_PARALLEL_ACCOUNTS,
+                 configure_api=None, progress_interval_seconds=60, max_concurrent_jobs=None, skip_finished=False,
+                 snapshot_store=None):
+    """
+    Run the bleach jobs for every account in the account store
+
+    :param account_store: BleachAccountStore with the accounts to bleach
+    :param bleach_jobs: List of (bleach_type, bleach_function, kwargs) tuples to run for each account, see
+    bleach_concurrently
+    :param checkpoint_store: BleachCheckpointStore shared by every account. Default is None, which keeps progress in
+    memory
+    :param max_parallel_accounts: Most accounts bleached at the same time
+    :param configure_api: Function called with the API object and the account before it is authenticated. Default
+    None
+    :param progress_interval_seconds: Seconds between progress log lines of each account
+    :param max_concurrent_jobs: Most jobs run at the same time for each account. Default None, all of them
+    :param skip_finished: Leave out the jobs an account has already finished, see bleach_concurrently. Default False
+    :param snapshot_store: BleachSnapshotStore to snapshot each account to before it is bleached. Default None, no
+    snapshots
+    :return: Dictionary of account name to the bleach_concurrently results, None if the account failed
+    """
+
+    if checkpoint_store is None:
+        checkpoint_store = BleachCheckpointStore()
+
+    accounts = account_store.accounts()
+    logging.info(f"Bleaching {len(accounts)} accounts, {max_parallel_accounts} at a time")
+
+    def bleach_account(account):
+        api = make_account_api(account, configure_api)
+        try:
+            if snapshot_store is not None:
+                twitter_user_id = api.get_me(return_json=True)["data"]["id"]
+                bleach_types = snapshot_bleach_types([bleach_type for bleach_type, _, _ in bleach_jobs],
+                                                     checkpoint_store.unfinished_bleach_types(twitter_user_id))
+                if bleach_types:
+                    take_snapshot(api, snapshot_store, bleach_types=bleach_types, twitter_user_id=twitter_user_id)
+            return bleach_concurrently(api, account_bleach_jobs(bleach_jobs), checkpoint_store=checkpoint_store,
+                                       progress_interval_seconds=progress_interval_seconds,
+                                       max_concurrent_jobs=max_concurrent_jobs, skip_finished=skip_finished)
+        finally:
+            api.stop_background_refresh()
+
+    results = {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(max_parallel_accounts, len(accounts))),
+                                               thread_name_prefix="fleet") as executor:
+        futures = {executor.submit(bleach_account, account): account.account_name for account in accounts}
+
+        for future in concurrent.futures.as_completed(futures):
+            account_name = futures[future]
+            try:
+                results[account_name] = future.result()
+                logging.info(f"Bleaching account '{account_name}' finished. Result {results[account_name]}")
+            except Exception as e:
+                results[account_name] = None
+                logging.fatal("Bleaching account '{}' failed with exception of type {}. Message is '{}'".format(
+                    account_name, type(e), e))
+            logging.info(f"Fleet progress: {len(results)} of {len(accounts)} accounts done")
+
+    return results
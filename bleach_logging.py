@@ -0,0 +1,146 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+# Logging set up for long bleach runs
+#
+# Records are put on a bounded queue by the threads doing the bleaching and formatted and written to a rotating log
+# file by a background thread, so a slow disk never holds up a request. Records are queued as they are made, the
+# message is only formatted with its arguments by the background thread. Use %-style arguments in the hot loops, e.g.
+#
+#   logging.debug("Liked tweets from API %s, new to do %s", len(page), queued)
+#
+# so nothing is formatted when the level is off. If the queue fills up, records are dropped and counted instead of
+# blocking the caller.
+#
+# Structured fields passed with extra, e.g. extra={"item_id": tweet_id, "endpoint": endpoint, "status": 429}, are
+# written at the end of the line as key=value pairs.
+#
+# Messages logged once per item or per request go to hot_path_log. At most HOT_PATH_RECORDS_PER_INTERVAL of each
+# message are written per interval, the rest are counted and the count is written with the next one that gets through.
+#
+
+DEFAULT_LOG_FORMAT = '%(asctime)s %(name)s %(levelname)-8s %(message)s'
+DEFAULT_LOG_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+DEFAULT_LOG_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_LOG_BACKUP_COUNT = 5
+DEFAULT_LOG_QUEUE_SIZE = 10000
+
+# Attributes of a record, set with extra, written as key=value at the end of the line
+STRUCTURED_LOG_FIELDS = ("bleach_type", "item_id", "endpoint", "status")
+
+HOT_PATH_LOGGER_NAME = "twitter_bleach.hot_path"
+HOT_PATH_RECORDS_PER_INTERVAL = 10
+HOT_PATH_INTERVAL_SECONDS = 60
+
+hot_path_log = logging.getLogger(HOT_PATH_LOGGER_NAME)
+
+
+class StructuredFormatter(logging.Formatter):
+
+    def format(self, record):
+        line = super(StructuredFormatter, self).format(record)
+        fields = " ".join(f"{field}={getattr(record, field)}" for field in STRUCTURED_LOG_FIELDS
+                          if hasattr(record, field))
+        return f"{line} {fields}" if fields else line
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records without formatting them. Records that don't fit in the queue are dropped and counted
+    """
+
+    def __init__(self, log_queue, max_queued_records=DEFAULT_LOG_QUEUE_SIZE):
+        super(NonBlockingQueueHandler, self).__init__(log_queue)
+        self.max_queued_records = max_queued_records
+        self.dropped_records = 0
+
+    def prepare(self, record):
+        # The listener thread formats the record. The default prepare formats it here, on the caller's thread
+        return record
+
+    def enqueue(self, record):
+        # A SimpleQueue has no size limit and puts without taking a lock, so the limit is checked here
+        if self.queue.qsize() >= self.max_queued_records:
+            self.dropped_records += 1
+            return
+        self.queue.put_nowait(record)
+
+
+class HotPathRateLimitFilter(logging.Filter):
+    """
+    Lets through at most records_per_interval records of each message per interval
+    """
+
+    def __init__(self, records_per_interval=HOT_PATH_RECORDS_PER_INTERVAL, interval_seconds=HOT_PATH_INTERVAL_SECONDS):
+        super(HotPathRateLimitFilter, self).__init__()
+        self.records_per_interval = records_per_interval
+        self.interval_seconds = interval_seconds
+        self._lock = threading.Lock()
+        # Message template to [interval start, records let through, records suppressed]
+        self._windows = {}
+
+    def filter(self, record):
+        now = time.monotonic()
+        suppressed = 0
+        with self._lock:
+            window = self._windows.get(record.msg)
+            if window is None or now - window[0] >= self.interval_seconds:
+                suppressed = window[2] if window is not None else 0
+                window = self._windows[record.msg] = [now, 0, 0]
+            if window[1] >= self.records_per_interval:
+                window[2] += 1
+                return False
+            window[1] += 1
+        if suppressed:
+            record.suppressed = suppressed
+            record.msg = f"{record.msg} ({suppressed} similar suppressed)"
+        return True
+
+
+hot_path_log.addFilter(HotPathRateLimitFilter())
+
+
+class BackgroundLogWriter(logging.handlers.QueueListener):
+    """
+    QueueListener that can be stopped more than once, e.g. by the caller and again at exit
+    """
+
+    def stop(self):
+        if self._thread is not None:
+            super(BackgroundLogWriter, self).stop()
+
+
+def configure_logging(file_name, level=logging.DEBUG, max_bytes=DEFAULT_LOG_MAX_BYTES,
+                      backup_count=DEFAULT_LOG_BACKUP_COUNT, queue_size=DEFAULT_LOG_QUEUE_SIZE,
+                      log_format=DEFAULT_LOG_FORMAT, date_format=DEFAULT_LOG_DATE_FORMAT):
+    """
+    Send the records of the root logger through a queue to a rotating log file written by a background thread. The
+    queue is drained when the interpreter exits
+
+    :param file_name: Path of the log file
+    :param level: Level of the root logger
+    :param max_bytes: Size the log file is rotated at
+    :param backup_count: Number of rotated log files kept
+    :param queue_size: Most records waiting to be written. More are dropped
+    :param log_format: Format of the log lines, structured fields are added at the end
+    :param date_format: Format of the time in the log lines
+    :return: The BackgroundLogWriter writing the file. Call stop on it to drain the queue
+    """
+    file_handler = logging.handlers.RotatingFileHandler(file_name, maxBytes=max_bytes, backupCount=backup_count)
+    file_handler.setFormatter(StructuredFormatter(log_format, datefmt=date_format))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = NonBlockingQueueHandler(log_queue, max_queued_records=queue_size)
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(level)
+    root_logger.addHandler(queue_handler)
+
+    listener = BackgroundLogWriter(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
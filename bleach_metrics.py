@@ -0,0 +1,354 @@
+import bisect
+import http.server
+import logging
+import threading
+import time
+
+from bleach_checkpoint import BLEACH_TYPE_LIKES, BLEACH_TYPE_TWEETS, BLEACH_TYPE_FOLLOWS
+
+# Counters of a bleach run, served in the Prometheus text format and summarised in a progress line
+#
+# Set api.metrics to a BleachMetrics to turn them on. WrappedPyTwitterAPI records every response, its status, latency
+# and rate limit headers, and the bleach loops record every item they process. With api.metrics left as None each
+# hook is a single attribute check.
+#
+#   api.metrics = BleachMetrics()
+#   start_metrics_server(api.metrics, port=9464)
+#
+# Each account of a fleet gets its own BleachMetrics from a BleachFleetMetrics, labelled with the account name, and
+# the server serves all of them
+#
+#   fleet_metrics = BleachFleetMetrics()
+#   start_metrics_server(fleet_metrics, port=9464)
+#   api.metrics = fleet_metrics.account_metrics(account.account_name)
+#
+# The ETA of each kind of bleaching is the items left divided by the rate items have been done at so far this run. The
+# items left at the start come from the public_metrics counts of the account, e.g. following_count, so the ETA is an
+# upper bound when a bleach rule skips some items.
+#
+
+DEFAULT_METRICS_PORT = 9464
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKET_BOUNDS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Status recorded for a request that got no response, e.g. a dropped connection
+STATUS_CONNECTION_ERROR = "connection_error"
+
+# public_metrics count of the account that is the number of items to bleach. The other kinds have no count and no ETA
+EXPECTED_ITEMS_PUBLIC_METRIC = {
+    BLEACH_TYPE_LIKES: "like_count",
+    BLEACH_TYPE_TWEETS: "tweet_count",
+    BLEACH_TYPE_FOLLOWS: "following_count",
+}
+
+
+def metrics_user_fields(api, user_fields=None):
+    """
+    :param api: WrappedPyTwitterAPI
+    :param user_fields: user_fields the caller of get_me needs. Default None
+    :return: user_fields for get_me, with 'public_metrics' added when metrics are on
+    """
+    if api.metrics is None:
+        return user_fields
+    return ",".join(field for field in (user_fields, "public_metrics") if field)
+
+
+def start_bleach_metrics(api, bleach_type, twitter_me):
+    """
+    Record the start of a bleach loop and the number of items it has to do, if metrics are on
+
+    :param api: WrappedPyTwitterAPI
+    :param bleach_type: One of the BLEACH_TYPE_ values
+    :param twitter_me: get_me response JSON, asked for with metrics_user_fields
+    :return: None
+    """
+    if api.metrics is None:
+        return
+    public_metrics = twitter_me["data"].get("public_metrics", {})
+    expected_items_metric = EXPECTED_ITEMS_PUBLIC_METRIC.get(bleach_type)
+    api.metrics.start(bleach_type, public_metrics.get(expected_items_metric) if expected_items_metric else None)
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels.items()) + "}"
+
+
+class _LatencyHistogram:
+
+    def __init__(self):
+        self.bucket_counts = [0] * (len(LATENCY_BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.bucket_counts[bisect.bisect_left(LATENCY_BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+
+class BleachMetrics:
+    """
+    Metrics of one account. Thread safe, one BleachMetrics can be shared by the bleach loops of the account running at
+    the same time. A fleet has one for each account, see BleachFleetMetrics.
+    """
+
+    def __init__(self, account=None):
+        """
+        :param account: Name of the account, added as the 'account' label of every metric. Default None, no label
+        """
+        self.account = account
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._latency = {}
+        self._rate_limits = {}
+        self._items_processed = {}
+        self._expected_items = {}
+        self._started_at = {}
+
+    def record_response(self, endpoint, status, latency_seconds=None):
+        """
+        :param endpoint: Key of the endpoint from rate_limit_endpoint_key
+        :param status: HTTP status code, or STATUS_CONNECTION_ERROR
+        :param latency_seconds: Seconds the request took. Default None, not known
+        :return: None
+        """
+        with self._lock:
+            self._calls[(endpoint, status)] = self._calls.get((endpoint, status), 0) + 1
+            if latency_seconds is not None:
+                histogram = self._latency.get(endpoint)
+                if histogram is None:
+                    histogram = self._latency[endpoint] = _LatencyHistogram()
+                histogram.observe(latency_seconds)
+
+    def record_rate_limit(self, endpoint, limit, remaining, reset_at):
+        """
+        :param endpoint: Key of the endpoint from rate_limit_endpoint_key
+        :param limit: Requests allowed in the window
+        :param remaining: Requests left in the window
+        :param reset_at: Epoch seconds the window resets
+        :return: None
+        """
+        with self._lock:
+            self._rate_limits[endpoint] = (limit, remaining, reset_at)
+
+    def start(self, bleach_type, expected_items=None):
+        """
+        :param bleach_type: One of the BLEACH_TYPE_ values
+        :param expected_items: Items the run has to do. Default None, not known and there is no ETA
+        :return: None
+        """
+        with self._lock:
+            self._started_at.setdefault(bleach_type, time.monotonic())
+            if expected_items is not None:
+                self._expected_items[bleach_type] = expected_items
+
+    def record_items(self, bleach_type, count=1):
+        """
+        :param bleach_type: One of the BLEACH_TYPE_ values
+        :param count: Items processed
+        :return: None
+        """
+        with self._lock:
+            self._started_at.setdefault(bleach_type, time.monotonic())
+            self._items_processed[bleach_type] = self._items_processed.get(bleach_type, 0) + count
+
+    def calls(self):
+        """
+        :return: Dictionary of (endpoint, status) to the number of responses
+        """
+        with self._lock:
+            return dict(self._calls)
+
+    def items_processed(self):
+        """
+        :return: Dictionary of bleach type to the items processed this run
+        """
+        with self._lock:
+            return dict(self._items_processed)
+
+    def _eta_seconds(self, bleach_type, now):
+        expected = self._expected_items.get(bleach_type)
+        processed = self._items_processed.get(bleach_type, 0)
+        if expected is None:
+            return None
+        remaining = max(0, expected - processed)
+        if remaining == 0:
+            return 0.0
+        elapsed = now - self._started_at[bleach_type]
+        if processed == 0 or elapsed <= 0:
+            return None
+        return remaining / (processed / elapsed)
+
+    def eta_seconds(self, bleach_type):
+        """
+        :param bleach_type: One of the BLEACH_TYPE_ values
+        :return: Seconds until the items left are done at the rate so far, None if not known yet
+        """
+        with self._lock:
+            return self._eta_seconds(bleach_type, time.monotonic())
+
+    def progress_line(self):
+        """
+        :return: One line summary of the items done, rate and ETA of each kind of bleaching
+        """
+        now = time.monotonic()
+        with self._lock:
+            progress = []
+            for bleach_type in sorted(self._started_at):
+                processed = self._items_processed.get(bleach_type, 0)
+                elapsed = now - self._started_at[bleach_type]
+                per_hour = processed / elapsed * 3600 if elapsed > 0 else 0.0
+                expected = self._expected_items.get(bleach_type)
+                eta = self._eta_seconds(bleach_type, now)
+                progress.append(f"{bleach_type} {processed}" + (f" of {expected}" if expected is not None else "") +
+                                f" at {per_hour:.0f}/hour, ETA " +
+                                (f"{int(eta // 3600)}h {int(eta % 3600 // 60):02d}m" if eta is not None else "unknown"))
+            throttled = sum(calls for (_, status), calls in self._calls.items() if status == 429)
+        account = f" of '{self.account}'" if self.account is not None else ""
+        return (f"Bleach metrics{account}: {'; '.join(progress) or 'nothing started'}. "
+                f"Rate limited responses {throttled}")
+
+    def _metric_families(self):
+        """
+        :return: List of (name, type, help, sample lines) of each metric, the sample lines labelled with the account
+        """
+        now = time.monotonic()
+        wall_now = time.time()
+        account_labels = {} if self.account is None else {"account": self.account}
+
+        def sample(name, value, **labels):
+            return f"{name}{_labels(**account_labels, **labels)} {value}"
+
+        with self._lock:
+            calls = [sample("twitter_bleach_api_calls_total", calls, endpoint=endpoint, status=status)
+                     for (endpoint, status), calls in sorted(self._calls.items(), key=lambda entry: str(entry[0]))]
+
+            latency = []
+            for endpoint, histogram in sorted(self._latency.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(LATENCY_BUCKET_BOUNDS + ("+Inf",), histogram.bucket_counts):
+                    cumulative += bucket_count
+                    latency.append(sample("twitter_bleach_api_latency_seconds_bucket", cumulative, endpoint=endpoint,
+                                          le=bound))
+                latency.append(sample("twitter_bleach_api_latency_seconds_sum", histogram.sum, endpoint=endpoint))
+                latency.append(sample("twitter_bleach_api_latency_seconds_count", histogram.count, endpoint=endpoint))
+
+            rate_limit_remaining = [sample("twitter_bleach_rate_limit_remaining", remaining, endpoint=endpoint)
+                                    for endpoint, (limit, remaining, reset_at) in sorted(self._rate_limits.items())
+                                    if remaining is not None]
+            rate_limit_reset = [sample("twitter_bleach_rate_limit_reset_seconds",
+                                       f"{max(0.0, reset_at - wall_now):.0f}", endpoint=endpoint)
+                                for endpoint, (limit, remaining, reset_at) in sorted(self._rate_limits.items())
+                                if reset_at is not None]
+
+            items_processed = [sample("twitter_bleach_items_processed_total", processed, bleach_type=bleach_type)
+                               for bleach_type, processed in sorted(self._items_processed.items())]
+            items_expected = [sample("twitter_bleach_items_expected", expected, bleach_type=bleach_type)
+                              for bleach_type, expected in sorted(self._expected_items.items())]
+            etas = []
+            for bleach_type in sorted(self._started_at):
+                eta = self._eta_seconds(bleach_type, now)
+                if eta is not None:
+                    etas.append(sample("twitter_bleach_eta_seconds", f"{eta:.0f}", bleach_type=bleach_type))
+
+        return [
+            ("twitter_bleach_api_calls_total", "counter", "API responses by endpoint and status", calls),
+            ("twitter_bleach_api_latency_seconds", "histogram", "Time to get a response by endpoint", latency),
+            ("twitter_bleach_rate_limit_remaining", "gauge", "Requests left in the rate limit window",
+             rate_limit_remaining),
+            ("twitter_bleach_rate_limit_reset_seconds", "gauge", "Seconds until the rate limit window resets",
+             rate_limit_reset),
+            ("twitter_bleach_items_processed_total", "counter", "Items processed this run by bleach type",
+             items_processed),
+            ("twitter_bleach_items_expected", "gauge", "Items to process this run by bleach type", items_expected),
+            ("twitter_bleach_eta_seconds", "gauge", "Projected seconds until the bleach type is done", etas),
+        ]
+
+    def render(self):
+        """
+        :return: The metrics in the Prometheus text exposition format
+        """
+        return render_metrics([self])
+
+
+def render_metrics(all_metrics):
+    """
+    :param all_metrics: List of BleachMetrics, e.g. one for each account of a fleet
+    :return: The metrics of all of them in the Prometheus text exposition format, each metric under one HELP and TYPE
+    """
+    lines = []
+    for families in zip(*(metrics._metric_families() for metrics in all_metrics)):
+        name, metric_type, metric_help, _ = families[0]
+        lines.append(f"# HELP {name} {metric_help}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for _, _, _, samples in families:
+            lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+class BleachFleetMetrics:
+    """
+    One BleachMetrics for each account of a fleet, served together. Rate limits and the items to bleach are per
+    account, so the accounts can't share one BleachMetrics. Thread safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._account_metrics = {}
+
+    def account_metrics(self, account=None):
+        """
+        :param account: Name of the account. Default None, the single account of a run without a fleet
+        :return: The BleachMetrics of the account, created the first time it is asked for
+        """
+        with self._lock:
+            metrics = self._account_metrics.get(account)
+            if metrics is None:
+                metrics = self._account_metrics[account] = BleachMetrics(account)
+            return metrics
+
+    def render(self):
+        """
+        :return: The metrics of every account in the Prometheus text exposition format
+        """
+        with self._lock:
+            all_metrics = [self._account_metrics[account]
+                           for account in sorted(self._account_metrics, key=lambda account: account or "")]
+        return render_metrics(all_metrics)
+
+
+class _MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    metrics = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(metrics, port=DEFAULT_METRICS_PORT, listen_ip="127.0.0.1"):
+    """
+    Serve the metrics on http://listen_ip:port/metrics from a background thread
+
+    :param metrics: BleachMetrics or BleachFleetMetrics
+    :param port: Port to listen on. 0 for any free port
+    :param listen_ip: IP to listen on. Default local only
+    :return: The ThreadingHTTPServer. Call shutdown on it to stop serving
+    """
+    handler = type("MetricsRequestHandler", (_MetricsRequestHandler,), {"metrics": metrics})
+    server = http.server.ThreadingHTTPServer((listen_ip, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logging.info(f"Serving bleach metrics on http://{listen_ip}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,79 @@
+import concurrent.futures
+import logging
+
+from bleach_checkpoint import BleachCheckpointStore
+
+# Run several kinds of bleaching at the same time
+#
+# Unliking, deleting tweets and unfollowing each have their own rate limit window of 50 requests per 15 min.
+# Running them one after another leaves two of the windows idle. Running them in threads sharing one
+# WrappedPyTwitterAPI keeps all three windows busy. The API object refreshes the access token once for all threads
+# and its rate limit scheduler keeps the windows separate.
+#
+# Progress of all the bleach jobs is read from the shared checkpoint store and logged together.
+#
+
+
+def bleach_concurrently(api, bleach_jobs, checkpoint_store=None, progress_interval_seconds=60, max_concurrent_jobs=None,
+                        skip_finished=False):
+    """
+    Run bleach functions in parallel, one thread per function
+
+    :param api: Instance of an authenticated pytwitter2 WrappedPyTwitterAPI, shared by all the jobs
+    :param bleach_jobs: List of (bleach_type, bleach_function, kwargs) tuples. bleach_type is one of the BLEACH_TYPE_
+    values of bleach_checkpoint. bleach_function is called as bleach_function(api, checkpoint_store=..., **kwargs)
+    :param checkpoint_store: BleachCheckpointStore shared by the jobs. Default is None, which keeps progress in memory
+    :param progress_interval_seconds: Seconds between combined progress log lines
+    :param max_concurrent_jobs: Most jobs run at the same time. Default None, all of them
+    :param skip_finished: Leave out the jobs whose last run for the account went through every page, e.g. to resume.
+    Default False
+    :return: Dictionary of bleach_type to the value returned by the bleach function, None if the function failed
+    """
+
+    if checkpoint_store is None:
+        checkpoint_store = BleachCheckpointStore()
+
+    twitter_me = api.get_me(return_json=True)
+    twitter_user_id = twitter_me["data"]["id"]
+
+    checkpoints = {bleach_type: checkpoint_store.checkpoint(bleach_type, twitter_user_id)
+                   for bleach_type, _, _ in bleach_jobs}
+    if skip_finished:
+        unfinished_bleach_types = checkpoint_store.unfinished_bleach_types(twitter_user_id)
+        bleach_jobs = [bleach_job for bleach_job in bleach_jobs if bleach_job[0] in unfinished_bleach_types]
+        checkpoints = {bleach_type: checkpoints[bleach_type] for bleach_type, _, _ in bleach_jobs}
+    processed_at_start = {bleach_type: checkpoint.processed_count() for bleach_type, checkpoint in checkpoints.items()}
+
+    def log_progress():
+        progress = ", ".join("{} {} (total {})".format(bleach_type,
+                                                      checkpoint.processed_count() - processed_at_start[bleach_type],
+                                                      checkpoint.processed_count())
+                             for bleach_type, checkpoint in checkpoints.items())
+        logging.info(f"Bleach progress this run: {progress}")
+        if api.metrics is not None:
+            logging.info(api.metrics.progress_line())
+
+    results = {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(max_concurrent_jobs or len(bleach_jobs),
+                                                                      len(bleach_jobs))),
+                                               thread_name_prefix="bleach") as executor:
+        futures = {executor.submit(bleach_function, api, checkpoint_store=checkpoint_store, **kwargs): bleach_type
+                   for bleach_type, bleach_function, kwargs in bleach_jobs}
+
+        not_done = set(futures.keys())
+        while not_done:
+            done, not_done = concurrent.futures.wait(not_done, timeout=progress_interval_seconds,
+                                                     return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                bleach_type = futures[future]
+                try:
+                    results[bleach_type] = future.result()
+                    logging.info(f"Bleaching {bleach_type} finished. Result {results[bleach_type]}")
+                except Exception as e:
+                    results[bleach_type] = None
+                    logging.fatal("Bleaching {} failed with exception of type {}. Message is '{}'".format(
+                        bleach_type, type(e), e))
+            log_progress()
+
+    return results
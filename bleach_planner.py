@@ -0,0 +1,208 @@
+import logging
+import math
+
+from api_call_ledger import ACTION_ENDPOINTS
+
+# Plan of the API calls a bleach run will make and how long the rate limits will make it take
+#
+# The plan walks the same pages the bleach run would, from the API or a downloaded archive, and counts the items
+# still to be done. Nothing is deleted. Each item costs the calls listed for its action in ACTION_ENDPOINTS, so the
+# plan is the exact number of calls a run makes when no request fails.
+#
+# Some read endpoints only allow 15 requests per 15 min, the same requests the run needs, so only the first
+# DEFAULT_PLAN_MAX_PAGES pages are read from the API. When there are more, the counts are an estimate. They are scaled
+# up by the public_metrics count of the account for the items listed, e.g. like_count, if there is one. Otherwise they
+# are only the items of the pages read, a lower bound. Pages from a downloaded archive cost no requests and are all
+# read.
+#
+# A run is as long as the slowest endpoint it calls. Reads of the next pages overlap with the writes, see
+# PagePrefetcher, so the endpoints are projected separately and the longest one is the time of the run.
+#
+
+GET_ME_ENDPOINT = "GET /2/users/me"
+
+# Most pages a plan reads from the API
+DEFAULT_PLAN_MAX_PAGES = 2
+
+# Documented Twitter v2 user context rate limits as (requests, window seconds)
+# https://developer.twitter.com/en/docs/twitter-api/rate-limits
+TWITTER_V2_RATE_LIMITS = {
+    "GET /2/users/me": (75, 900),
+    "GET /2/users/:id/tweets": (900, 900),
+    "GET /2/users/:id/liked_tweets": (75, 900),
+    "GET /2/users/:id/following": (15, 900),
+    "GET /2/tweets": (900, 900),
+    "GET /2/users": (900, 900),
+    "GET /2/users/:id/blocking": (15, 900),
+    "GET /2/users/:id/muting": (15, 900),
+    "GET /2/users/:id/owned_lists": (15, 900),
+    "DELETE /2/users/:id/likes/:id": (50, 900),
+    "DELETE /2/tweets/:id": (50, 900),
+    "DELETE /2/users/:id/retweets/:id": (50, 900),
+    "DELETE /2/users/:id/following/:id": (50, 900),
+    "POST /2/users/:id/following": (50, 900),
+    "DELETE /2/users/:id/blocking/:id": (50, 900),
+    "DELETE /2/users/:id/muting/:id": (50, 900),
+    "DELETE /2/lists/:id": (300, 900),
+}
+
+
+class BleachPlan:
+
+    def __init__(self, bleach_type, items_by_action, pages, calls_by_endpoint, planning_calls, rate_limits=None,
+                 estimate=None):
+        """
+        :param bleach_type: One of the BLEACH_TYPE_ constants
+        :param items_by_action: Dictionary of ACTION_ constant to the number of items it will be done to
+        :param pages: Number of pages the run will read
+        :param calls_by_endpoint: Dictionary of endpoint key to the number of calls the run will make
+        :param planning_calls: Number of API calls made to make the plan
+        :param rate_limits: Dictionary of endpoint key to (requests, window seconds). Default None,
+        TWITTER_V2_RATE_LIMITS
+        :param estimate: Description of how the counts were estimated when not every page was read. Default None, the
+        counts are exact
+        """
+        self.bleach_type = bleach_type
+        self.items_by_action = items_by_action
+        self.pages = pages
+        self.calls_by_endpoint = calls_by_endpoint
+        self.planning_calls = planning_calls
+        self.rate_limits = rate_limits if rate_limits is not None else TWITTER_V2_RATE_LIMITS
+        self.estimate = estimate
+
+    @property
+    def items(self):
+        return sum(self.items_by_action.values())
+
+    @property
+    def total_calls(self):
+        return sum(self.calls_by_endpoint.values())
+
+    def projected_seconds_by_endpoint(self):
+        """
+        :return: Dictionary of endpoint key to the seconds its rate limit windows will take. Endpoints without a known
+        rate limit are left out
+        """
+        projected = {}
+        for endpoint, calls in self.calls_by_endpoint.items():
+            if endpoint not in self.rate_limits or calls == 0:
+                continue
+            limit, window_seconds = self.rate_limits[endpoint]
+            # The first window's worth of calls go straight away, each window after that waits for a reset
+            projected[endpoint] = ((calls - 1) // limit) * window_seconds
+        return projected
+
+    @property
+    def projected_seconds(self):
+        return max(self.projected_seconds_by_endpoint().values(), default=0)
+
+    def summary(self):
+        """
+        :return: One line summary of the items, calls and projected time, saying if the counts are an estimate
+        """
+        summary = (f"{self.items} items in {self.pages} pages, {self.total_calls} API calls, "
+                   f"projected {self.projected_seconds / 3600:.1f} hours")
+        if self.estimate is not None:
+            summary += f" ({self.estimate})"
+        return summary
+
+    def log(self):
+        """
+        Log the plan at info level
+        :return: None
+        """
+        logging.info(f"Plan for {self.bleach_type}: {self.summary()}")
+        projected = self.projected_seconds_by_endpoint()
+        for endpoint, calls in sorted(self.calls_by_endpoint.items()):
+            logging.info(f"  {endpoint}: {calls} calls, {projected.get(endpoint, 0) / 3600:.1f} hours")
+
+
+def _scale_counts(counts, scale):
+    return {key: round(count * scale) for key, count in counts.items()}
+
+
+def plan_bleach(bleach_type, fetch_page, pagination_token, read_endpoint, action_of_item, checkpoint=None,
+                item_limit=None, pages_from_api=True, rate_limits=None, item_matches=None,
+                max_pages=DEFAULT_PLAN_MAX_PAGES, listed_item_count=None):
+    """
+    Walk the pages a bleach run would and count the calls it will make
+
+    :param bleach_type: One of the BLEACH_TYPE_ constants
+    :param fetch_page: Function taking a pagination token and returning the page as a JSON dictionary
+    :param pagination_token: Token of the first page the run would read
+    :param read_endpoint: Endpoint key fetch_page reads from the API
+    :param action_of_item: Function taking an item and returning the ACTION_ constant the run will do to it
+    :param checkpoint: BleachCheckpoint of the run. Items it has done are not counted, its pending items are. Default
+    None, every item is counted
+    :param item_limit: Most items the run will do. Default None, no limit
+    :param pages_from_api: True if fetch_page reads from the API, False for an archive
+    :param rate_limits: Dictionary of endpoint key to (requests, window seconds). Default None,
+    TWITTER_V2_RATE_LIMITS
+    :param item_matches: Function taking an item and returning True if the run would remove it, see
+    BleachRule.compile. Default None, every item
+    :param max_pages: Most pages to read from the API, the counts are estimated when there are more. None for all.
+    Pages from an archive are all read
+    :param listed_item_count: Number of items the pages list, e.g. the like_count of the account, to estimate the
+    counts from. Default None, not known, the counts of the pages read are a lower bound
+    :return: BleachPlan
+    """
+    pending_by_action = {}
+    items_by_action = {}
+    counted_ids = set()
+    pages_read = 0
+    listed_items = 0
+
+    def count_item(item, by_action):
+        if item_limit is not None and len(counted_ids) >= item_limit:
+            return
+        if item["id"] in counted_ids or (checkpoint is not None and checkpoint.is_processed(item["id"])):
+            return
+        counted_ids.add(item["id"])
+        action = action_of_item(item)
+        by_action[action] = by_action.get(action, 0) + 1
+
+    if checkpoint is not None:
+        for pending_item in checkpoint.pending_items():
+            count_item(pending_item, pending_by_action)
+
+    estimate = None
+    pages = None
+    while item_limit is None or len(counted_ids) < item_limit:
+        if pages_from_api and max_pages is not None and pages_read >= max_pages:
+            if listed_item_count is not None and listed_items > 0:
+                # Assume the pages not read have the same share of items to remove as the pages read
+                scale = max(1.0, listed_item_count / listed_items)
+                estimate = f"estimated from {pages_read} pages and {listed_item_count} items on the account"
+                items_by_action = _scale_counts(items_by_action, scale)
+                pages = math.ceil(pages_read * scale)
+            else:
+                estimate = f"at least, from the first {pages_read} pages"
+            break
+        page = fetch_page(pagination_token)
+        pages_read += 1
+        for item in page.get("data", []):
+            listed_items += 1
+            if item_matches is None or item_matches(item):
+                count_item(item, items_by_action)
+        pagination_token = page.get("meta", {}).get("next_token")
+        if pagination_token is None:
+            break
+
+    for action, items in pending_by_action.items():
+        items_by_action[action] = items_by_action.get(action, 0) + items
+    total_items = sum(items_by_action.values())
+    if item_limit is not None and total_items > item_limit:
+        items_by_action = _scale_counts(items_by_action, item_limit / total_items)
+
+    if pages is None:
+        pages = pages_read
+
+    calls_by_endpoint = {GET_ME_ENDPOINT: 1}
+    if pages_from_api:
+        calls_by_endpoint[read_endpoint] = pages
+    for action, items in items_by_action.items():
+        for endpoint in ACTION_ENDPOINTS[action]:
+            calls_by_endpoint[endpoint] = calls_by_endpoint.get(endpoint, 0) + items
+
+    planning_calls = 1 + (pages_read if pages_from_api else 0)
+    return BleachPlan(bleach_type, items_by_action, pages, calls_by_endpoint, planning_calls, rate_limits, estimate)
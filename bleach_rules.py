@@ -0,0 +1,341 @@
+import ast
+import datetime
+import re
+
+# Rules choosing which items a bleach run removes
+#
+# By default a bleach run removes everything. A rule narrows it down, e.g. only tweets older than a year with fewer
+# than 5 likes that aren't pinned
+#
+#   created_before_days_ago(365) & public_metric_below("like_count", 5) & ~is_pinned()
+#
+# Each rule knows the tweet.fields and user.fields it looks at. The bleach loops ask the API for those fields when
+# they fetch a page and filter the page before queueing it, so write requests are only spent on items that match.
+#
+# Rules can be given as text, e.g. on the command line, see parse_rule. The text is parsed, never run.
+#
+# A rule is compiled to a plain function once per run. Dates are compared as ISO 8601 strings, keywords are one
+# precompiled regular expression and lists of names are sets, so checking an item costs a few dictionary lookups.
+#
+# A rule never matches an item that is missing the field it checks, e.g. a tweet from a downloaded archive has no
+# public_metrics. When unsure, an item is kept. Predicates return None when they can't tell, and not, and and or pass
+# the None on unless the other side decides, e.g. False and None is False. So ~public_metric_below("like_count", 5)
+# doesn't match an item without public_metrics either.
+#
+
+# Format of 'created_at' in the API responses. Strings in this format sort in time order
+TWITTER_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.000Z"
+
+
+def tweet_is_retweet(tweet):
+    """
+    :param tweet: Tweet dictionary
+    :return: True if the 'referenced_tweets' of the tweet has a retweeted tweet. The API leaves out 'referenced_tweets'
+    of a tweet that doesn't reference any, and archived tweets have it for retweets, see
+    twitter_archive_import.archived_tweets, so a tweet without it isn't a retweet
+    """
+    return any(referenced["type"] == "retweeted" for referenced in tweet.get("referenced_tweets", ()))
+
+
+def retweeted_tweet_id(tweet):
+    """
+    :param tweet: Tweet dictionary
+    :return: ID of the tweet a retweet retweeted, from 'referenced_tweets'. None if it isn't there
+    """
+    for referenced in tweet.get("referenced_tweets", ()):
+        if referenced["type"] == "retweeted":
+            return referenced.get("id")
+    return None
+
+
+class BleachRule:
+    """
+    Predicate on an item. Combine rules with & (and), | (or) and ~ (not)
+    """
+
+    def __init__(self, description, make_predicate, tweet_fields=(), user_fields=(), needs_pinned_tweet_id=False):
+        """
+        :param description: Readable description of the rule, for logging
+        :param make_predicate: Function taking the rule context dictionary and returning the predicate, a function
+        taking an item and returning True if the item matches, False if it doesn't and None if it is missing a field
+        needed to tell
+        :param tweet_fields: tweet.fields the rule looks at
+        :param user_fields: user.fields the rule looks at
+        :param needs_pinned_tweet_id: True if the rule needs the 'pinned_tweet_id' of the account in the context
+        """
+        self.description = description
+        self.make_predicate = make_predicate
+        self.tweet_fields = frozenset(tweet_fields)
+        self.user_fields = frozenset(user_fields)
+        self.needs_pinned_tweet_id = needs_pinned_tweet_id
+
+    def __repr__(self):
+        return self.description
+
+    def _combine(self, other, description, make_predicate):
+        return BleachRule(description, make_predicate,
+                          tweet_fields=self.tweet_fields | other.tweet_fields,
+                          user_fields=self.user_fields | other.user_fields,
+                          needs_pinned_tweet_id=self.needs_pinned_tweet_id or other.needs_pinned_tweet_id)
+
+    def __and__(self, other):
+        def make_predicate(context):
+            left, right = self.make_predicate(context), other.make_predicate(context)
+
+            def predicate(item):
+                left_matches = left(item)
+                if left_matches is False:
+                    return False
+                right_matches = right(item)
+                if right_matches is False:
+                    return False
+                return None if left_matches is None or right_matches is None else True
+            return predicate
+        return self._combine(other, f"({self} and {other})", make_predicate)
+
+    def __or__(self, other):
+        def make_predicate(context):
+            left, right = self.make_predicate(context), other.make_predicate(context)
+
+            def predicate(item):
+                left_matches = left(item)
+                if left_matches is True:
+                    return True
+                right_matches = right(item)
+                if right_matches is True:
+                    return True
+                return None if left_matches is None or right_matches is None else False
+            return predicate
+        return self._combine(other, f"({self} or {other})", make_predicate)
+
+    def __invert__(self):
+        def make_predicate(context):
+            predicate = self.make_predicate(context)
+
+            def inverted_predicate(item):
+                matches = predicate(item)
+                # Not knowing stays not knowing, the item is kept either way
+                return None if matches is None else not matches
+            return inverted_predicate
+        return BleachRule(f"not {self}", make_predicate, self.tweet_fields, self.user_fields,
+                          self.needs_pinned_tweet_id)
+
+    def compile(self, context=None):
+        """
+        :param context: Dictionary of details about the account and run. 'now' is the datetime the date rules count
+        back from, default the current time. 'pinned_tweet_id' is the pinned tweet of the account
+        :return: Function taking an item and returning True if the item matches the rule. False if it doesn't, or if
+        it is missing a field needed to tell
+        """
+        context = dict(context or {})
+        context.setdefault("now", datetime.datetime.now(datetime.timezone.utc))
+        predicate = self.make_predicate(context)
+        return lambda item: predicate(item) is True
+
+
+def _check_number(name, value, minimum=None):
+    """
+    :raises ValueError: If value isn't an int or a float, or is below minimum. Checked when the rule is made so a bad
+    rule is rejected before a run starts instead of failing on every item
+    """
+    # bool is an int to Python, but True likes is a mistake
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"{name} must be a number, not {value!r}")
+    if minimum is not None and value < minimum:
+        raise ValueError(f"{name} must be at least {minimum}, not {value!r}")
+
+
+def rule_fields(fields, bleach_rule, always=()):
+    """
+    Comma separated fields to ask the API for
+
+    :param fields: 'tweet_fields' or 'user_fields'
+    :param bleach_rule: BleachRule of the run, None for no rule
+    :param always: Fields needed whatever the rule
+    :return: String for the tweet_fields or user_fields parameter, None if no fields are needed
+    """
+    needed = set(always)
+    if bleach_rule is not None:
+        needed |= getattr(bleach_rule, fields)
+    return ",".join(sorted(needed)) if needed else None
+
+
+def match_all():
+    return BleachRule("all", lambda context: lambda item: True)
+
+
+def created_before_days_ago(days):
+    """
+    :param days: Age in days
+    :return: Rule matching items created more than days ago
+    :raises ValueError: If days isn't a number of days a date can go back
+    """
+    _check_number("days", days, minimum=0)
+    try:
+        datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)
+    except OverflowError:
+        raise ValueError(f"days {days} goes back too far")
+
+    def make_predicate(context):
+        cutoff = (context["now"] - datetime.timedelta(days=days)).astimezone(datetime.timezone.utc)
+        cutoff = cutoff.strftime(TWITTER_TIME_FORMAT)
+        return lambda item: None if item.get("created_at") is None else item["created_at"] < cutoff
+    return BleachRule(f"created more than {days} days ago", make_predicate, tweet_fields=("created_at",),
+                      user_fields=("created_at",))
+
+
+def text_contains_any(keywords, case_sensitive=False):
+    """
+    :param keywords: Words or phrases to look for
+    :param case_sensitive: Default False
+    :return: Rule matching tweets whose text contains any of the keywords
+    """
+    pattern = re.compile("|".join(re.escape(keyword) for keyword in keywords), 0 if case_sensitive else re.IGNORECASE)
+    return BleachRule(f"text contains any of {list(keywords)}",
+                      lambda context: lambda item: None if item.get("text") is None
+                      else pattern.search(item["text"]) is not None)
+
+
+def text_matches(regular_expression):
+    """
+    :param regular_expression: Regular expression searched for in the text
+    :return: Rule matching tweets whose text matches
+    """
+    pattern = re.compile(regular_expression)
+    return BleachRule(f"text matches '{regular_expression}'",
+                      lambda context: lambda item: None if item.get("text") is None
+                      else pattern.search(item["text"]) is not None)
+
+
+def public_metric_below(metric, threshold):
+    """
+    :param metric: Name in 'public_metrics', e.g. 'like_count' of a tweet or 'followers_count' of a user
+    :param threshold: Items with the metric below this match
+    :return: Rule matching items with a low metric
+    :raises ValueError: If metric isn't a string or threshold isn't a number
+    """
+    if not isinstance(metric, str):
+        raise ValueError(f"metric must be the name of a public metric, not {metric!r}")
+    _check_number("threshold", threshold)
+
+    def predicate(item):
+        value = item.get("public_metrics", {}).get(metric)
+        return None if value is None else value < threshold
+    return BleachRule(f"{metric} below {threshold}", lambda context: predicate,
+                      tweet_fields=("public_metrics",), user_fields=("public_metrics",))
+
+
+_tweet_engagement_metrics = ("like_count", "retweet_count", "reply_count", "quote_count")
+
+
+def engagement_below(threshold):
+    """
+    :param threshold: Tweets with fewer likes, retweets, replies and quotes added together match
+    :return: Rule matching tweets with low engagement
+    :raises ValueError: If threshold isn't a number
+    """
+    _check_number("threshold", threshold)
+
+    def predicate(item):
+        public_metrics = item.get("public_metrics")
+        if public_metrics is None:
+            return None
+        return sum(public_metrics.get(metric, 0) for metric in _tweet_engagement_metrics) < threshold
+    return BleachRule(f"engagement below {threshold}", lambda context: predicate, tweet_fields=("public_metrics",))
+
+
+def is_retweet():
+    return BleachRule("is retweet", lambda context: tweet_is_retweet, tweet_fields=("referenced_tweets",))
+
+
+def is_reply():
+    # The API leaves out 'referenced_tweets' of a tweet that doesn't reference any, and archived tweets have it for
+    # replies, see twitter_archive_import.archived_tweets, so a tweet without it isn't a reply
+    def predicate(item):
+        return any(referenced["type"] == "replied_to" for referenced in item.get("referenced_tweets", ()))
+    return BleachRule("is reply", lambda context: predicate, tweet_fields=("referenced_tweets",))
+
+
+def is_pinned():
+    def make_predicate(context):
+        pinned_tweet_id = context.get("pinned_tweet_id")
+        return lambda item: pinned_tweet_id is not None and item["id"] == pinned_tweet_id
+    return BleachRule("is pinned", make_predicate, needs_pinned_tweet_id=True)
+
+
+def item_id_in(item_ids):
+    """
+    :param item_ids: Twitter IDs of tweets or users
+    :return: Rule matching the items with the IDs
+    """
+    item_ids = frozenset(item_ids)
+    return BleachRule(f"ID in {len(item_ids)} IDs", lambda context: lambda item: item["id"] in item_ids)
+
+
+def username_in(usernames):
+    """
+    :param usernames: Twitter usernames, without the '@'. Not case sensitive
+    :return: Rule matching users with the usernames
+    """
+    usernames = frozenset(username.lower() for username in usernames)
+    return BleachRule(f"username in {sorted(usernames)}",
+                      lambda context: lambda item: None if item.get("username") is None
+                      else item["username"].lower() in usernames)
+
+
+def user_is_verified():
+    return BleachRule("user is verified", lambda context: lambda item: None if item.get("verified") is None
+                      else item["verified"] is True,
+                      user_fields=("verified",))
+
+
+# Functions a rule given as text can be made of
+_rule_functions = {function.__name__: function for function in (
+    match_all, created_before_days_ago, text_contains_any, text_matches, public_metric_below, engagement_below,
+    is_retweet, is_reply, is_pinned, item_id_in, username_in, user_is_verified)}
+
+
+def parse_rule(expression):
+    """
+    Make a rule from text, e.g. 'created_before_days_ago(365) & ~is_pinned()'. Only calls of the rule functions of this
+    module with literal arguments, &, |, ~ and parentheses are allowed. Nothing in the text is run
+
+    :param expression: Rule as text
+    :return: BleachRule
+    :raises ValueError: If the text isn't a rule
+    """
+    try:
+        return _rule_from_node(ast.parse(expression.strip(), mode="eval").body)
+    except SyntaxError as e:
+        raise ValueError(f"invalid syntax at column {e.offset}")
+    except (RecursionError, MemoryError):
+        # What the parser raises for deeply nested text
+        raise ValueError("nested too deeply")
+
+
+def _rule_from_node(node):
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitAnd):
+        return _rule_from_node(node.left) & _rule_from_node(node.right)
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitOr):
+        return _rule_from_node(node.left) | _rule_from_node(node.right)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Invert):
+        return ~_rule_from_node(node.operand)
+    if not isinstance(node, ast.Call):
+        raise ValueError(f"only rule functions combined with &, | and ~ are allowed, not {type(node).__name__}")
+    if not isinstance(node.func, ast.Name) or node.func.id not in _rule_functions:
+        raise ValueError(f"unknown rule function, use one of {', '.join(sorted(_rule_functions))}")
+
+    function_name = node.func.id
+    try:
+        arguments = [ast.literal_eval(argument) for argument in node.args]
+        keyword_arguments = {}
+        for keyword in node.keywords:
+            if keyword.arg is None:
+                raise ValueError()
+            keyword_arguments[keyword.arg] = ast.literal_eval(keyword.value)
+    except ValueError:
+        raise ValueError(f"arguments of {function_name} must be numbers, strings, booleans or lists of them")
+    try:
+        return _rule_functions[function_name](*arguments, **keyword_arguments)
+    except (TypeError, ValueError, re.error) as e:
+        raise ValueError(f"{function_name}: {e}")
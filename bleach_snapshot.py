@@ -0,0 +1,396 @@
+import datetime
+import json
+import logging
+import sqlite3
+import threading
+
+from wrapped_pytwitter_api import *
+from bleach_checkpoint import BLEACH_TYPE_LIKES, BLEACH_TYPE_TWEETS, BLEACH_TYPE_FOLLOWS
+from api_call_ledger import ACTION_RESTORE_FOLLOW
+from page_prefetcher import fetch_page_with_retries
+
+# Snapshot of an account taken before it is bleached
+#
+# The tweets, likes and follows of the account are paged through and saved to an indexed SQLite database, so
+# questions like "did we remove X" are a query instead of a search through the logs. Every snapshot is kept, with the
+# time it was taken. The raw item from the API is kept alongside the indexed columns. A snapshot records which kinds
+# of items it went through all the pages of, e.g. a snapshot taken before bleaching only likes has no follows.
+#
+# Follows can be restored from a snapshot. The follows are made through the same WrappedPyTwitterAPI, so they are
+# paced by its rate limit scheduler, 50 follows per 15 min. Each restored follow is recorded in the snapshot, a
+# stopped restore picks up where it left off. By default the latest snapshot with the follows is restored. Snapshots
+# shouldn't be taken of follows that are already partly bleached, see BleachCheckpointStore.unfinished_bleach_types,
+# so that is the one taken before the follows were bleached.
+#
+# Pages are read through fetch_page_with_retries like the bleach loops, so a 401, 429 or 503 is retried before the
+# snapshot gives up.
+#
+
+# Kinds of bleaching whose items are saved in a snapshot. Blocks, mutes and lists aren't
+SNAPSHOT_BLEACH_TYPES = (BLEACH_TYPE_TWEETS, BLEACH_TYPE_LIKES, BLEACH_TYPE_FOLLOWS)
+
+SNAPSHOT_TWEET_FIELDS = "created_at,public_metrics"
+SNAPSHOT_LIKED_TWEET_FIELDS = "created_at,author_id,public_metrics"
+# id, name and username as in schemas/twitter_user_api_schema.json, plus details useful to decide what to restore
+SNAPSHOT_USER_FIELDS = "created_at,description,protected,verified,public_metrics"
+
+_snapshot_schema = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    snapshot_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    taken_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS snapshot_bleach_types (
+    snapshot_id INTEGER NOT NULL,
+    bleach_type TEXT NOT NULL,
+    PRIMARY KEY (snapshot_id, bleach_type)
+);
+CREATE TABLE IF NOT EXISTS tweets (
+    snapshot_id INTEGER NOT NULL,
+    tweet_id TEXT NOT NULL,
+    text TEXT,
+    created_at TEXT,
+    retweet_count INTEGER,
+    reply_count INTEGER,
+    like_count INTEGER,
+    quote_count INTEGER,
+    item_json TEXT NOT NULL,
+    PRIMARY KEY (snapshot_id, tweet_id)
+);
+CREATE INDEX IF NOT EXISTS tweets_tweet_id ON tweets (tweet_id);
+CREATE INDEX IF NOT EXISTS tweets_created_at ON tweets (snapshot_id, created_at);
+CREATE TABLE IF NOT EXISTS likes (
+    snapshot_id INTEGER NOT NULL,
+    tweet_id TEXT NOT NULL,
+    text TEXT,
+    author_id TEXT,
+    created_at TEXT,
+    item_json TEXT NOT NULL,
+    PRIMARY KEY (snapshot_id, tweet_id)
+);
+CREATE INDEX IF NOT EXISTS likes_tweet_id ON likes (tweet_id);
+CREATE TABLE IF NOT EXISTS follows (
+    snapshot_id INTEGER NOT NULL,
+    followed_user_id TEXT NOT NULL,
+    username TEXT,
+    name TEXT,
+    followers_count INTEGER,
+    item_json TEXT NOT NULL,
+    restored_at TEXT,
+    PRIMARY KEY (snapshot_id, followed_user_id)
+);
+CREATE INDEX IF NOT EXISTS follows_followed_user_id ON follows (followed_user_id);
+CREATE INDEX IF NOT EXISTS follows_username ON follows (username COLLATE NOCASE);
+"""
+
+# Table and ID column holding the items of each bleach type
+_snapshot_tables = {
+    BLEACH_TYPE_TWEETS: ("tweets", "tweet_id"),
+    BLEACH_TYPE_LIKES: ("likes", "tweet_id"),
+    BLEACH_TYPE_FOLLOWS: ("follows", "followed_user_id"),
+}
+
+
+def _utc_now_iso():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+
+
+class BleachSnapshotStore:
+    """
+    SQLite backed store of account snapshots. Can be shared between threads.
+    """
+
+    def __init__(self, database_path=":memory:"):
+        """
+        :param database_path: Path of the SQLite file. Default is ':memory:', which keeps snapshots only for the life
+        of the process
+        """
+        self.database_path = database_path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(database_path, check_same_thread=False)
+        self._connection.executescript(_snapshot_schema)
+        self._connection.commit()
+
+    def _execute(self, sql, parameters=(), commit=False):
+        with self._lock:
+            cursor = self._connection.execute(sql, parameters)
+            rows = cursor.fetchall()
+            if commit:
+                self._connection.commit()
+            return rows
+
+    def _execute_many(self, sql, parameter_rows):
+        with self._lock:
+            with self._connection:
+                self._connection.executemany(sql, parameter_rows)
+
+    def new_snapshot(self, user_id):
+        """
+        :param user_id: Twitter ID of the account
+        :return: ID of the new, empty, snapshot
+        """
+        with self._lock:
+            with self._connection:
+                cursor = self._connection.execute("INSERT INTO snapshots (user_id, taken_at) VALUES (?, ?)",
+                                                  (user_id, _utc_now_iso()))
+                return cursor.lastrowid
+
+    def mark_complete(self, snapshot_id, bleach_type):
+        """
+        Record that every page of the items of the bleach type has been saved to the snapshot
+
+        :param snapshot_id: ID of the snapshot
+        :param bleach_type: One of the BLEACH_TYPE_ values
+        :return: None
+        """
+        self._execute("INSERT OR IGNORE INTO snapshot_bleach_types (snapshot_id, bleach_type) VALUES (?, ?)",
+                      (snapshot_id, bleach_type), commit=True)
+
+    def bleach_types(self, snapshot_id):
+        """
+        :param snapshot_id: ID of the snapshot
+        :return: Set of the BLEACH_TYPE_ values the snapshot has all the items of
+        """
+        return {row[0] for row in self._execute("SELECT bleach_type FROM snapshot_bleach_types WHERE snapshot_id = ?",
+                                                (snapshot_id,))}
+
+    def latest_snapshot_id(self, user_id, bleach_type=None):
+        """
+        :param user_id: Twitter ID of the account
+        :param bleach_type: Only snapshots with all the items of this BLEACH_TYPE_ value. Default None, any snapshot
+        :return: ID of the latest snapshot of the account, None if there isn't one
+        """
+        if bleach_type is None:
+            rows = self._execute("SELECT MAX(snapshot_id) FROM snapshots WHERE user_id = ?", (user_id,))
+            return rows[0][0]
+
+        # Snapshots saved before the bleach types were recorded count if they have any of the items
+        table, _ = _snapshot_tables[bleach_type]
+        rows = self._execute("SELECT MAX(snapshot_id) FROM snapshots WHERE user_id = ? AND ("
+                             "snapshot_id IN (SELECT snapshot_id FROM snapshot_bleach_types WHERE bleach_type = ?) OR ("
+                             "snapshot_id NOT IN (SELECT snapshot_id FROM snapshot_bleach_types) AND "
+                             f"snapshot_id IN (SELECT snapshot_id FROM {table})))",
+                             (user_id, bleach_type))
+        return rows[0][0]
+
+    def add_tweets(self, snapshot_id, tweets):
+        self._execute_many("INSERT OR REPLACE INTO tweets (snapshot_id, tweet_id, text, created_at, retweet_count, "
+                           "reply_count, like_count, quote_count, item_json) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           [(snapshot_id, tweet["id"], tweet.get("text"), tweet.get("created_at"),
+                             tweet.get("public_metrics", {}).get("retweet_count"),
+                             tweet.get("public_metrics", {}).get("reply_count"),
+                             tweet.get("public_metrics", {}).get("like_count"),
+                             tweet.get("public_metrics", {}).get("quote_count"),
+                             json.dumps(tweet)) for tweet in tweets])
+
+    def add_likes(self, snapshot_id, liked_tweets):
+        self._execute_many("INSERT OR REPLACE INTO likes (snapshot_id, tweet_id, text, author_id, created_at, "
+                           "item_json) VALUES (?, ?, ?, ?, ?, ?)",
+                           [(snapshot_id, tweet["id"], tweet.get("text"), tweet.get("author_id"),
+                             tweet.get("created_at"), json.dumps(tweet)) for tweet in liked_tweets])
+
+    def add_follows(self, snapshot_id, followed_users):
+        self._execute_many("INSERT OR REPLACE INTO follows (snapshot_id, followed_user_id, username, name, "
+                           "followers_count, item_json) VALUES (?, ?, ?, ?, ?, ?)",
+                           [(snapshot_id, user["id"], user.get("username"), user.get("name"),
+                             user.get("public_metrics", {}).get("followers_count"),
+                             json.dumps(user)) for user in followed_users])
+
+    def find(self, bleach_type, item_id):
+        """
+        Find an item in every snapshot it was in
+
+        :param bleach_type: One of the BLEACH_TYPE_ values
+        :param item_id: Twitter ID of the tweet, or of the user for follows
+        :return: List of (snapshot_id, item dictionary), oldest snapshot first
+        """
+        table, id_column = _snapshot_tables[bleach_type]
+        rows = self._execute(f"SELECT snapshot_id, item_json FROM {table} WHERE {id_column} = ? ORDER BY snapshot_id",
+                             (item_id,))
+        return [(snapshot_id, json.loads(item_json)) for snapshot_id, item_json in rows]
+
+    def find_followed_user(self, username):
+        """
+        :param username: Twitter username, without the '@'. Not case sensitive
+        :return: List of (snapshot_id, user dictionary), oldest snapshot first
+        """
+        rows = self._execute("SELECT snapshot_id, item_json FROM follows WHERE username = ? COLLATE NOCASE "
+                             "ORDER BY snapshot_id", (username,))
+        return [(snapshot_id, json.loads(item_json)) for snapshot_id, item_json in rows]
+
+    def was_removed(self, bleach_type, item_id, checkpoint):
+        """
+        Did we remove X. True if the item was in a snapshot and the bleach checkpoint records it as done
+
+        :param bleach_type: One of the BLEACH_TYPE_ values
+        :param item_id: Twitter ID of the tweet, or of the user for follows
+        :param checkpoint: BleachCheckpoint of the bleach type and account
+        :return: True if the item was removed
+        """
+        return len(self.find(bleach_type, item_id)) > 0 and checkpoint.is_processed(item_id)
+
+    def counts(self, snapshot_id):
+        """
+        :param snapshot_id: ID of the snapshot
+        :return: Dictionary of bleach type to the number of items in the snapshot
+        """
+        return {bleach_type: self._execute(f"SELECT COUNT(*) FROM {table} WHERE snapshot_id = ?", (snapshot_id,))[0][0]
+                for bleach_type, (table, _) in _snapshot_tables.items()}
+
+    def follows_to_restore(self, snapshot_id, after_followed_user_id=None, limit=100):
+        """
+        :param snapshot_id: ID of the snapshot
+        :param after_followed_user_id: Only return users ordered after this ID. Default None, from the start
+        :param limit: Most follows to return
+        :return: List of followed user dictionaries not restored yet, ordered by user ID
+        """
+        rows = self._execute("SELECT item_json FROM follows WHERE snapshot_id = ? AND restored_at IS NULL "
+                             "AND followed_user_id > ? ORDER BY followed_user_id LIMIT ?",
+                             (snapshot_id, after_followed_user_id or "", limit))
+        return [json.loads(row[0]) for row in rows]
+
+    def mark_follow_restored(self, snapshot_id, followed_user_id):
+        self._execute("UPDATE follows SET restored_at = ? WHERE snapshot_id = ? AND followed_user_id = ?",
+                      (_utc_now_iso(), snapshot_id, followed_user_id), commit=True)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def _snapshot_pages(api, fetch_page, add_items, description):
+    pagination_token = None
+    item_count = 0
+    while True:
+        page = fetch_page_with_retries(api, fetch_page, pagination_token)
+        items = page.get("data", [])
+        add_items(items)
+        item_count += len(items)
+        logging.debug(f"Snapshot of {description}, {item_count} so far")
+
+        pagination_token = page.get("meta", {}).get("next_token")
+        if pagination_token is None:
+            return item_count
+
+
+def snapshot_bleach_types(bleach_types, unfinished_bleach_types=()):
+    """
+    Kinds a run already started on aren't snapshotted again, the snapshot from before that run is the one with
+    everything that was removed
+
+    :param bleach_types: BLEACH_TYPE_ values of the kinds about to be bleached
+    :param unfinished_bleach_types: BLEACH_TYPE_ values of the kinds the account has an unfinished run of
+    :return: List of the BLEACH_TYPE_ values to snapshot, empty if there is nothing to snapshot
+    """
+    return [bleach_type for bleach_type in bleach_types
+            if bleach_type in SNAPSHOT_BLEACH_TYPES and bleach_type not in unfinished_bleach_types]
+
+
+def take_snapshot(api, snapshot_store, bleach_types=SNAPSHOT_BLEACH_TYPES, twitter_user_id=None):
+    """
+    Save the tweets, likes and follows of the authenticated account to a new snapshot
+
+    :param api: Instance of an authenticated pytwitter2 WrappedPyTwitterAPI
+    :param snapshot_store: BleachSnapshotStore to save the snapshot to
+    :param bleach_types: BLEACH_TYPE_ values of the items to save. Default all of them
+    :param twitter_user_id: Twitter ID of the authenticated account. Default None, which looks it up
+    :return: ID of the snapshot
+    """
+    if twitter_user_id is None:
+        twitter_me = api.get_me(return_json=True)
+        twitter_user_id = twitter_me["data"]["id"]
+
+    snapshot_id = snapshot_store.new_snapshot(twitter_user_id)
+
+    if BLEACH_TYPE_TWEETS in bleach_types:
+        _snapshot_pages(api,
+                        lambda pagination_token: api.get_timelines(user_id=twitter_user_id,
+                                                                   return_json=True,
+                                                                   max_results=100,
+                                                                   tweet_fields=SNAPSHOT_TWEET_FIELDS,
+                                                                   pagination_token=pagination_token),
+                        lambda tweets: snapshot_store.add_tweets(snapshot_id, tweets),
+                        "tweets")
+        snapshot_store.mark_complete(snapshot_id, BLEACH_TYPE_TWEETS)
+
+    if BLEACH_TYPE_LIKES in bleach_types:
+        _snapshot_pages(api,
+                        lambda pagination_token: api.get_user_liked_tweets(user_id=twitter_user_id,
+                                                                           return_json=True,
+                                                                           max_results=100,
+                                                                           tweet_fields=SNAPSHOT_LIKED_TWEET_FIELDS,
+                                                                           pagination_token=pagination_token),
+                        lambda liked_tweets: snapshot_store.add_likes(snapshot_id, liked_tweets),
+                        "likes")
+        snapshot_store.mark_complete(snapshot_id, BLEACH_TYPE_LIKES)
+
+    if BLEACH_TYPE_FOLLOWS in bleach_types:
+        _snapshot_pages(api,
+                        lambda pagination_token: api.get_following(user_id=twitter_user_id,
+                                                                   return_json=True,
+                                                                   max_results=1000,
+                                                                   user_fields=SNAPSHOT_USER_FIELDS,
+                                                                   pagination_token=pagination_token),
+                        lambda followed_users: snapshot_store.add_follows(snapshot_id, followed_users),
+                        "follows")
+        snapshot_store.mark_complete(snapshot_id, BLEACH_TYPE_FOLLOWS)
+
+    logging.info(f"Snapshot {snapshot_id} of user '{twitter_user_id}' taken. "
+                 f"Items {snapshot_store.counts(snapshot_id)}")
+    return snapshot_id
+
+
+def _follow_user(api, twitter_user_id, followed_user_id):
+    while True:
+        try:
+            with api.call_ledger.action(ACTION_RESTORE_FOLLOW, followed_user_id):
+                return api.follow_user(user_id=twitter_user_id, target_user_id=followed_user_id)
+        except WrappedPyTwitterAPIRateLimitExceededException:
+            # The API scheduler will hold the next follow until the rate limit window resets
+            logging.info("Follow rate limit exceeded. Waiting for window to reset")
+        except WrappedPyTwitterAPIUnauthorizedException:
+            logging.info("Authentication failed. Access token may have expired")
+            api.refresh_access_token()
+
+
+def restore_follows(api, snapshot_store, snapshot_id=None, follow_limit=None):
+    """
+    Follow again the users followed in a snapshot
+
+    :param api: Instance of an authenticated pytwitter2 WrappedPyTwitterAPI
+    :param snapshot_store: BleachSnapshotStore holding the snapshot
+    :param snapshot_id: ID of the snapshot to restore. Default None, the latest snapshot of the account with its follows
+    :param follow_limit: Limit of follows. Default is None, will restore all
+    :return: Number of users followed
+    """
+    twitter_me = api.get_me(return_json=True)
+    twitter_user_id = twitter_me["data"]["id"]
+
+    if snapshot_id is None:
+        snapshot_id = snapshot_store.latest_snapshot_id(twitter_user_id, bleach_type=BLEACH_TYPE_FOLLOWS)
+        if snapshot_id is None:
+            logging.warning(f"No snapshot of the follows of user '{twitter_user_id}' to restore")
+            return 0
+
+    total_users_followed = 0
+    last_followed_user_id = None
+    while follow_limit is None or total_users_followed < follow_limit:
+        followed_users = snapshot_store.follows_to_restore(snapshot_id, after_followed_user_id=last_followed_user_id)
+        if len(followed_users) == 0:
+            break
+
+        for followed_user in followed_users:
+            if follow_limit is not None and total_users_followed >= follow_limit:
+                break
+            last_followed_user_id = followed_user["id"]
+            try:
+                _follow_user(api, twitter_user_id, followed_user["id"])
+            except pytwitter.error.PyTwitterError as ptw:
+                # e.g. the user has been suspended. Leave it unrestored and carry on with the rest
+                logging.warning("Follow of user '{}' failed '{}'. Skipping".format(followed_user["id"], ptw.message))
+                continue
+            snapshot_store.mark_follow_restored(snapshot_id, followed_user["id"])
+            total_users_followed += 1
+
+    logging.info(f"Restored {total_users_followed} follows from snapshot {snapshot_id}")
+    return total_users_followed
@@ -0,0 +1,85 @@
+from wrapped_pytwitter_api import *
+from twitter_archive_import import archived_blocking
+from bleach_checkpoint import BLEACH_TYPE_BLOCKS
+from api_call_ledger import ACTION_UNBLOCK
+from bleach_existence_check import EXISTENCE_LOOKUP_USERS
+from bleach_engine import BleachPlugin, run_bleach_plugin, plan_bleach_plugin
+from bleach_rules import rule_fields
+
+# Use version2 Twitter API to unblock users
+# https://developer.twitter.com/en/docs/twitter-api/users/blocks/api-reference/delete-users-user_id-blocking
+#
+# The blocked users are listed 1000 a page, the list endpoint only allows 15 requests per 15 min. Unblocking has a
+# ratelimit of 50 requests per 15 min.
+#
+# Each unblock costs a single DELETE call, see ApiCallLedger
+#
+
+# Most users the blocking endpoint returns in a page
+MAX_BLOCKED_USERS_PER_PAGE = 1000
+
+
+class BlocksBleachPlugin(BleachPlugin):
+
+    bleach_type = BLEACH_TYPE_BLOCKS
+    list_endpoint = "GET /2/users/:id/blocking"
+    page_size = MAX_BLOCKED_USERS_PER_PAGE
+    archive_page_size = 100
+    archived_items = staticmethod(archived_blocking)
+    existence_lookup = EXISTENCE_LOOKUP_USERS
+    item_name = "blocked users"
+
+    def list_page(self, api, twitter_user_id, bleach_rule, pagination_token):
+        return api.get_blocking_users(twitter_user_id,
+                                      return_json=True,
+                                      max_results=MAX_BLOCKED_USERS_PER_PAGE,
+                                      user_fields=rule_fields("user_fields", bleach_rule),
+                                      pagination_token=pagination_token)
+
+    def action(self, blocked_user):
+        return ACTION_UNBLOCK
+
+    def remove(self, api, twitter_user_id, blocked_user, action):
+        return api.unblock_user(twitter_user_id, blocked_user["id"])
+
+
+def bleach_blocks(api, unblock_limit=None, archive_writer=None, checkpoint_store=None, twitter_archive_js_file=None,
+                  bleach_rule=None, existence_cache=None, _dont_actually_bleach=False):
+    """
+    Unblock the users the user has blocked
+
+    :param api: Instance of an authenticated pytwitter2 WrappedPyTwitterAPI
+    :param unblock_limit: Limit of unblocks. Default is None, which unblocks all
+    :param archive_writer: BleachArchiveWriter to archive the unblocked users to. Default is None, which is no archive
+    :param checkpoint_store: BleachCheckpointStore to resume from and record progress in. Default is None, which keeps
+    progress in memory for this run only
+    :param twitter_archive_js_file: Path to block.js from a downloaded Twitter archive to take the users to be
+    unblocked from instead of paging through the API. Default is None, which uses the API
+    :param bleach_rule: BleachRule choosing the users to unblock. Default is None, which unblocks all
+    :param existence_cache: ItemExistenceCache to look up queued blocked users with before unblocking them. Default is
+    None, no lookups
+    :param _dont_actually_bleach: boolean to not actually make DELETE API call. For testing. Default False
+    :return: Number of users unblocked
+    """
+
+    return run_bleach_plugin(api, BlocksBleachPlugin(), item_limit=unblock_limit, archive_writer=archive_writer,
+                             checkpoint_store=checkpoint_store, twitter_archive_js_file=twitter_archive_js_file,
+                             bleach_rule=bleach_rule, existence_cache=existence_cache,
+                             _dont_actually_bleach=_dont_actually_bleach)
+
+
+def plan_blocks(api, unblock_limit=None, checkpoint_store=None, twitter_archive_js_file=None, bleach_rule=None):
+    """
+    Count the API calls bleach_blocks would make and the time the rate limits would make it take. Nobody is unblocked
+
+    :param api: Instance of an authenticated pytwitter2 WrappedPyTwitterAPI
+    :param unblock_limit: Limit of unblocks. Default is None, which unblocks all
+    :param checkpoint_store: BleachCheckpointStore the run would resume from. Default is None, which plans a fresh run
+    :param twitter_archive_js_file: Path to block.js from a downloaded Twitter archive the run would use. Default is
+    None, which pages through the API
+    :param bleach_rule: BleachRule choosing the users to unblock. Default is None, which unblocks all
+    :return: BleachPlan
+    """
+
+    return plan_bleach_plugin(api, BlocksBleachPlugin(), item_limit=unblock_limit, checkpoint_store=checkpoint_store,
+                              twitter_archive_js_file=twitter_archive_js_file, bleach_rule=bleach_rule)
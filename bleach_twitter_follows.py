@@ -1,109 +1,92 @@
-import base64
-import logging
-import json
-import time
-
-import jsonschema
-
 from wrapped_pytwitter_api import *
+from twitter_archive_import import archived_following
+from bleach_checkpoint import BLEACH_TYPE_FOLLOWS
+from api_call_ledger import ACTION_UNFOLLOW
+from bleach_existence_check import EXISTENCE_LOOKUP_USERS
+from bleach_engine import BleachPlugin, run_bleach_plugin, plan_bleach_plugin
+from bleach_rules import rule_fields
 
 # Use version2 Twitter API to unfollow users
 # https://developer.twitter.com/en/docs/twitter-api/users/follows/api-reference/delete-users-source_id-following
 #
-# The API has a ratelimit of 50 unfollow requests per 15 min. Code will pause if rate limit is exceeded and
-# then continue.
+# The API has a ratelimit of 50 unfollow requests per 15 min. Requests are paced by the rate limit headers the API
+# returns, code will wait for the window to reset and then continue.
 #
 # For long runs, the code will refresh the authentication bearer token when it expires
 #
+# Progress is recorded in a checkpoint store so a stopped run can be started again without walking pages already done
+#
+# Each unfollow costs a single DELETE call, see ApiCallLedger. plan_follows reports the calls and time a run will take
+#
+# The loop itself is the shared one in bleach_engine.py, FollowsBleachPlugin is what is particular to follows
+#
+
+
+class FollowsBleachPlugin(BleachPlugin):
 
+    bleach_type = BLEACH_TYPE_FOLLOWS
+    list_endpoint = "GET /2/users/:id/following"
+    # The default max_results of the following endpoint
+    page_size = 100
+    listed_items_public_metric = "following_count"
+    archive_page_size = 100
+    archived_items = staticmethod(archived_following)
+    existence_lookup = EXISTENCE_LOOKUP_USERS
+    item_name = "followed users"
 
-def bleach_follows(api, unfollow_limit=None, follows_archive_csv_file=None, _dont_actually_bleach=False):
+    def list_page(self, api, twitter_user_id, bleach_rule, pagination_token):
+        # The page is validated against schemas/twitter_followers_endpoint_response_schema.json by the API object
+        return api.get_following(user_id=twitter_user_id,
+                                 return_json=True,
+                                 user_fields=rule_fields("user_fields", bleach_rule),
+                                 pagination_token=pagination_token)
+
+    def action(self, followed_user):
+        return ACTION_UNFOLLOW
+
+    def remove(self, api, twitter_user_id, followed_user, action):
+        return api.unfollow_user(twitter_user_id, followed_user["id"])
+
+
+def bleach_follows(api, unfollow_limit=None, archive_writer=None, checkpoint_store=None,
+                   twitter_archive_js_file=None, bleach_rule=None, existence_cache=None, _dont_actually_bleach=False):
     """
     Unfollow users for the user specified by the passed in ID.
 
     :param api: Instance of an authenticated pytwitter2 WrappedPyTwitterAPI
     :param unfollow_limit: Limit of unfollows. Default is None, will attempt to unfollow all
-    :param follows_archive_csv_file: File to write details of unfollowed user. Default is None
+    :param archive_writer: BleachArchiveWriter to archive the unfollowed users to. Default is None, which is no archive
+    :param checkpoint_store: BleachCheckpointStore to resume from and record progress in. Default is None, which keeps
+    progress in memory for this run only
+    :param twitter_archive_js_file: Path to following.js from a downloaded Twitter archive to take the users to be
+    unfollowed from instead of paging through the API. Default is None, which uses the API
+    :param bleach_rule: BleachRule choosing the users to unfollow. Default is None, which unfollows all
+    :param existence_cache: ItemExistenceCache to look up queued followed users with before unfollowing them, so the
+    ones already gone don't use up write requests. Default is None, no lookups
     :param _dont_actually_bleach: boolean to not actually make DELETE API call. For testing. Default False
     :return: Number of unfollowed accounts
     """
 
-    twitter_me = api.get_me(return_json=True)
-    twitter_user_id = twitter_me["data"]["id"]
-
-    total_users_unfollowed = 0
-
-    pagination_token = None
-
-    users_not_unfollowed = []
+    return run_bleach_plugin(api, FollowsBleachPlugin(), item_limit=unfollow_limit, archive_writer=archive_writer,
+                             checkpoint_store=checkpoint_store, twitter_archive_js_file=twitter_archive_js_file,
+                             bleach_rule=bleach_rule, existence_cache=existence_cache,
+                             _dont_actually_bleach=_dont_actually_bleach)
 
-    failed_requests_in_a_row = 0
-    max_failed_requests_in_a_row = 5
 
-    with open("schemas/twitter_followers_endpoint_response_schema.json") as response_schema_file:
-        followers_json_schema = json.load(response_schema_file)
-
-    while unfollow_limit is None or total_users_unfollowed <= unfollow_limit:
-
-        try:
-            following_query_result = api.get_following(user_id=twitter_user_id,
-                                                       return_json=True,
-                                                       pagination_token=pagination_token)
-
-            jsonschema.validate(following_query_result, followers_json_schema)
-            failed_requests_in_a_row = 0
-
-            users_to_unfollow = following_query_result["data"]+users_not_unfollowed
-
-            for followed_user in users_to_unfollow:
-                if unfollow_limit is not None and total_users_unfollowed > unfollow_limit:
-                    break
-
-                try:
-                    # TODO Unfollow here
-                    if not _dont_actually_bleach:
-                        unfollow_response = api.unfollow_user(twitter_user_id, followed_user["id"])
-                    total_users_unfollowed += 1
-                    if follows_archive_csv_file is not None:
-                        follows_archive_csv_file.write("{},\"{}\",{}\n".format(
-                            followed_user['id'],
-                            followed_user['name'].replace(',', '\,'),
-                            followed_user['username'].replace(',', '\,')
-                        ))
-
-                except WrappedPyTwitterAPIRateLimitExceededException:
-                    users_not_unfollowed.append(followed_user)
-                    logging.info(
-                        "Unfollow Twitter user rate limit exceeded. Waiting 15min. Unfollowed so far {}".format(
-                            total_users_unfollowed))
-                    time.sleep(900)
-                    continue
-
-            if 'next_token' not in following_query_result['meta'].keys():
-                break
-
-            pagination_token = following_query_result['meta']['next_token']
+def plan_follows(api, unfollow_limit=None, checkpoint_store=None, twitter_archive_js_file=None, bleach_rule=None):
+    """
+    Count the API calls bleach_follows would make and the time the rate limits would make it take. Nobody is
+    unfollowed
 
-        except WrappedPyTwitterAPIUnauthorizedException:
-            logging.info("Authentication failed. Access token may have expired")
-            api.refresh_access_token()
-            continue
-        except WrappedPyTwitterAPIServiceUnavailableException:
-            failed_requests_in_a_row += 1
-            if failed_requests_in_a_row < max_failed_requests_in_a_row:
-                logging.info("API service unavailable. Waiting 5 seconds, resetting pagination and trying again")
-                users_not_unfollowed = []
-                pagination_token = None
-                time.sleep(5)
-                continue
-            else:
-                logging.info("API service unavailable. Failed {} times in a row, max failed attempts {}. Bailing.".format(failed_requests_in_a_row, max_failed_requests_in_a_row))
-                break
-        except pytwitter.error.PyTwitterError as ptw:
-            logging.fatal("PyTwitterError with unknown message format '{}'".format(ptw.message['status'], ptw.message))
-            break
-        except Exception as e:
-            logging.fatal("Exception of unhandled type {}. Message is '{}'".format(type(e), e))
+    :param api: Instance of an authenticated pytwitter2 WrappedPyTwitterAPI
+    :param unfollow_limit: Limit of unfollows. Default is None, will attempt to unfollow all
+    :param checkpoint_store: BleachCheckpointStore the run would resume from. Default is None, which plans a fresh run
+    :param twitter_archive_js_file: Path to following.js from a downloaded Twitter archive the run would use. Default
+    is None, which pages through the API
+    :param bleach_rule: BleachRule choosing the users to unfollow. Default is None, which unfollows all
+    :return: BleachPlan
+    """
 
-    logging.debug(f"Total unfollows count {total_users_unfollowed}")
-    return total_users_unfollowed
+    return plan_bleach_plugin(api, FollowsBleachPlugin(), item_limit=unfollow_limit,
+                              checkpoint_store=checkpoint_store, twitter_archive_js_file=twitter_archive_js_file,
+                              bleach_rule=bleach_rule)
@@ -1,100 +1,89 @@
-import base64
-import logging
-import json
-import time
-
 from wrapped_pytwitter_api import *
+from twitter_archive_import import archived_likes
+from bleach_checkpoint import BLEACH_TYPE_LIKES
+from api_call_ledger import ACTION_UNLIKE
+from bleach_existence_check import EXISTENCE_LOOKUP_TWEETS
+from bleach_engine import BleachPlugin, run_bleach_plugin, plan_bleach_plugin
+from bleach_rules import rule_fields
 
 # Use version2 Twitter API to unlike tweets
 # https://developer.twitter.com/en/docs/twitter-api/tweets/likes/api-reference/delete-users-id-likes-tweet_id
 #
-# The API has a ratelimit of 50 unlikes requests per 15 min. Code will pause if rate limit is exceeded and
-# then continue.
+# The API has a ratelimit of 50 unlikes requests per 15 min. Requests are paced by the rate limit headers the API
+# returns, code will wait for the window to reset and then continue.
 #
 # For long runs, the code will refresh the authentication bearer token when it expires
 #
+# Progress is recorded in a checkpoint store so a stopped run can be started again without walking pages already done
+#
+# Each unlike costs a single DELETE call, see ApiCallLedger. plan_likes reports the calls and time a run will take
+#
+# The loop itself is the shared one in bleach_engine.py, LikesBleachPlugin is what is particular to likes
+#
+
+
+class LikesBleachPlugin(BleachPlugin):
 
+    bleach_type = BLEACH_TYPE_LIKES
+    list_endpoint = "GET /2/users/:id/liked_tweets"
+    page_size = 50
+    listed_items_public_metric = "like_count"
+    archive_page_size = 50
+    archived_items = staticmethod(archived_likes)
+    existence_lookup = EXISTENCE_LOOKUP_TWEETS
+    item_name = "liked tweets"
 
-def bleach_likes(api, unlike_limit=None, likes_archive_file=None, _dont_actually_bleach=False):
+    def list_page(self, api, twitter_user_id, bleach_rule, pagination_token):
+        return api.get_user_liked_tweets(user_id=twitter_user_id,
+                                         return_json=True,
+                                         max_results=50,
+                                         tweet_fields=rule_fields("tweet_fields", bleach_rule),
+                                         pagination_token=pagination_token)
+
+    def action(self, liked_tweet):
+        return ACTION_UNLIKE
+
+    def remove(self, api, twitter_user_id, liked_tweet, action):
+        return api.unlike_tweet(twitter_user_id, tweet_id=liked_tweet["id"])
+
+
+def bleach_likes(api, unlike_limit=None, archive_writer=None, checkpoint_store=None, twitter_archive_js_file=None,
+                 bleach_rule=None, existence_cache=None, _dont_actually_bleach=False):
     """
     Unlike all the tweets a user has liked in their timeline
 
     :param api: Instance of an authenticated pytwitter2 WrappedPyTwitterAPI
     :param unlike_limit: Limit of tweets to unlike. Default is None, which will unlike all
-    :param likes_archive_file: File to archive details of unliked tweets. Default is None, which is no archiving
+    :param archive_writer: BleachArchiveWriter to archive the unliked tweets to. Default is None, which is no archiving
+    :param checkpoint_store: BleachCheckpointStore to resume from and record progress in. Default is None, which keeps
+    progress in memory for this run only
+    :param twitter_archive_js_file: Path to like.js from a downloaded Twitter archive to take the items to be unliked
+    from instead of paging through the API. Default is None, which uses the API
+    :param bleach_rule: BleachRule choosing the tweets to unlike. Default is None, which unlikes all
+    :param existence_cache: ItemExistenceCache to look up queued liked tweets with before unliking them, so the ones
+    already gone don't use up write requests. Default is None, no lookups
     :param _dont_actually_bleach: boolean to not actually make DELETE API call. For testing. Default False
     :return: Number of tweets unliked
     """
 
-    twitter_me = api.get_me(return_json=True)
-    twitter_user_id = twitter_me["data"]["id"]
-
-    total_unliked_tweets = 0
-
-    tweet_ids_not_done = []
-    pagination_token = None
+    return run_bleach_plugin(api, LikesBleachPlugin(), item_limit=unlike_limit, archive_writer=archive_writer,
+                             checkpoint_store=checkpoint_store, twitter_archive_js_file=twitter_archive_js_file,
+                             bleach_rule=bleach_rule, existence_cache=existence_cache,
+                             _dont_actually_bleach=_dont_actually_bleach)
 
-    failed_requests_in_a_row = 0
-    max_failed_requests_in_a_row = 5
 
-    while unlike_limit is None or total_unliked_tweets <= unlike_limit:
-        try:
-            liked_tweets_query_result = api.get_user_liked_tweets(user_id=twitter_user_id,
-                                                                  return_json=True,
-                                                                  max_results=50,
-                                                                  pagination_token=pagination_token)
-            failed_requests_in_a_row = 0
-
-            if 'data' not in liked_tweets_query_result.keys():
-                logging.warning("Twitter response to liked data has no key 'data'. Skipping. Response JSON '{}'".format(base64.b64encode(json.dumps(liked_tweets_query_result).encode())))
-                continue
-
-            tweet_ids_to_do = list(map(lambda t: t["id"], liked_tweets_query_result['data']))
-
-            logging.debug("List of liked tweet IDs from API {}".format(tweet_ids_to_do))
-            logging.debug("List of liked tweet IDs residual from last run {}".format(tweet_ids_not_done))
-
-            tweet_ids_to_do = tweet_ids_not_done + tweet_ids_to_do
-
-            tweet_ids_not_done = []
-            for tweet_id in tweet_ids_to_do:
-                if unlike_limit is not None and total_unliked_tweets > unlike_limit:
-                    break
-
-                try:
-                    api.like_tweet(twitter_user_id, tweet_id=tweet_id)
-                    api.unlike_tweet(twitter_user_id, tweet_id=tweet_id)
-                    total_unliked_tweets += 1
-                except WrappedPyTwitterAPIRateLimitExceededException:
-                    tweet_ids_not_done.append(tweet_id)
-                    logging.info(
-                        "Unlike Tweet rate limit exceeded. Waiting 15min. Unliked so far {}".format(total_unliked_tweets))
-                    time.sleep(900)
-                    continue
-
-            if 'next_token' not in liked_tweets_query_result['meta'].keys():
-                break
-
-            pagination_token = liked_tweets_query_result['meta']['next_token']
+def plan_likes(api, unlike_limit=None, checkpoint_store=None, twitter_archive_js_file=None, bleach_rule=None):
+    """
+    Count the API calls bleach_likes would make and the time the rate limits would make it take. Nothing is unliked
 
-        except WrappedPyTwitterAPIUnauthorizedException:
-            logging.info("Authentication failed. Access token may have expired")
-            api.refresh_access_token()
-            continue
-        except WrappedPyTwitterAPIServiceUnavailableException:
-            failed_requests_in_a_row += 1
-            if failed_requests_in_a_row < max_failed_requests_in_a_row:
-                logging.info("API service unavailable. Waiting 5 seconds, resetting pagination and trying again")
-                tweet_ids_not_done = []
-                pagination_token = None
-                time.sleep(5)
-                continue
-            else:
-                logging.info("API service unavailable. Failed {} times in a row, max failed attempts {}. Bailing.".format(failed_requests_in_a_row, max_failed_requests_in_a_row))
-                break
-        except pytwitter.error.PyTwitterError as ptw:
-            logging.fatal("PyTwitterError with unknown message format '{}'".format(ptw.message['status'], ptw.message))
-            break
+    :param api: Instance of an authenticated pytwitter2 WrappedPyTwitterAPI
+    :param unlike_limit: Limit of tweets to unlike. Default is None, which will unlike all
+    :param checkpoint_store: BleachCheckpointStore the run would resume from. Default is None, which plans a fresh run
+    :param twitter_archive_js_file: Path to like.js from a downloaded Twitter archive the run would use. Default is
+    None, which pages through the API
+    :param bleach_rule: BleachRule choosing the tweets to unlike. Default is None, which unlikes all
+    :return: BleachPlan
+    """
 
-    logging.debug(f"Total likes {total_unliked_tweets}")
-    return total_unliked_tweets
+    return plan_bleach_plugin(api, LikesBleachPlugin(), item_limit=unlike_limit, checkpoint_store=checkpoint_store,
+                              twitter_archive_js_file=twitter_archive_js_file, bleach_rule=bleach_rule)
@@ -0,0 +1,83 @@
+from wrapped_pytwitter_api import *
+from bleach_checkpoint import BLEACH_TYPE_LISTS
+from api_call_ledger import ACTION_DELETE_LIST
+from bleach_engine import BleachPlugin, run_bleach_plugin, plan_bleach_plugin
+
+# Use version2 Twitter API to delete the lists the user owns
+# https://developer.twitter.com/en/docs/twitter-api/lists/manage-lists/api-reference/delete-lists-id
+#
+# The owned lists are listed 100 a page, the list endpoint only allows 15 requests per 15 min. Deleting a list has a
+# ratelimit of 300 requests per 15 min.
+#
+# A downloaded Twitter archive has no file of the lists owned and there is no multi-ID lookup for lists, so lists are
+# always paged from the API and never looked up before they are deleted. Rules see the 'name' and 'created_at' of a
+# list, not a 'text'.
+#
+# Each delete costs a single DELETE call, see ApiCallLedger
+#
+
+# Most lists the owned lists endpoint returns in a page
+MAX_OWNED_LISTS_PER_PAGE = 100
+
+# Asked for on every page so the date rules work on lists
+OWNED_LIST_FIELDS = "created_at"
+
+
+class ListsBleachPlugin(BleachPlugin):
+
+    bleach_type = BLEACH_TYPE_LISTS
+    list_endpoint = "GET /2/users/:id/owned_lists"
+    page_size = MAX_OWNED_LISTS_PER_PAGE
+    item_name = "owned lists"
+
+    def list_page(self, api, twitter_user_id, bleach_rule, pagination_token):
+        return api.get_user_owned_lists(twitter_user_id,
+                                        return_json=True,
+                                        max_results=MAX_OWNED_LISTS_PER_PAGE,
+                                        list_fields=OWNED_LIST_FIELDS,
+                                        pagination_token=pagination_token)
+
+    def action(self, owned_list):
+        return ACTION_DELETE_LIST
+
+    def remove(self, api, twitter_user_id, owned_list, action):
+        return api.delete_list(owned_list["id"])
+
+
+def bleach_lists(api, delete_limit=None, archive_writer=None, checkpoint_store=None, twitter_archive_js_file=None,
+                 bleach_rule=None, existence_cache=None, _dont_actually_bleach=False):
+    """
+    Delete the lists the user owns
+
+    :param api: Instance of an authenticated pytwitter2 WrappedPyTwitterAPI
+    :param delete_limit: Limit of lists to delete. Default is None, which deletes all
+    :param archive_writer: BleachArchiveWriter to archive the deleted lists to. Default is None, which is no archive
+    :param checkpoint_store: BleachCheckpointStore to resume from and record progress in. Default is None, which keeps
+    progress in memory for this run only
+    :param twitter_archive_js_file: Must be None, a downloaded Twitter archive has no owned lists
+    :param bleach_rule: BleachRule choosing the lists to delete. Default is None, which deletes all
+    :param existence_cache: Not used, there is no lookup for lists. Taken so every bleach function can be called alike
+    :param _dont_actually_bleach: boolean to not actually make DELETE API call. For testing. Default False
+    :return: Number of lists deleted
+    """
+
+    return run_bleach_plugin(api, ListsBleachPlugin(), item_limit=delete_limit, archive_writer=archive_writer,
+                             checkpoint_store=checkpoint_store, twitter_archive_js_file=twitter_archive_js_file,
+                             bleach_rule=bleach_rule, existence_cache=existence_cache,
+                             _dont_actually_bleach=_dont_actually_bleach)
+
+
+def plan_lists(api, delete_limit=None, checkpoint_store=None, twitter_archive_js_file=None, bleach_rule=None):
+    """
+    Count the API calls bleach_lists would make and the time the rate limits would make it take. Nothing is deleted
+
+    :param api: Instance of an authenticated pytwitter2 WrappedPyTwitterAPI
+    :param delete_limit: Limit of lists to delete. Default is None, which deletes all
+    :param checkpoint_store: BleachCheckpointStore the run would resume from. Default is None, which plans a fresh run
+    :param twitter_archive_js_file: Must be None, a downloaded Twitter archive has no owned lists
+    :param bleach_rule: BleachRule choosing the lists to delete. Default is None, which deletes all
+    :return: BleachPlan
+    """
+
+    return plan_bleach_plugin(api, ListsBleachPlugin(), item_limit=delete_limit, checkpoint_store=checkpoint_store,
+                              twitter_archive_js_file=twitter_archive_js_file, bleach_rule=bleach_rule)
@@ -0,0 +1,85 @@
+from wrapped_pytwitter_api import *
+from twitter_archive_import import archived_muting
+from bleach_checkpoint import BLEACH_TYPE_MUTES
+from api_call_ledger import ACTION_UNMUTE
+from bleach_existence_check import EXISTENCE_LOOKUP_USERS
+from bleach_engine import BleachPlugin, run_bleach_plugin, plan_bleach_plugin
+from bleach_rules import rule_fields
+
+# Use version2 Twitter API to unmute users
+# https://developer.twitter.com/en/docs/twitter-api/users/mutes/api-reference/delete-users-user_id-muting
+#
+# The muted users are listed 1000 a page, the list endpoint only allows 15 requests per 15 min. Unmuting has a
+# ratelimit of 50 requests per 15 min.
+#
+# Each unmute costs a single DELETE call, see ApiCallLedger
+#
+
+# Most users the muting endpoint returns in a page
+MAX_MUTED_USERS_PER_PAGE = 1000
+
+
+class MutesBleachPlugin(BleachPlugin):
+
+    bleach_type = BLEACH_TYPE_MUTES
+    list_endpoint = "GET /2/users/:id/muting"
+    page_size = MAX_MUTED_USERS_PER_PAGE
+    archive_page_size = 100
+    archived_items = staticmethod(archived_muting)
+    existence_lookup = EXISTENCE_LOOKUP_USERS
+    item_name = "muted users"
+
+    def list_page(self, api, twitter_user_id, bleach_rule, pagination_token):
+        return api.get_user_muting(twitter_user_id,
+                                   return_json=True,
+                                   max_results=MAX_MUTED_USERS_PER_PAGE,
+                                   user_fields=rule_fields("user_fields", bleach_rule),
+                                   pagination_token=pagination_token)
+
+    def action(self, muted_user):
+        return ACTION_UNMUTE
+
+    def remove(self, api, twitter_user_id, muted_user, action):
+        return api.unmute_user(twitter_user_id, muted_user["id"])
+
+
+def bleach_mutes(api, unmute_limit=None, archive_writer=None, checkpoint_store=None, twitter_archive_js_file=None,
+                 bleach_rule=None, existence_cache=None, _dont_actually_bleach=False):
+    """
+    Unmute the users the user has muted
+
+    :param api: Instance of an authenticated pytwitter2 WrappedPyTwitterAPI
+    :param unmute_limit: Limit of unmutes. Default is None, which unmutes all
+    :param archive_writer: BleachArchiveWriter to archive the unmuted users to. Default is None, which is no archive
+    :param checkpoint_store: BleachCheckpointStore to resume from and record progress in. Default is None, which keeps
+    progress in memory for this run only
+    :param twitter_archive_js_file: Path to mute.js from a downloaded Twitter archive to take the users to be
+    unmuted from instead of paging through the API. Default is None, which uses the API
+    :param bleach_rule: BleachRule choosing the users to unmute. Default is None, which unmutes all
+    :param existence_cache: ItemExistenceCache to look up queued muted users with before unmuting them. Default is
+    None, no lookups
+    :param _dont_actually_bleach: boolean to not actually make DELETE API call. For testing. Default False
+    :return: Number of users unmuted
+    """
+
+    return run_bleach_plugin(api, MutesBleachPlugin(), item_limit=unmute_limit, archive_writer=archive_writer,
+                             checkpoint_store=checkpoint_store, twitter_archive_js_file=twitter_archive_js_file,
+                             bleach_rule=bleach_rule, existence_cache=existence_cache,
+                             _dont_actually_bleach=_dont_actually_bleach)
+
+
+def plan_mutes(api, unmute_limit=None, checkpoint_store=None, twitter_archive_js_file=None, bleach_rule=None):
+    """
+    Count the API calls bleach_mutes would make and the time the rate limits would make it take. Nobody is unmuted
+
+    :param api: Instance of an authenticated pytwitter2 WrappedPyTwitterAPI
+    :param unmute_limit: Limit of unmutes. Default is None, which unmutes all
+    :param checkpoint_store: BleachCheckpointStore the run would resume from. Default is None, which plans a fresh run
+    :param twitter_archive_js_file: Path to mute.js from a downloaded Twitter archive the run would use. Default is
+    None, which pages through the API
+    :param bleach_rule: BleachRule choosing the users to unmute. Default is None, which unmutes all
+    :return: BleachPlan
+    """
+
+    return plan_bleach_plugin(api, MutesBleachPlugin(), item_limit=unmute_limit, checkpoint_store=checkpoint_store,
+                              twitter_archive_js_file=twitter_archive_js_file, bleach_rule=bleach_rule)
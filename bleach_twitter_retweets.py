@@ -0,0 +1,71 @@
+from wrapped_pytwitter_api import *
+from bleach_checkpoint import BLEACH_TYPE_RETWEETS
+from api_call_ledger import ACTION_REMOVE_RETWEET
+from bleach_engine import run_bleach_plugin, plan_bleach_plugin
+from bleach_rules import is_retweet
+from bleach_twitter_tweets import TweetsBleachPlugin
+
+# Undo the retweets on the account's timeline and leave its own tweets
+# https://developer.twitter.com/en/docs/twitter-api/tweets/retweets/api-reference/delete-users-id-retweets-tweet_id
+#
+# Pages through the same timeline as bleach_tweets and only queues the retweets. Progress is checkpointed separately
+# from bleach_tweets, so undoing the retweets first and deleting the tweets later doesn't walk the finished pages
+# twice for either of them.
+#
+# The undo endpoint takes the ID of the tweet that was retweeted, from the 'referenced_tweets' of the retweet. A
+# retweet without it, e.g. from a downloaded archive, is logged and left, see remove_retweet in bleach_twitter_tweets.py
+#
+# Each undo costs a single DELETE call, see ApiCallLedger
+#
+
+
+class RetweetsBleachPlugin(TweetsBleachPlugin):
+
+    bleach_type = BLEACH_TYPE_RETWEETS
+    item_name = "retweets"
+    item_rule = is_retweet()
+
+    def action(self, retweet):
+        return ACTION_REMOVE_RETWEET
+
+
+def bleach_retweets(api, undo_limit=None, archive_writer=None, checkpoint_store=None, twitter_archive_js_file=None,
+                    bleach_rule=None, existence_cache=None, _dont_actually_bleach=False):
+    """
+    Undo the retweets of the user
+
+    :param api: Instance of an authenticated pytwitter2 WrappedPyTwitterAPI
+    :param undo_limit: Limit of retweets to undo. Default is None, which undoes all
+    :param archive_writer: BleachArchiveWriter to archive the undone retweets to. Default is None, which is no archive
+    :param checkpoint_store: BleachCheckpointStore to resume from and record progress in. Default is None, which keeps
+    progress in memory for this run only
+    :param twitter_archive_js_file: Path to tweets.js from a downloaded Twitter archive to take the retweets from
+    instead of paging through the API. Default is None, which uses the API
+    :param bleach_rule: BleachRule choosing the retweets to undo. Default is None, which undoes all
+    :param existence_cache: ItemExistenceCache to look up queued retweets with before undoing them. Default is None,
+    no lookups
+    :param _dont_actually_bleach: boolean to not actually make DELETE API call. For testing. Default False
+    :return: Number of retweets undone
+    """
+
+    return run_bleach_plugin(api, RetweetsBleachPlugin(), item_limit=undo_limit, archive_writer=archive_writer,
+                             checkpoint_store=checkpoint_store, twitter_archive_js_file=twitter_archive_js_file,
+                             bleach_rule=bleach_rule, existence_cache=existence_cache,
+                             _dont_actually_bleach=_dont_actually_bleach)
+
+
+def plan_retweets(api, undo_limit=None, checkpoint_store=None, twitter_archive_js_file=None, bleach_rule=None):
+    """
+    Count the API calls bleach_retweets would make and the time the rate limits would make it take. Nothing is undone
+
+    :param api: Instance of an authenticated pytwitter2 WrappedPyTwitterAPI
+    :param undo_limit: Limit of retweets to undo. Default is None, which undoes all
+    :param checkpoint_store: BleachCheckpointStore the run would resume from. Default is None, which plans a fresh run
+    :param twitter_archive_js_file: Path to tweets.js from a downloaded Twitter archive the run would use. Default is
+    None, which pages through the API
+    :param bleach_rule: BleachRule choosing the retweets to undo. Default is None, which undoes all
+    :return: BleachPlan
+    """
+
+    return plan_bleach_plugin(api, RetweetsBleachPlugin(), item_limit=undo_limit, checkpoint_store=checkpoint_store,
+                              twitter_archive_js_file=twitter_archive_js_file, bleach_rule=bleach_rule)
@@ -1,93 +1,157 @@
-import logging
-import json
-import time
-
 from wrapped_pytwitter_api import *
+from twitter_archive_import import archived_tweets
+from bleach_checkpoint import BLEACH_TYPE_TWEETS
+from api_call_ledger import ACTION_DELETE_TWEET, ACTION_REMOVE_RETWEET
+from bleach_existence_check import EXISTENCE_LOOKUP_TWEETS
+from bleach_engine import BleachPlugin, BleachItemSkippedException, run_bleach_plugin, plan_bleach_plugin
+from bleach_rules import rule_fields, tweet_is_retweet, retweeted_tweet_id
 
 # Loop through all the user tweets and delete them
 #
 # https://developer.twitter.com/en/docs/twitter-api/tweets/manage-tweets/api-reference/delete-tweets-id
 #
-# The API has a ratelimit of 50 delete requests per 15 min. Code will pause if rate limit is exceeded and
-# then continue.
+# The API has a ratelimit of 50 delete requests per 15 min. Requests are paced by the rate limit headers the API
+# returns, code will wait for the window to reset and then continue.
 #
 # For long runs, the code will refresh the authentication bearer token when it expires
 #
+# Progress is recorded in a checkpoint store so a stopped run can be started again without walking pages already done
+#
+# Each delete costs a single DELETE call, see ApiCallLedger. plan_tweets reports the calls and time a run will take
+#
+# The loop itself is the shared one in bleach_engine.py, TweetsBleachPlugin is what is particular to tweets
+#
+
+# Asked for on every page so retweets are told apart without looking at the text, and undone by the ID of the tweet
+# they retweeted
+TIMELINE_TWEET_FIELDS = ("referenced_tweets",)
+
+
+def tweet_rule_user_fields(bleach_rule):
+    """
+    :param bleach_rule: BleachRule of the run, None for no rule
+    :return: user_fields for get_me, None if the rule doesn't need any
+    """
+    if bleach_rule is not None and bleach_rule.needs_pinned_tweet_id:
+        return "pinned_tweet_id"
+    return None
+
+
+def tweet_rule_context(twitter_me):
+    """
+    :param twitter_me: get_me response JSON
+    :return: Context for BleachRule.compile
+    """
+    return {"pinned_tweet_id": twitter_me["data"].get("pinned_tweet_id")}
+
+
+def tweet_delete_action(tweet):
+    """
+    :param tweet: Tweet dictionary with 'referenced_tweets' or 'text'
+    :return: ACTION_REMOVE_RETWEET for a retweet, otherwise ACTION_DELETE_TWEET
+    """
+    if tweet_is_retweet(tweet):
+        return ACTION_REMOVE_RETWEET
+    return ACTION_DELETE_TWEET
+
+
+def remove_retweet(api, twitter_user_id, retweet):
+    """
+    Undo a retweet. The endpoint takes the ID of the tweet that was retweeted, not the ID of the retweet on the timeline
+
+    :param api: WrappedPyTwitterAPI
+    :param twitter_user_id: Twitter ID of the account
+    :param retweet: Tweet dictionary of the retweet, with 'referenced_tweets'
+    :return: Response JSON
+    :raises BleachItemSkippedException: If the retweet doesn't have the ID of the tweet it retweeted
+    """
+    source_tweet_id = retweeted_tweet_id(retweet)
+    if source_tweet_id is None:
+        raise BleachItemSkippedException("No ID of the retweeted tweet to undo the retweet with")
+    return api.remove_retweet_tweet(user_id=twitter_user_id, tweet_id=source_tweet_id)
 
 
-def bleach_tweets(api, delete_limit=None, tweets_archive_file=None, _dont_actually_bleach=False):
+def get_timeline_page(api, twitter_user_id, bleach_rule, pagination_token):
+    """
+    :param api: WrappedPyTwitterAPI
+    :param twitter_user_id: Twitter ID of the account
+    :param bleach_rule: BleachRule of the run, None for no rule
+    :param pagination_token: Token of the page. None for the first page
+    :return: Page of the account's timeline, with the fields the rule and tweet_delete_action need
+    """
+    return api.get_timelines(user_id=twitter_user_id,
+                             return_json=True,
+                             max_results=50,
+                             tweet_fields=rule_fields("tweet_fields", bleach_rule, always=TIMELINE_TWEET_FIELDS),
+                             pagination_token=pagination_token)
+
+
+class TweetsBleachPlugin(BleachPlugin):
+
+    bleach_type = BLEACH_TYPE_TWEETS
+    list_endpoint = "GET /2/users/:id/tweets"
+    page_size = 50
+    listed_items_public_metric = "tweet_count"
+    archive_page_size = 50
+    archived_items = staticmethod(archived_tweets)
+    existence_lookup = EXISTENCE_LOOKUP_TWEETS
+    item_name = "tweets"
+
+    def me_user_fields(self, bleach_rule):
+        return tweet_rule_user_fields(bleach_rule)
+
+    def rule_context(self, twitter_me):
+        return tweet_rule_context(twitter_me)
+
+    def list_page(self, api, twitter_user_id, bleach_rule, pagination_token):
+        return get_timeline_page(api, twitter_user_id, bleach_rule, pagination_token)
+
+    def action(self, tweet):
+        return tweet_delete_action(tweet)
+
+    def remove(self, api, twitter_user_id, tweet, action):
+        if action == ACTION_REMOVE_RETWEET:
+            return remove_retweet(api, twitter_user_id, tweet)
+        return api.delete_tweet(tweet_id=tweet["id"])
+
+
+def bleach_tweets(api, delete_limit=None, archive_writer=None, checkpoint_store=None, twitter_archive_js_file=None,
+                  bleach_rule=None, existence_cache=None, _dont_actually_bleach=False):
     """
     Delete all tweets and retweets for a specified user
 
     :param api: Instance of an authenticated pytwitter2 WrappedPyTwitterAPI
     :param delete_limit: Limit of number of tweets to delete. Default is None, which is to delete all
-    :param tweets_archive_file: File to archive tweets to. Default is None, which is no archive
+    :param archive_writer: BleachArchiveWriter to archive the deleted tweets to. Default is None, which is no archive
+    :param checkpoint_store: BleachCheckpointStore to resume from and record progress in. Default is None, which keeps
+    progress in memory for this run only
+    :param twitter_archive_js_file: Path to tweets.js from a downloaded Twitter archive to take the items to be deleted
+    from instead of paging through the API. Default is None, which uses the API
+    :param bleach_rule: BleachRule choosing the tweets to delete. Default is None, which deletes all
+    :param existence_cache: ItemExistenceCache to look up queued tweets with before deleting them, so the ones
+    already gone don't use up write requests. Default is None, no lookups
     :param _dont_actually_bleach: boolean to not actually make DELETE API call. For testing. Default False
     :return: Total number of tweets deleted
     """
 
-    twitter_me = api.get_me(return_json=True)
-    twitter_user_id = twitter_me["data"]["id"]
-
-    total_tweets_deleted = 0
-    tweets_not_processed = []
-
-    pagination_token = None
-
-    while delete_limit is None or total_tweets_deleted <= delete_limit:
-        try:
-            user_tweets_query_result = api.get_timelines(user_id=twitter_user_id,
-                                                         return_json=True,
-                                                         max_results=50,
-                                                         pagination_token=pagination_token)
-
-            tweet_ids_to_delete = list(map(lambda t: t["id"], user_tweets_query_result['data']))
-
-            logging.debug("List of user '{}' tweet IDs to delete from API {}".format(twitter_user_id,
-                                                                                     tweet_ids_to_delete)
-                          )
-            logging.debug("List of user '{}' tweet IDs to delete residual from last run {}".format(twitter_user_id,
-                                                                                                   tweets_not_processed)
-                          )
-
-            tweets_to_process = user_tweets_query_result['data'] + tweets_not_processed
-            tweets_not_processed = []
-
-            for tweet in tweets_to_process:
-                if delete_limit is not None and total_tweets_deleted > delete_limit:
-                    break
-
-                logging.info("archive of tweet '{}'".format(json.dumps(tweet)))
-                try:
-                    if tweet['text'].startswith("RT "):
-                        delete_response = api.remove_retweet_tweet(user_id=twitter_user_id, tweet_id=tweet["id"])
-                    else:
-                        delete_response = api.delete_tweet(tweet_id=tweet["id"])
-                    logging.debug("Response to delete of tweet {} '{}'".format(tweet["id"], delete_response))
-                    total_tweets_deleted += 1
-
-                except WrappedPyTwitterAPIRateLimitExceededException:
-                    # NOTE There is a rate limit of 50 'delete tweet' per 15 min window
-                    # https://developer.twitter.com/en/docs/twitter-api/tweets/manage-tweets/api-reference/delete-tweets-id
-                    tweets_not_processed.append(tweet)
-                    logging.info(
-                        "Unlike Tweet rate limit exceeded. Waiting 15min. Deleted so far {}".format(
-                            total_tweets_deleted))
-                    time.sleep(900)
-                    continue
-
-            if 'next_token' not in user_tweets_query_result['meta'].keys():
-                break
-
-            pagination_token = user_tweets_query_result['meta']['next_token']
-
-        except WrappedPyTwitterAPIUnauthorizedException:
-            logging.info("Authentication failed. Access token may have expired")
-            api.refresh_access_token()
-            continue
-        except pytwitter.error.PyTwitterError as ptw:
-            logging.fatal("PyTwitterError with unknown message format '{}'".format(ptw.message['status'], ptw.message))
-            break
-
-    logging.debug(f"Total deleted {total_tweets_deleted}")
-    return total_tweets_deleted
+    return run_bleach_plugin(api, TweetsBleachPlugin(), item_limit=delete_limit, archive_writer=archive_writer,
+                             checkpoint_store=checkpoint_store, twitter_archive_js_file=twitter_archive_js_file,
+                             bleach_rule=bleach_rule, existence_cache=existence_cache,
+                             _dont_actually_bleach=_dont_actually_bleach)
+
+
+def plan_tweets(api, delete_limit=None, checkpoint_store=None, twitter_archive_js_file=None, bleach_rule=None):
+    """
+    Count the API calls bleach_tweets would make and the time the rate limits would make it take. Nothing is deleted
+
+    :param api: Instance of an authenticated pytwitter2 WrappedPyTwitterAPI
+    :param delete_limit: Limit of number of tweets to delete. Default is None, which is to delete all
+    :param checkpoint_store: BleachCheckpointStore the run would resume from. Default is None, which plans a fresh run
+    :param twitter_archive_js_file: Path to tweets.js from a downloaded Twitter archive the run would use. Default is
+    None, which pages through the API
+    :param bleach_rule: BleachRule choosing the tweets to delete. Default is None, which deletes all
+    :return: BleachPlan
+    """
+
+    return plan_bleach_plugin(api, TweetsBleachPlugin(), item_limit=delete_limit, checkpoint_store=checkpoint_store,
+                              twitter_archive_js_file=twitter_archive_js_file, bleach_rule=bleach_rule)
@@ -0,0 +1,152 @@
+import collections
+
+# Queue of the items a bleach loop still has to process
+#
+# Items are fetched a page at a time and added to the queue. The loop works from the front of the queue, an item
+# stays at the front until it is completed so an item that hit a rate limit or an expired token is simply tried
+# again. Items are de-duplicated by ID, an item that is already queued or already done is not added again, so
+# fetching the same page twice never repeats work.
+#
+# Done items are recorded in the checkpoint so work is done exactly once across runs. The queue also remembers a
+# bounded number of recently done IDs to avoid asking the checkpoint about items it just finished.
+#
+# Done items are archived and recorded in the checkpoint in batches when commit is called, normally once a page. The
+# archive is made durable first so the checkpoint never says an item is done before its archive line is on disk.
+#
+
+
+class BleachWorkQueueFullException(Exception):
+    pass
+
+
+class BleachWorkQueue:
+
+    def __init__(self, checkpoint, max_queued_items=1000, max_remembered_done_ids=10000, archive_writer=None):
+        """
+        :param checkpoint: BleachCheckpoint the progress is recorded in. Pending items in it are queued first
+        :param max_queued_items: Most items the queue will hold besides the pending items of the checkpoint, normally
+        the size of a page. Adding more raises BleachWorkQueueFullException
+        :param max_remembered_done_ids: Number of recently done IDs kept in memory. Should be more than the items
+        done between commits
+        :param archive_writer: BleachArchiveWriter completed items are archived to. Default None, no archive
+        """
+        pending_items = checkpoint.pending_items()
+
+        self.checkpoint = checkpoint
+        self.archive_writer = archive_writer
+        # Items left pending by an earlier run don't take up the room for a page
+        self.max_queued_items = max_queued_items + len(pending_items)
+        self.max_remembered_done_ids = max_remembered_done_ids
+
+        self._queued_items = collections.OrderedDict()
+        self._recently_done_ids = collections.OrderedDict()
+        self._uncommitted_done_ids = []
+
+        for item in pending_items:
+            self.add(item)
+
+    def __len__(self):
+        return len(self._queued_items)
+
+    def _remember_done(self, item_id):
+        self._recently_done_ids[item_id] = True
+        self._recently_done_ids.move_to_end(item_id)
+        if len(self._recently_done_ids) > self.max_remembered_done_ids:
+            self._recently_done_ids.popitem(last=False)
+
+    def is_done(self, item_id):
+        return item_id in self._recently_done_ids or self.checkpoint.is_processed(item_id)
+
+    def add(self, item):
+        """
+        Queue an item to be processed, unless it is already queued or done
+
+        :param item: Item dictionary from the API, must have an 'id' key
+        :return: True if the item was queued
+        :raises BleachWorkQueueFullException: If the queue already holds max_queued_items
+        """
+        item_id = item["id"]
+        if item_id in self._queued_items or self.is_done(item_id):
+            return False
+        if len(self._queued_items) >= self.max_queued_items:
+            raise BleachWorkQueueFullException(f"Work queue already has {len(self._queued_items)} items")
+        self._queued_items[item_id] = item
+        return True
+
+    def add_page(self, items):
+        """
+        :param items: Items from the 'data' of a page
+        :return: Number of items queued
+        """
+        return sum(1 for item in items if self.add(item))
+
+    def queued_items(self):
+        """
+        :return: List of the queued items, front first
+        """
+        return list(self._queued_items.values())
+
+    def peek(self):
+        """
+        :return: The item at the front of the queue, None if the queue is empty. The item stays queued until
+        complete or discard is called for it
+        """
+        if len(self._queued_items) == 0:
+            return None
+        return next(iter(self._queued_items.values()))
+
+    def complete(self, item_id):
+        """
+        Remove the item from the queue and archive it. It is recorded as done in the checkpoint on the next commit
+
+        :param item_id: ID of the item that was processed
+        :return: None
+        """
+        item = self._queued_items.pop(item_id, None)
+        if self.archive_writer is not None and item is not None:
+            self.archive_writer.write(self.checkpoint.bleach_type, self.checkpoint.user_id, item)
+        self._uncommitted_done_ids.append(item_id)
+        self._remember_done(item_id)
+
+    def commit(self):
+        """
+        Make the archive of the completed items durable, then record them as done in the checkpoint. Call before
+        saving the pagination token of the next page and before stopping
+
+        :return: None
+        """
+        if self.archive_writer is not None:
+            self.archive_writer.commit()
+        self.checkpoint.mark_processed_batch(self._uncommitted_done_ids)
+        self._uncommitted_done_ids = []
+
+    def drop(self, item_id):
+        """
+        Remove the item from the queue and record it as done on the next commit without archiving it, e.g. when it no
+        longer exists
+
+        :param item_id: ID of the item
+        :return: None
+        """
+        self._queued_items.pop(item_id, None)
+        self._uncommitted_done_ids.append(item_id)
+        self._remember_done(item_id)
+
+    def discard(self, item_id):
+        """
+        Remove the item from the queue without recording it as done, e.g. when not actually bleaching
+
+        :param item_id: ID of the item
+        :return: None
+        """
+        self._queued_items.pop(item_id, None)
+
+    def defer(self, item):
+        """
+        Keep the item at the front of the queue to try again and record it as pending in the checkpoint so it isn't
+        lost if the run stops. Used when a rate limit is hit
+
+        :param item: Item dictionary
+        :return: None
+        """
+        self.checkpoint.add_pending(item)
@@ -0,0 +1,453 @@
+import argparse
+import datetime
+import http.server
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+from rate_limit_scheduler import rate_limit_endpoint_key
+
+# Local stand in for the Twitter v2 API endpoints used by the bleach code
+#
+# Serves a synthetic account with a configurable number of tweets, liked tweets, followed, blocked and muted users and
+# owned lists so the bleach loops
+# can be run and measured without spending the quota of a real account. Supports
+#   - pagination with 'next_token'
+#   - per-endpoint rate limit windows, with the x-rate-limit-* headers and 429 responses
+#   - access tokens that expire, 401 responses and the OAuth2 refresh endpoint
+#   - random 503 responses
+#
+# Point a WrappedPyTwitterAPI at the server by setting BASE_URL_V2 on the instance
+#
+#   api.BASE_URL_V2 = "http://127.0.0.1:8765/2"
+#
+# Counts of requests by endpoint and response status are served from GET /mock/stats
+#
+
+MOCK_USER_ID = "2244994945"
+MOCK_FIRST_ITEM_ID = 1480000000000000000
+
+# IDs of the tweets the retweets of the account retweeted. Below the IDs of the account's own items so they never clash
+MOCK_FIRST_RETWEETED_ID = 1470000000000000000
+
+# Time the ages of the synthetic tweets count back from
+MOCK_NOW = datetime.datetime(2022, 2, 10, tzinfo=datetime.timezone.utc)
+
+
+class MockTwitterAccount:
+    """
+    Items of the synthetic account. IDs are kept in lists for pagination with a set of the ones still present so
+    deletes are O(1). The next_token of a page is the list index to continue from.
+    """
+
+    def __init__(self, tweet_count, like_count, following_count, user_id=MOCK_USER_ID, blocking_count=0,
+                 muting_count=0, owned_list_count=0):
+        self.user_id = user_id
+        self.tweet_ids = [str(MOCK_FIRST_ITEM_ID + i) for i in range(tweet_count)]
+        self.liked_tweet_ids = [str(MOCK_FIRST_ITEM_ID + tweet_count + i) for i in range(like_count)]
+        self.following_ids = [str(MOCK_FIRST_ITEM_ID + tweet_count + like_count + i) for i in range(following_count)]
+        next_id = MOCK_FIRST_ITEM_ID + tweet_count + like_count + following_count
+        self.blocking_ids = [str(next_id + i) for i in range(blocking_count)]
+        self.muting_ids = [str(next_id + blocking_count + i) for i in range(muting_count)]
+        self.owned_list_ids = [str(next_id + blocking_count + muting_count + i) for i in range(owned_list_count)]
+
+        # Every fifth tweet is a retweet, like the 'RT ' prefixed tweets seen on real timelines. Each one retweeted a
+        # different tweet, which is the ID the undo retweet endpoint takes
+        self.retweeted_ids = {retweet_id: str(MOCK_FIRST_RETWEETED_ID + i)
+                              for i, retweet_id in enumerate(self.tweet_ids[::5])}
+        self.retweet_ids_by_retweeted_id = {retweeted_id: retweet_id
+                                            for retweet_id, retweeted_id in self.retweeted_ids.items()}
+        self.retweet_ids = set(self.retweeted_ids)
+
+        self.tweets = set(self.tweet_ids)
+        self.likes = set(self.liked_tweet_ids)
+        self.following = set(self.following_ids)
+        self.blocking = set(self.blocking_ids)
+        self.muting = set(self.muting_ids)
+        self.owned_lists = set(self.owned_list_ids)
+        self.lock = threading.Lock()
+
+    def tweet(self, tweet_id, tweet_fields=()):
+        """
+        :return: Tweet dictionary with the tweet.fields asked for. Each tweet is a day older than the one after it and
+        has between 0 and 9 likes
+        """
+        text = ("RT @someone: tweet " if tweet_id in self.retweet_ids else "tweet ") + tweet_id
+        tweet = {"id": tweet_id, "text": text}
+        age = MOCK_FIRST_ITEM_ID + len(self.tweet_ids) + len(self.liked_tweet_ids) - int(tweet_id)
+        if "created_at" in tweet_fields:
+            created_at = MOCK_NOW - datetime.timedelta(days=age)
+            tweet["created_at"] = created_at.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        if "public_metrics" in tweet_fields:
+            tweet["public_metrics"] = {"retweet_count": 0, "reply_count": 0, "like_count": int(tweet_id) % 10,
+                                       "quote_count": 0}
+        if "referenced_tweets" in tweet_fields and tweet_id in self.retweet_ids:
+            tweet["referenced_tweets"] = [{"type": "retweeted", "id": self.retweeted_ids[tweet_id]}]
+        return tweet
+
+    @staticmethod
+    def user(user_id, user_fields=()):
+        """
+        :return: User dictionary with the user.fields asked for. Every third user is verified
+        """
+        user = {"id": user_id, "name": f"User {user_id}", "username": f"user{user_id}"}
+        if "verified" in user_fields:
+            user["verified"] = int(user_id) % 3 == 0
+        if "public_metrics" in user_fields:
+            user["public_metrics"] = {"followers_count": int(user_id) % 1000, "following_count": 0,
+                                      "tweet_count": 0, "listed_count": 0}
+        return user
+
+    @staticmethod
+    def owned_list(list_id, list_fields=()):
+        """
+        :return: List dictionary with the list.fields asked for
+        """
+        owned_list = {"id": list_id, "name": f"List {list_id}"}
+        if "created_at" in list_fields:
+            owned_list["created_at"] = MOCK_NOW.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        return owned_list
+
+    @staticmethod
+    def page(item_ids, present, pagination_token, max_results):
+        """
+        :return: Tuple of (list of present IDs in the page, next_token or None)
+        """
+        index = int(pagination_token) if pagination_token else 0
+        page_ids = []
+        while index < len(item_ids) and len(page_ids) < max_results:
+            if item_ids[index] in present:
+                page_ids.append(item_ids[index])
+            index += 1
+        while index < len(item_ids) and item_ids[index] not in present:
+            index += 1
+        return page_ids, (str(index) if index < len(item_ids) else None)
+
+
+class MockTwitterAPIConfig:
+    """
+    Behaviour of the mock server
+
+    rate_limits is a dictionary of endpoint key, as made by rate_limit_scheduler.rate_limit_endpoint_key, to a
+    (requests per window, window seconds) tuple. Endpoints not in the dictionary are not rate limited.
+    """
+
+    def __init__(self, rate_limits=None, access_token_lifetime_seconds=7200, service_unavailable_rate=0.0,
+                 latency_seconds=0.0, random_seed=None):
+        self.rate_limits = rate_limits if rate_limits is not None else twitter_rate_limits()
+        self.access_token_lifetime_seconds = access_token_lifetime_seconds
+        self.service_unavailable_rate = service_unavailable_rate
+        self.latency_seconds = latency_seconds
+        self.random = random.Random(random_seed)
+
+
+def twitter_rate_limits(window_seconds=900, write_limit=50, read_limit=75):
+    """
+    Rate limits shaped like the Twitter v2 user context limits. Use a small window_seconds to speed up benchmarks
+
+    :param window_seconds: Length of every rate limit window
+    :param write_limit: Requests per window of the unlike, delete, unfollow, unblock and unmute endpoints
+    :param read_limit: Requests per window of the paginated read endpoints
+    :return: Dictionary for MockTwitterAPIConfig.rate_limits
+    """
+    return {
+        "GET /2/users/:id/tweets": (read_limit * 12, window_seconds),
+        "GET /2/users/:id/liked_tweets": (read_limit, window_seconds),
+        "GET /2/users/:id/following": (max(1, read_limit // 5), window_seconds),
+        "GET /2/users/me": (read_limit, window_seconds),
+        "GET /2/tweets": (read_limit * 12, window_seconds),
+        "GET /2/users": (read_limit * 12, window_seconds),
+        "POST /2/users/:id/likes": (write_limit, window_seconds),
+        "DELETE /2/users/:id/likes/:id": (write_limit, window_seconds),
+        "DELETE /2/tweets/:id": (write_limit, window_seconds),
+        "DELETE /2/users/:id/retweets/:id": (write_limit, window_seconds),
+        "DELETE /2/users/:id/following/:id": (write_limit, window_seconds),
+        "POST /2/users/:id/following": (write_limit, window_seconds),
+        "GET /2/users/:id/blocking": (max(1, read_limit // 5), window_seconds),
+        "GET /2/users/:id/muting": (max(1, read_limit // 5), window_seconds),
+        "GET /2/users/:id/owned_lists": (max(1, read_limit // 5), window_seconds),
+        "DELETE /2/users/:id/blocking/:id": (write_limit, window_seconds),
+        "DELETE /2/users/:id/muting/:id": (write_limit, window_seconds),
+        "DELETE /2/lists/:id": (write_limit * 6, window_seconds),
+    }
+
+
+class MockTwitterAPIState:
+
+    def __init__(self, account, config):
+        self.account = account
+        self.config = config
+        self.lock = threading.Lock()
+        self.windows = {}
+        self.access_tokens = {}
+        self.refresh_tokens = set()
+        self.token_counter = 0
+        self.stats = {"requests": {}, "statuses": {}, "redundant_writes": 0, "items_removed": 0}
+
+    def issue_tokens(self):
+        with self.lock:
+            self.token_counter += 1
+            access_token = f"mock-access-{self.token_counter}"
+            refresh_token = f"mock-refresh-{self.token_counter}"
+            self.access_tokens[access_token] = time.time() + self.config.access_token_lifetime_seconds
+            self.refresh_tokens.add(refresh_token)
+        return {"token_type": "bearer", "access_token": access_token, "refresh_token": refresh_token,
+                "expires_in": self.config.access_token_lifetime_seconds, "scope": "tweet.read users.read"}
+
+    def take_rate_limit(self, endpoint):
+        """
+        :return: Tuple of (allowed, headers)
+        """
+        if endpoint not in self.config.rate_limits:
+            return True, {}
+        limit, window_seconds = self.config.rate_limits[endpoint]
+        now = time.time()
+        with self.lock:
+            reset_at, used = self.windows.get(endpoint, (now + window_seconds, 0))
+            if now >= reset_at:
+                reset_at, used = now + window_seconds, 0
+            allowed = used < limit
+            if allowed:
+                used += 1
+            self.windows[endpoint] = (reset_at, used)
+        return allowed, {"x-rate-limit-limit": str(limit),
+                         "x-rate-limit-remaining": str(limit - used),
+                         "x-rate-limit-reset": f"{reset_at:.3f}"}
+
+    def count(self, endpoint, status):
+        with self.lock:
+            self.stats["requests"][endpoint] = self.stats["requests"].get(endpoint, 0) + 1
+            self.stats["statuses"][str(status)] = self.stats["statuses"].get(str(status), 0) + 1
+
+
+class MockTwitterAPIRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    # Set on the subclass made by make_mock_twitter_api_server
+    state = None
+
+    protocol_version = "HTTP/1.1"
+
+    # Buffer the headers and body of a response in to one write. Separate small writes on a keep-alive connection
+    # get held up by Nagle's algorithm and delayed ACKs, adding ~40ms to every request
+    wbufsize = 64 * 1024
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, verb):
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+
+        if url.path == "/mock/stats":
+            with self.state.lock:
+                return self._send_json(200, self.state.stats)
+
+        endpoint = rate_limit_endpoint_key(verb, url.path)
+
+        if self.state.config.latency_seconds > 0:
+            time.sleep(self.state.config.latency_seconds)
+
+        if endpoint == "POST /2/oauth2/token":
+            form = urllib.parse.parse_qs(body.decode())
+            refresh_token = form.get("refresh_token", [None])[0]
+            with self.state.lock:
+                valid = refresh_token in self.state.refresh_tokens
+                self.state.refresh_tokens.discard(refresh_token)
+            self.state.count(endpoint, 200 if valid else 400)
+            if not valid:
+                return self._send_json(400, {"error": "invalid_request"})
+            return self._send_json(200, self.state.issue_tokens())
+
+        status, data, headers = self._api_response(verb, endpoint, url.path, query, body)
+        self.state.count(endpoint, status)
+        self._send_json(status, data, headers)
+
+    def _api_response(self, verb, endpoint, path, query, body):
+        access_token = self.headers.get("Authorization", "").replace("Bearer ", "", 1)
+        expires_at = self.state.access_tokens.get(access_token)
+        if expires_at is None or time.time() >= expires_at:
+            return 401, {"title": "Unauthorized", "type": "about:blank", "status": 401, "detail": "Unauthorized"}, {}
+
+        if self.state.config.random.random() < self.state.config.service_unavailable_rate:
+            return 503, {"title": "Service Unavailable", "status": 503}, {}
+
+        allowed, headers = self.state.take_rate_limit(endpoint)
+        if not allowed:
+            return 429, {"title": "Too Many Requests", "detail": "Too Many Requests", "type": "about:blank",
+                         "status": 429}, headers
+
+        account = self.state.account
+        segments = path.strip("/").split("/")
+        max_results = int(query.get("max_results", [0])[0] or 0)
+        pagination_token = query.get("pagination_token", [None])[0]
+
+        if endpoint == "GET /2/users/me":
+            me = {"id": account.user_id, "name": "Mock User", "username": "mockuser"}
+            user_fields = query.get("user.fields", [""])[0].split(",")
+            if "pinned_tweet_id" in user_fields and account.tweet_ids:
+                me["pinned_tweet_id"] = account.tweet_ids[-1]
+            if "public_metrics" in user_fields:
+                with account.lock:
+                    me["public_metrics"] = {"followers_count": 0, "following_count": len(account.following),
+                                            "tweet_count": len(account.tweets), "listed_count": 0,
+                                            "like_count": len(account.likes)}
+            return 200, {"data": me}, headers
+
+        if endpoint in ("GET /2/users/:id/tweets", "GET /2/users/:id/liked_tweets", "GET /2/users/:id/following",
+                        "GET /2/users/:id/blocking", "GET /2/users/:id/muting", "GET /2/users/:id/owned_lists"):
+            if endpoint == "GET /2/users/:id/tweets":
+                item_ids, present, default_max = account.tweet_ids, account.tweets, 10
+            elif endpoint == "GET /2/users/:id/liked_tweets":
+                item_ids, present, default_max = account.liked_tweet_ids, account.likes, 10
+            elif endpoint == "GET /2/users/:id/blocking":
+                item_ids, present, default_max = account.blocking_ids, account.blocking, 100
+            elif endpoint == "GET /2/users/:id/muting":
+                item_ids, present, default_max = account.muting_ids, account.muting, 100
+            elif endpoint == "GET /2/users/:id/owned_lists":
+                item_ids, present, default_max = account.owned_list_ids, account.owned_lists, 100
+            else:
+                item_ids, present, default_max = account.following_ids, account.following, 100
+            with account.lock:
+                page_ids, next_token = account.page(item_ids, present, pagination_token, max_results or default_max)
+            if endpoint == "GET /2/users/:id/owned_lists":
+                list_fields = query.get("list.fields", [""])[0].split(",")
+                data = [account.owned_list(i, list_fields) for i in page_ids]
+            elif endpoint in ("GET /2/users/:id/following", "GET /2/users/:id/blocking", "GET /2/users/:id/muting"):
+                user_fields = query.get("user.fields", [""])[0].split(",")
+                data = [account.user(i, user_fields) for i in page_ids]
+            else:
+                tweet_fields = query.get("tweet.fields", [""])[0].split(",")
+                data = [account.tweet(i, tweet_fields) for i in page_ids]
+            response = {"meta": {"result_count": len(data)}}
+            if data:
+                response["data"] = data
+            if next_token is not None:
+                response["meta"]["next_token"] = next_token
+            return 200, response, headers
+
+        if endpoint in ("GET /2/tweets", "GET /2/users"):
+            ids = query.get("ids", [""])[0].split(",")
+            with account.lock:
+                if endpoint == "GET /2/tweets":
+                    exists = lambda i: i in account.tweets or i in account.likes
+                else:
+                    exists = lambda i: i in account.following or i in account.blocking or i in account.muting
+                data = [{"id": i} for i in ids if exists(i)]
+                errors = [{"value": i, "detail": f"Could not find object with id: [{i}].",
+                           "title": "Not Found Error", "type": "https://api.twitter.com/2/problems/resource-not-found"}
+                          for i in ids if not exists(i)]
+            response = {}
+            if data:
+                response["data"] = data
+            if errors:
+                response["errors"] = errors
+            return 200, response, headers
+
+        if endpoint == "POST /2/users/:id/likes":
+            tweet_id = json.loads(body or b"{}").get("tweet_id")
+            with account.lock:
+                if tweet_id in account.likes:
+                    self.state.stats["redundant_writes"] += 1
+                account.likes.add(tweet_id)
+            return 200, {"data": {"liked": True}}, headers
+
+        if endpoint == "POST /2/users/:id/following":
+            target_user_id = json.loads(body or b"{}").get("target_user_id")
+            with account.lock:
+                if target_user_id in account.following:
+                    self.state.stats["redundant_writes"] += 1
+                account.following.add(target_user_id)
+            return 200, {"data": {"following": True, "pending_follow": False}}, headers
+
+        if verb == "DELETE" and endpoint in ("DELETE /2/users/:id/likes/:id", "DELETE /2/tweets/:id",
+                                             "DELETE /2/users/:id/retweets/:id", "DELETE /2/users/:id/following/:id",
+                                             "DELETE /2/users/:id/blocking/:id", "DELETE /2/users/:id/muting/:id",
+                                             "DELETE /2/lists/:id"):
+            item_id = segments[-1]
+            if endpoint == "DELETE /2/users/:id/retweets/:id":
+                # Takes the ID of the tweet that was retweeted. Any other ID undoes nothing
+                item_id = account.retweet_ids_by_retweeted_id.get(item_id)
+            if endpoint == "DELETE /2/users/:id/likes/:id":
+                present, result = account.likes, {"liked": False}
+            elif endpoint == "DELETE /2/users/:id/following/:id":
+                present, result = account.following, {"following": False}
+            elif endpoint == "DELETE /2/users/:id/blocking/:id":
+                present, result = account.blocking, {"blocking": False}
+            elif endpoint == "DELETE /2/users/:id/muting/:id":
+                present, result = account.muting, {"muting": False}
+            elif endpoint == "DELETE /2/lists/:id":
+                present, result = account.owned_lists, {"deleted": True}
+            elif endpoint == "DELETE /2/users/:id/retweets/:id":
+                present, result = account.tweets, {"retweeted": False}
+            else:
+                present, result = account.tweets, {"deleted": True}
+            with account.lock:
+                if item_id in present:
+                    present.discard(item_id)
+                    self.state.stats["items_removed"] += 1
+                else:
+                    self.state.stats["redundant_writes"] += 1
+            return 200, {"data": result}, headers
+
+        return 404, {"title": "Not Found Error", "status": 404, "detail": f"No mock for '{endpoint}'"}, {}
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+
+def make_mock_twitter_api_server(account, config=None, listen_ip="127.0.0.1", port=0):
+    """
+    :param account: MockTwitterAccount to serve
+    :param config: MockTwitterAPIConfig. Default None, Twitter like rate limits and no errors
+    :param listen_ip: IP to listen on
+    :param port: Port to listen on. Default 0, any free port
+    :return: Tuple of (ThreadingHTTPServer, MockTwitterAPIState). Call serve_forever on the server
+    """
+    state = MockTwitterAPIState(account, config if config is not None else MockTwitterAPIConfig())
+    handler = type("BoundMockTwitterAPIRequestHandler", (MockTwitterAPIRequestHandler,), {"state": state})
+    server = http.server.ThreadingHTTPServer((listen_ip, port), handler)
+    server.daemon_threads = True
+    return server, state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local mock of the Twitter v2 API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--tweets", type=int, default=1000)
+    parser.add_argument("--likes", type=int, default=1000)
+    parser.add_argument("--following", type=int, default=1000)
+    parser.add_argument("--blocking", type=int, default=0)
+    parser.add_argument("--muting", type=int, default=0)
+    parser.add_argument("--owned-lists", type=int, default=0)
+    parser.add_argument("--window-seconds", type=float, default=900)
+    parser.add_argument("--service-unavailable-rate", type=float, default=0.0)
+    arguments = parser.parse_args()
+
+    mock_server, mock_state = make_mock_twitter_api_server(
+        MockTwitterAccount(arguments.tweets, arguments.likes, arguments.following, blocking_count=arguments.blocking,
+                           muting_count=arguments.muting, owned_list_count=arguments.owned_lists),
+        MockTwitterAPIConfig(rate_limits=twitter_rate_limits(window_seconds=arguments.window_seconds),
+                             service_unavailable_rate=arguments.service_unavailable_rate),
+        port=arguments.port)
+    print(f"Mock Twitter API at http://127.0.0.1:{mock_server.server_address[1]}/2 "
+          f"access token details {json.dumps(mock_state.issue_tokens())}")
+    mock_server.serve_forever()
@@ -0,0 +1,145 @@
+import logging
+import queue
+import threading
+import time
+
+from wrapped_pytwitter_api import *
+
+# Fetch the next pages of a paginated endpoint in a background thread while the bleach loop works through the
+# current one
+#
+# The read endpoints that list tweets, likes and follows have their own rate limit windows, separate from the write
+# endpoints that delete them. Fetching ahead means the write window is never left idle while the loop waits for the
+# next page to come back.
+#
+# The pages fetched ahead are held in a bounded buffer. When it is full the prefetcher waits, so it never gets more
+# than max_pages_ahead pages ahead of the page the loop last checkpointed.
+#
+# A page that failed with a 429, or with a 503 the API object has already retried, is fetched again before the error
+# is handed to the loop. After a 429 the rate limit scheduler of the API object holds the next request until the read
+# window resets. After a 503 the prefetcher backs off as the retry policy of the API object says. A 401 refreshes the
+# access token first. The planner and snapshots read their pages the same way, see fetch_page_with_retries.
+#
+
+DEFAULT_MAX_PAGES_AHEAD = 2
+
+# Times a page is fetched again after a 401, 429 or 503 before the error is handed to the loop
+DEFAULT_MAX_PAGE_RETRIES = 3
+
+_end_of_pages = object()
+
+
+def fetch_page_with_retries(api, fetch_page, pagination_token, max_page_retries=DEFAULT_MAX_PAGE_RETRIES,
+                            stopped=None):
+    """
+    Fetch a page, refreshing the access token after a 401 and fetching it again after a 429 or a 503
+
+    :param api: WrappedPyTwitterAPI used by fetch_page
+    :param fetch_page: Function taking a pagination token and returning the page as a JSON dictionary
+    :param pagination_token: Token of the page. None for the first page
+    :param max_page_retries: Times the page is fetched again before the error is raised
+    :param stopped: threading.Event that cuts short the wait before a retry, raising the error. Default None
+    :return: The page
+    :raises PyTwitterError: The error of the last try
+    """
+    page_retries = 0
+    while True:
+        try:
+            return fetch_page(pagination_token)
+        except WrappedPyTwitterAPIUnauthorizedException:
+            if page_retries >= max_page_retries:
+                raise
+            page_retries += 1
+            logging.info("Authentication failed fetching page. Access token may have expired")
+            api.refresh_access_token()
+        except (WrappedPyTwitterAPIRateLimitExceededException, WrappedPyTwitterAPIServiceUnavailableException) as e:
+            if page_retries >= max_page_retries:
+                raise
+            page_retries += 1
+            if isinstance(e, WrappedPyTwitterAPIRateLimitExceededException):
+                # The rate limit scheduler holds the next request until the window resets
+                logging.info(f"Rate limit exceeded fetching page. Retry {page_retries} when the window resets")
+                continue
+            delay_seconds = api.retry_policy.delay_seconds(page_retries)
+            logging.info(f"API service unavailable fetching page '{e.message}'. Retry {page_retries} in "
+                         f"{delay_seconds:.1f} seconds")
+            if stopped is None:
+                time.sleep(delay_seconds)
+            elif stopped.wait(delay_seconds):
+                raise
+
+
+class PagePrefetcher:
+
+    def __init__(self, api, fetch_page, pagination_token=None, max_pages_ahead=DEFAULT_MAX_PAGES_AHEAD,
+                 max_page_retries=DEFAULT_MAX_PAGE_RETRIES):
+        """
+        :param api: WrappedPyTwitterAPI used by fetch_page. The access token is refreshed through it on a 401
+        :param fetch_page: Function taking a pagination token and returning the page as a JSON dictionary
+        :param pagination_token: Token of the first page to fetch. Default None, the first page of the endpoint
+        :param max_pages_ahead: Most pages to hold that the loop hasn't taken yet
+        :param max_page_retries: Times a page is fetched again after a 401, 429 or 503 before the error is handed to
+        the loop
+        """
+        self.api = api
+        self.fetch_page = fetch_page
+        self.max_pages_ahead = max_pages_ahead
+        self.max_page_retries = max_page_retries
+
+        self._pages = queue.Queue(maxsize=max_pages_ahead)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._prefetch, args=(pagination_token,),
+                                        name="page-prefetcher", daemon=True)
+        self._thread.start()
+
+    def _put(self, entry):
+        # Wait for room in the buffer, but give up if the loop has closed the prefetcher
+        while not self._stopped.is_set():
+            try:
+                self._pages.put(entry, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _prefetch(self, pagination_token):
+        while not self._stopped.is_set():
+            try:
+                # Stops waiting to retry if the loop closes the prefetcher
+                page = fetch_page_with_retries(self.api, self.fetch_page, pagination_token, self.max_page_retries,
+                                               self._stopped)
+            except Exception as e:
+                # Hand the exception to the loop so it is handled the same as if the loop had made the request
+                self._put(e)
+                return
+
+            if not self._put(page):
+                return
+
+            next_token = page.get("meta", {}).get("next_token")
+            if next_token is None:
+                self._put(_end_of_pages)
+                return
+            pagination_token = next_token
+
+    def next_page(self):
+        """
+        :return: The next page, None when there are no more pages
+        :raises Exception: The exception raised fetching the page
+        """
+        entry = self._pages.get()
+        if entry is _end_of_pages:
+            # Leave the marker for any later calls
+            self._pages.put(entry)
+            return None
+        if isinstance(entry, Exception):
+            self._pages.put(entry)
+            raise entry
+        return entry
+
+    def close(self):
+        """
+        Stop fetching pages
+        :return: None
+        """
+        self._stopped.set()
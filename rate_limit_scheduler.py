@@ -0,0 +1,169 @@
+import logging
+import threading
+import time
+import urllib.parse
+
+# Paces calls to the Twitter v2 API using the rate limit headers returned with every response
+# https://developer.twitter.com/en/docs/twitter-api/rate-limits
+#
+# Every endpoint has its own window. The API reports the state of the window in three headers
+#   x-rate-limit-limit      the number of requests allowed in the window
+#   x-rate-limit-remaining  the number of requests left in the window
+#   x-rate-limit-reset      the epoch second the window resets
+#
+# The scheduler keeps a token bucket per endpoint seeded from those headers. A call takes a token before it is made.
+# When the bucket is empty the call waits until the reset time instead of spending a request to find out it would
+# get a 429.
+#
+
+# Window length used when the API does not say when a window resets
+DEFAULT_RATE_LIMIT_WINDOW_SECONDS = 900
+
+# Small margin added to the reset time to allow for clock differences with the API servers
+RATE_LIMIT_RESET_MARGIN_SECONDS = 1.0
+
+
+def rate_limit_endpoint_key(verb, url):
+    """
+    Key for the rate limit window of a request. IDs in the URL path are replaced with ':id' so all requests to the
+    same endpoint share a bucket, e.g. 'DELETE /2/users/:id/likes/:id'
+
+    :param verb: HTTP method of the request
+    :param url: URL of the request
+    :return: String key of the endpoint
+    """
+    # The first segment is the API version, e.g. '/2', and is kept as is
+    version, _, path = urllib.parse.urlparse(url).path.lstrip("/").partition("/")
+    path_segments = [":id" if segment.isdigit() else segment for segment in path.split("/")]
+    return f"{verb.upper()} /{version}/{'/'.join(path_segments)}"
+
+
+class EndpointRateLimitBucket:
+    """
+    Token bucket for a single endpoint rate limit window
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.limit = None
+        self.remaining = None
+        self.reset_at = None
+
+    def seconds_until_available(self, now, poll_seconds):
+        """
+        :param now: Current epoch time
+        :param poll_seconds: Seconds to wait when the tokens are used up but the reset time isn't known yet
+        :return: Seconds to wait before a token is available. 0 if a call can be made now
+        """
+        if self.reset_at is not None and now >= self.reset_at:
+            # The window has reopened. Refill the bucket, the next response will correct the count
+            self.remaining = self.limit
+            self.reset_at = None
+
+        if self.remaining is None or self.remaining > 0:
+            return 0
+        if self.reset_at is None:
+            # Tokens were used up locally by calls still in flight. Their responses will say when the window resets
+            return poll_seconds
+        return self.reset_at - now
+
+    def take(self):
+        if self.remaining is not None:
+            self.remaining -= 1
+
+
+class RateLimitScheduler:
+    """
+    Tracks the rate limit window of every endpoint called and blocks callers until their endpoint has capacity.
+    Thread safe, one scheduler can be shared by threads using the same API instance.
+    """
+
+    def __init__(self, reset_margin_seconds=RATE_LIMIT_RESET_MARGIN_SECONDS):
+        """
+        :param reset_margin_seconds: Seconds added to the reset time of a window before calling again
+        """
+        self.reset_margin_seconds = reset_margin_seconds
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, endpoint):
+        bucket = self._buckets.get(endpoint)
+        if bucket is None:
+            bucket = EndpointRateLimitBucket(endpoint)
+            self._buckets[endpoint] = bucket
+        return bucket
+
+    def reserve(self, endpoint):
+        """
+        Try to take a token for the endpoint without blocking
+
+        :param endpoint: Key of the endpoint from rate_limit_endpoint_key
+        :return: 0 if the token was taken, otherwise the seconds to wait before trying again
+        """
+        with self._lock:
+            bucket = self._bucket(endpoint)
+            wait_seconds = bucket.seconds_until_available(time.time(), self.reset_margin_seconds)
+            if wait_seconds <= 0:
+                bucket.take()
+                return 0
+            return wait_seconds + self.reset_margin_seconds
+
+    def acquire(self, endpoint):
+        """
+        Take a token for the endpoint, sleeping until the rate limit window reopens if the bucket is empty
+
+        :param endpoint: Key of the endpoint from rate_limit_endpoint_key
+        :return: Total seconds spent waiting
+        """
+        total_waited = 0
+        while True:
+            wait_seconds = self.reserve(endpoint)
+            if wait_seconds <= 0:
+                return total_waited
+            logging.info("Rate limit for '%s' exhausted. Waiting %.0f seconds for window to reset", endpoint,
+                         wait_seconds, extra={"endpoint": endpoint})
+            time.sleep(wait_seconds)
+            total_waited += wait_seconds
+
+    def update_from_headers(self, endpoint, headers):
+        """
+        Record the rate limit state reported by the API for the endpoint
+
+        :param endpoint: Key of the endpoint from rate_limit_endpoint_key
+        :param headers: Response headers
+        :return: None
+        """
+        try:
+            limit = int(headers["x-rate-limit-limit"])
+            remaining = int(headers["x-rate-limit-remaining"])
+            reset_at = float(headers["x-rate-limit-reset"])
+        except (KeyError, TypeError, ValueError):
+            return
+
+        with self._lock:
+            bucket = self._bucket(endpoint)
+            bucket.limit = limit
+            bucket.remaining = remaining
+            bucket.reset_at = reset_at
+
+    def mark_exhausted(self, endpoint, reset_at=None):
+        """
+        Empty the bucket for an endpoint. Used when the API returns 429 regardless of what the bucket thought
+
+        :param endpoint: Key of the endpoint from rate_limit_endpoint_key
+        :param reset_at: Epoch time the window resets. Default is None, which waits a full default window
+        :return: None
+        """
+        with self._lock:
+            bucket = self._bucket(endpoint)
+            bucket.remaining = 0
+            bucket.reset_at = reset_at if reset_at is not None else time.time() + DEFAULT_RATE_LIMIT_WINDOW_SECONDS
+
+    def status(self, endpoint):
+        """
+        :param endpoint: Key of the endpoint from rate_limit_endpoint_key
+        :return: Tuple of (limit, remaining, reset_at) last recorded for the endpoint. Values are None if unknown
+        """
+        with self._lock:
+            bucket = self._bucket(endpoint)
+            return bucket.limit, bucket.remaining, bucket.reset_at
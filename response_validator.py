@@ -0,0 +1,138 @@
+import functools
+import json
+import logging
+import os
+import random
+import threading
+
+import jsonschema
+# noinspection PyPackageRequirements
+import pytwitter  # pip 'package' is python-twitter, module is pytwitter -RDP
+
+# Validation of the JSON responses of the Twitter API endpoints the bleach code reads
+#
+# Each endpoint with a schema in the schemas directory has one validator, compiled when the ResponseValidator is made.
+# Compiled validators are cached by schema file so every API object, e.g. one per account in a fleet, shares them.
+# References to the schema's own $defs are inlined when it is compiled, resolving a $ref for every item of a page
+# takes a third of the time of validating it.
+#
+# Every response of an endpoint with a schema gets a fast check of its shape, 'data' is a list of objects each with a
+# string 'id'. The full schema is checked for a sample of the responses, all of them by default. Long runs can lower
+# sample_rate to spend less time validating pages that are almost always fine.
+#
+# The paginated endpoints leave out 'data' when a page has no results. It is filled in as an empty list so the bleach
+# loops always have a 'data' list to work with.
+#
+
+SCHEMA_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schemas")
+
+# Schema file of each endpoint, as keyed by rate_limit_endpoint_key
+RESPONSE_SCHEMA_FILES = {
+    "GET /2/users/:id/following": "twitter_followers_endpoint_response_schema.json",
+    "GET /2/users/:id/liked_tweets": "twitter_liked_tweets_endpoint_response_schema.json",
+    "GET /2/users/:id/tweets": "twitter_timeline_endpoint_response_schema.json",
+    # Blocked and muted users are listed in the same shape as followed users
+    "GET /2/users/:id/blocking": "twitter_followers_endpoint_response_schema.json",
+    "GET /2/users/:id/muting": "twitter_followers_endpoint_response_schema.json",
+}
+
+# Endpoints that return a page of items in 'data'
+PAGINATED_ENDPOINTS = frozenset(RESPONSE_SCHEMA_FILES)
+
+
+class ResponseValidationException(pytwitter.PyTwitterError):
+    pass
+
+
+def _inline_local_refs(node, defs):
+    if isinstance(node, dict):
+        if set(node) == {"$ref"} and node["$ref"].startswith("#/$defs/"):
+            return _inline_local_refs(defs[node["$ref"][len("#/$defs/"):]], defs)
+        return {key: _inline_local_refs(value, defs) for key, value in node.items() if key != "$defs"}
+    if isinstance(node, list):
+        return [_inline_local_refs(value, defs) for value in node]
+    return node
+
+
+@functools.lru_cache(maxsize=None)
+def compiled_schema_validator(schema_path):
+    """
+    :param schema_path: Path of a JSON schema file
+    :return: jsonschema validator for the schema. Compiled once per path
+    """
+    with open(schema_path) as schema_file:
+        schema = json.load(schema_file)
+    validator_class = jsonschema.validators.validator_for(schema)
+    validator_class.check_schema(schema)
+    return validator_class(_inline_local_refs(schema, schema.get("$defs", {})))
+
+
+class ResponseValidator:
+    """
+    Validates responses by endpoint. Thread safe.
+    """
+
+    def __init__(self, sample_rate=1.0, schema_directory=SCHEMA_DIRECTORY, schema_files=None, random_seed=None):
+        """
+        :param sample_rate: Fraction of the responses checked against the full schema. 1.0 checks all of them, 0.0 only
+        the fast shape check
+        :param schema_directory: Directory of the schema files
+        :param schema_files: Dictionary of endpoint key to schema file name. Default None, RESPONSE_SCHEMA_FILES
+        :param random_seed: Seed of the sampling
+        """
+        self.sample_rate = sample_rate
+        schema_files = schema_files if schema_files is not None else RESPONSE_SCHEMA_FILES
+        self._validators = {endpoint: compiled_schema_validator(os.path.join(schema_directory, schema_file_name))
+                            for endpoint, schema_file_name in schema_files.items()}
+
+        self._lock = threading.Lock()
+        self._random = random.Random(random_seed)
+        self.responses_checked = 0
+        self.responses_fully_validated = 0
+
+    def _sampled(self):
+        if self.sample_rate >= 1.0:
+            return True
+        with self._lock:
+            return self._random.random() < self.sample_rate
+
+    def validate(self, endpoint, data):
+        """
+        Validate the JSON data of a successful response. Fills in a missing 'data' of a paginated endpoint
+
+        :param endpoint: Key of the endpoint from rate_limit_endpoint_key
+        :param data: JSON data of the response
+        :return: None
+        :raises ResponseValidationException: If the response doesn't match its schema
+        """
+        validator = self._validators.get(endpoint)
+        if validator is None:
+            return
+
+        if endpoint in PAGINATED_ENDPOINTS and isinstance(data, dict) and "data" not in data:
+            data["data"] = []
+
+        fully_validated = self._sampled()
+        with self._lock:
+            self.responses_checked += 1
+            if fully_validated:
+                self.responses_fully_validated += 1
+
+        if fully_validated:
+            if validator.is_valid(data):
+                return
+            error = jsonschema.exceptions.best_match(validator.iter_errors(data))
+            if error is not None:
+                detail = f"Response of '{endpoint}' doesn't match its schema. {error.message} at " \
+                         f"'{'/'.join(str(part) for part in error.absolute_path)}'"
+                logging.error(detail)
+                raise ResponseValidationException({"status": None, "detail": detail})
+            return
+
+        # Fast check of what the bleach loops rely on
+        items = data.get("data") if isinstance(data, dict) else None
+        if not isinstance(items, list) or not all(isinstance(item, dict) and isinstance(item.get("id"), str)
+                                                  for item in items):
+            detail = f"Response of '{endpoint}' has no list of items with IDs in 'data'"
+            logging.error(detail)
+            raise ResponseValidationException({"status": None, "detail": detail})
@@ -0,0 +1,105 @@
+import random
+import threading
+
+import requests
+
+# Retries of requests that failed for reasons that are likely to go away on their own
+#
+# A failed request is retried exactly as it was made, so the pagination cursor of the caller is kept. The wait
+# between attempts grows exponentially and is randomised with "full jitter" so clients that failed together don't
+# retry together
+# https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+#
+# Each kind of error has its own budget of retries for a single request. When the budget is used up the error is
+# passed on to the caller.
+#
+
+RETRYABLE_ERROR_SERVICE_UNAVAILABLE = "service_unavailable"
+RETRYABLE_ERROR_SERVER_ERROR = "server_error"
+RETRYABLE_ERROR_CONNECTION = "connection"
+RETRYABLE_ERROR_TIMEOUT = "timeout"
+
+DEFAULT_RETRY_BUDGETS = {
+    RETRYABLE_ERROR_SERVICE_UNAVAILABLE: 8,
+    RETRYABLE_ERROR_SERVER_ERROR: 3,
+    RETRYABLE_ERROR_CONNECTION: 5,
+    RETRYABLE_ERROR_TIMEOUT: 5,
+}
+
+
+class RetryPolicy:
+    """
+    Decides whether a failed request is retried and how long to wait first. Thread safe, the counts of retries are
+    shared by every request made through the API object the policy is attached to.
+    """
+
+    def __init__(self, retry_budgets=None, base_delay_seconds=1.0, max_delay_seconds=120.0, random_generator=None):
+        """
+        :param retry_budgets: Dictionary of RETRYABLE_ERROR_ kind to the most retries of a single request. Default None,
+        DEFAULT_RETRY_BUDGETS. Kinds missing from the dictionary are not retried
+        :param base_delay_seconds: Upper bound of the wait before the first retry
+        :param max_delay_seconds: Upper bound of the wait before any retry
+        :param random_generator: random.Random to draw the jitter from. Default None, a new unseeded one
+        """
+        self.retry_budgets = dict(DEFAULT_RETRY_BUDGETS if retry_budgets is None else retry_budgets)
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self._random = random_generator if random_generator is not None else random.Random()
+
+        self._lock = threading.Lock()
+        self.retries = {kind: 0 for kind in self.retry_budgets}
+        self.exhausted = {kind: 0 for kind in self.retry_budgets}
+
+    @staticmethod
+    def classify_response(resp):
+        """
+        :param resp: requests.Response
+        :return: RETRYABLE_ERROR_ kind of the response, None if the response should not be retried
+        """
+        if resp.status_code == 503:
+            return RETRYABLE_ERROR_SERVICE_UNAVAILABLE
+        if resp.status_code in (500, 502, 504):
+            return RETRYABLE_ERROR_SERVER_ERROR
+        return None
+
+    @staticmethod
+    def classify_exception(exception):
+        """
+        :param exception: Exception raised making the request
+        :return: RETRYABLE_ERROR_ kind of the exception, None if the request should not be retried
+        """
+        if isinstance(exception, requests.Timeout):
+            return RETRYABLE_ERROR_TIMEOUT
+        if isinstance(exception, requests.ConnectionError):
+            return RETRYABLE_ERROR_CONNECTION
+        return None
+
+    def should_retry(self, error_kind, retries_so_far):
+        """
+        :param error_kind: RETRYABLE_ERROR_ kind of the failure
+        :param retries_so_far: Number of times the request has already been retried for this kind of error
+        :return: True if the request should be tried again
+        """
+        budget = self.retry_budgets.get(error_kind, 0)
+        with self._lock:
+            if retries_so_far < budget:
+                self.retries[error_kind] = self.retries.get(error_kind, 0) + 1
+                return True
+            self.exhausted[error_kind] = self.exhausted.get(error_kind, 0) + 1
+            return False
+
+    def delay_seconds(self, retries_so_far):
+        """
+        :param retries_so_far: Number of times the request has already been retried
+        :return: Seconds to wait before the next attempt
+        """
+        upper_bound = min(self.max_delay_seconds, self.base_delay_seconds * (2 ** retries_so_far))
+        with self._lock:
+            return self._random.uniform(0, upper_bound)
+
+    def metrics(self):
+        """
+        :return: Dictionary with the counts of 'retries' made and retry budgets 'exhausted' by kind of error
+        """
+        with self._lock:
+            return {"retries": dict(self.retries), "exhausted": dict(self.exhausted)}
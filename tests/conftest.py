@@ -0,0 +1,115 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+# The modules are flat files at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mock_twitter_api_server  # noqa: E402
+from bleach_account_store import BleachAccountStore  # noqa: E402
+from rate_limit_scheduler import RateLimitScheduler  # noqa: E402
+from wrapped_pytwitter_api import WrappedPyTwitterAPI  # noqa: E402
+
+# Shared fixtures of the tests
+#
+# mock_api starts a mock_twitter_api_server for a synthetic account and returns a WrappedPyTwitterAPI authenticated
+# against it. Rate limit windows are a fraction of a second so the bleach loops run through them quickly. mock_fleet
+# starts a server for each of several accounts and saves them in an account store, for bleach_fleet. mock_server only
+# starts the server.
+#
+
+# Seconds in each rate limit window of the mock server
+MOCK_WINDOW_SECONDS = 0.2
+
+
+def _start_mock_server(account, config, servers):
+    if config is None:
+        config = mock_twitter_api_server.MockTwitterAPIConfig(
+            rate_limits=mock_twitter_api_server.twitter_rate_limits(window_seconds=MOCK_WINDOW_SECONDS,
+                                                                    write_limit=2000))
+    server, state = mock_twitter_api_server.make_mock_twitter_api_server(account, config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    servers.append(server)
+    return f"http://127.0.0.1:{server.server_address[1]}/2", state
+
+
+def _point_at_mock_server(api, base_url):
+    api.BASE_URL_V2 = base_url
+    api.rate_limit_scheduler = RateLimitScheduler(reset_margin_seconds=0.01)
+
+
+def _stop_mock_servers(servers):
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def mock_api():
+    """
+    :return: Function taking a MockTwitterAccount, and optionally a MockTwitterAPIConfig, and returning a tuple of the
+    authenticated WrappedPyTwitterAPI and the MockTwitterAPIState of the server
+    """
+    servers = []
+    apis = []
+
+    def make_mock_api(account, config=None):
+        base_url, state = _start_mock_server(account, config, servers)
+
+        tokens = state.issue_tokens()
+        api = WrappedPyTwitterAPI(client_id="mock-client-id", oauth_flow=True)
+        _point_at_mock_server(api, base_url)
+        api.set_access_token(tokens["access_token"], tokens["refresh_token"], expires_in=tokens["expires_in"])
+        apis.append(api)
+        return api, state
+
+    yield make_mock_api
+
+    for api in apis:
+        api.stop_background_refresh()
+    _stop_mock_servers(servers)
+
+
+@pytest.fixture
+def mock_server():
+    """
+    :return: Function taking a MockTwitterAccount, and optionally a MockTwitterAPIConfig, and returning a tuple of the
+    base URL of the server's v2 API and its MockTwitterAPIState
+    """
+    servers = []
+
+    yield lambda account, config=None: _start_mock_server(account, config, servers)
+
+    _stop_mock_servers(servers)
+
+
+@pytest.fixture
+def mock_fleet():
+    """
+    :return: Function taking a dictionary of account name to MockTwitterAccount and returning a tuple of a
+    BleachAccountStore with the accounts, the configure_api function for bleach_fleet that points each account at its
+    server, and a dictionary of account name to the MockTwitterAPIState of its server
+    """
+    servers = []
+
+    def make_mock_fleet(accounts):
+        account_store = BleachAccountStore()
+        base_urls = {}
+        states = {}
+        for account_name, account in accounts.items():
+            base_urls[account_name], states[account_name] = _start_mock_server(account, None, servers)
+            tokens = states[account_name].issue_tokens()
+            account_store.save_account(account_name, "mock-client-id", tokens["access_token"], tokens["refresh_token"],
+                                       time.time() + tokens["expires_in"])
+
+        def configure_api(api, bleach_account):
+            _point_at_mock_server(api, base_urls[bleach_account.account_name])
+
+        return account_store, configure_api, states
+
+    yield make_mock_fleet
+
+    _stop_mock_servers(servers)
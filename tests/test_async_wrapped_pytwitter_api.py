@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from async_wrapped_pytwitter_api import AsyncWrappedPyTwitterAPI
+from mock_twitter_api_server import MockTwitterAccount, MockTwitterAPIConfig, MOCK_USER_ID, twitter_rate_limits
+from rate_limit_scheduler import RateLimitScheduler
+from wrapped_pytwitter_api import WrappedPyTwitterAPIUnauthorizedException
+
+
+def make_async_api(api, tokens):
+    async_api = AsyncWrappedPyTwitterAPI("mock-client-id", tokens["access_token"], tokens["refresh_token"])
+    async_api.BASE_URL_V2 = api.BASE_URL_V2
+    async_api.rate_limit_scheduler = RateLimitScheduler(reset_margin_seconds=0.01)
+    return async_api
+
+
+def test_unlike_concurrently(mock_api):
+    api, state = mock_api(MockTwitterAccount(0, 120, 0))
+
+    async def unlike_all():
+        async with make_async_api(api, state.issue_tokens()) as async_api:
+            twitter_me = await async_api.get_me()
+            liked_tweet_ids = []
+            pagination_token = None
+            while True:
+                page = await async_api.get_user_liked_tweets(twitter_me["data"]["id"], max_results=100,
+                                                             pagination_token=pagination_token)
+                liked_tweet_ids.extend(liked_tweet["id"] for liked_tweet in page["data"])
+                pagination_token = page["meta"].get("next_token")
+                if pagination_token is None:
+                    break
+            await asyncio.gather(*(async_api.unlike_tweet(twitter_me["data"]["id"], liked_tweet_id)
+                                   for liked_tweet_id in liked_tweet_ids))
+            return len(liked_tweet_ids)
+
+    assert asyncio.run(unlike_all()) == 120
+    assert not state.account.likes
+    assert state.stats["redundant_writes"] == 0
+
+
+def test_expired_access_token_is_raised_and_refreshed(mock_api):
+    api, state = mock_api(MockTwitterAccount(0, 0, 0), MockTwitterAPIConfig(
+        rate_limits=twitter_rate_limits(window_seconds=0.2), access_token_lifetime_seconds=0))
+
+    async def refresh_after_401():
+        async with make_async_api(api, state.issue_tokens()) as async_api:
+            with pytest.raises(WrappedPyTwitterAPIUnauthorizedException):
+                await async_api.get_me()
+            state.config.access_token_lifetime_seconds = 7200
+            await async_api.refresh_access_token()
+            return await async_api.get_me()
+
+    assert asyncio.run(refresh_after_401())["data"]["id"] == MOCK_USER_ID
@@ -0,0 +1,45 @@
+import time
+
+from mock_twitter_api_server import MockTwitterAccount, MockTwitterAPIConfig, MOCK_USER_ID, twitter_rate_limits
+
+
+def short_lived_tokens_config():
+    return MockTwitterAPIConfig(rate_limits=twitter_rate_limits(window_seconds=0.2), access_token_lifetime_seconds=1)
+
+
+def test_access_token_refreshed_before_it_expires(mock_api):
+    api, state = mock_api(MockTwitterAccount(0, 0, 0), short_lived_tokens_config())
+    saved_tokens = []
+    api.on_access_token_set = lambda access_token, refresh_token, expires_at: saved_tokens.append(access_token)
+
+    # The first token has expired by now, requests only work with one the timer fetched
+    time.sleep(1.5)
+
+    assert api.get_me(return_json=True)["data"]["id"] == MOCK_USER_ID
+    assert state.stats["statuses"].get("401") is None
+    assert state.stats["requests"]["POST /2/oauth2/token"] >= 1
+    assert saved_tokens and saved_tokens[-1] in state.access_tokens
+
+
+def test_failed_background_refresh_is_tried_again(mock_api):
+    api, state = mock_api(MockTwitterAccount(0, 0, 0), short_lived_tokens_config())
+    api.BACKGROUND_REFRESH_RETRY_SECONDS = 0.05
+    # A refresh token the server doesn't know is rejected with a 400. The first refresh is 1.8 seconds in
+    api.set_access_token(state.issue_tokens()["access_token"], "unknown-refresh-token", expires_in=2)
+
+    time.sleep(2.1)
+    refresh_count = state.stats["requests"]["POST /2/oauth2/token"]
+    time.sleep(0.2)
+
+    # Tried again until the access token was too close to expiring, then left for the 401 handling
+    assert refresh_count > 1
+    assert state.stats["requests"]["POST /2/oauth2/token"] == refresh_count
+
+
+def test_stopped_background_refresh_does_not_fire(mock_api):
+    api, state = mock_api(MockTwitterAccount(0, 0, 0), short_lived_tokens_config())
+
+    api.stop_background_refresh()
+    time.sleep(1.2)
+
+    assert "POST /2/oauth2/token" not in state.stats["requests"]
@@ -0,0 +1,54 @@
+import cryptography.fernet
+import pytest
+
+from bleach_account_store import BleachAccountStore, BleachAccountStoreDecryptException, load_or_create_token_key, \
+    TOKEN_KEY_ENVIRONMENT_VARIABLE
+
+
+def test_tokens_round_trip_encrypted(tmp_path):
+    database_path = str(tmp_path / "accounts.sqlite")
+    key = cryptography.fernet.Fernet.generate_key()
+    account_store = BleachAccountStore(database_path, encryption_key=key)
+    account_store.save_account("someone", "client-id", "access-secret", "refresh-secret", 1234.5)
+    account_store.close()
+
+    # Not stored in the clear
+    with open(database_path, "rb") as database_file:
+        database_bytes = database_file.read()
+    assert b"access-secret" not in database_bytes and b"refresh-secret" not in database_bytes
+
+    account = BleachAccountStore(database_path, encryption_key=key).account("someone")
+    assert (account.client_id, account.access_token, account.refresh_token, account.expires_at) == \
+        ("client-id", "access-secret", "refresh-secret", 1234.5)
+
+
+def test_wrong_key_is_an_error(tmp_path):
+    database_path = str(tmp_path / "accounts.sqlite")
+    account_store = BleachAccountStore(database_path, encryption_key=cryptography.fernet.Fernet.generate_key())
+    account_store.save_account("someone", "client-id", "access-secret", "refresh-secret")
+    account_store.close()
+
+    with pytest.raises(BleachAccountStoreDecryptException):
+        BleachAccountStore(database_path, encryption_key=cryptography.fernet.Fernet.generate_key()).accounts()
+
+
+def test_saved_tokens_replace_the_old_ones():
+    account_store = BleachAccountStore()
+    account = account_store.save_account("someone", "client-id", "access-1", "refresh-1")
+
+    account.save_tokens("access-2", "refresh-2", 99.0)
+
+    assert [(saved.access_token, saved.refresh_token, saved.expires_at) for saved in account_store.accounts()] == \
+        [("access-2", "refresh-2", 99.0)]
+
+
+def test_token_key_created_once(tmp_path, monkeypatch):
+    monkeypatch.delenv(TOKEN_KEY_ENVIRONMENT_VARIABLE, raising=False)
+    key_file_name = str(tmp_path / "token.key")
+
+    key = load_or_create_token_key(key_file_name)
+
+    assert load_or_create_token_key(key_file_name) == key
+    assert (tmp_path / "token.key").stat().st_mode & 0o777 == 0o600
+    monkeypatch.setenv(TOKEN_KEY_ENVIRONMENT_VARIABLE, "environment-key")
+    assert load_or_create_token_key(key_file_name) == b"environment-key"
@@ -0,0 +1,62 @@
+import gzip
+import json
+
+import pytest
+
+from bleach_archive import BleachArchiveWriter, read_archive
+
+
+def archive_ids(path):
+    return [archive_line["item"]["id"] for archive_line in read_archive(path)]
+
+
+def write_items(writer, item_ids):
+    for item_id in item_ids:
+        writer.write("likes", "1", {"id": str(item_id)})
+
+
+@pytest.mark.parametrize("file_name", ["archive.jsonl", "archive.jsonl.gz"])
+def test_read_back(tmp_path, file_name):
+    path = str(tmp_path / file_name)
+    writer = BleachArchiveWriter(path, buffer_bytes=100)
+    write_items(writer, range(10))
+    writer.commit()
+    write_items(writer, range(10, 20))
+    writer.close()
+
+    assert archive_ids(path) == [str(item_id) for item_id in range(20)]
+
+
+@pytest.mark.parametrize("cut_at", [0.25, 0.5, 0.75, 0.9])
+def test_gzip_member_cut_short_by_crash(tmp_path, cut_at):
+    path = str(tmp_path / "archive.jsonl.gz")
+    writer = BleachArchiveWriter(path)
+    write_items(writer, range(50))
+    writer.close()
+
+    # A crash part way through writing the lines of the next commit
+    cut_short_member = gzip.compress(b"".join(json.dumps({"item": {"id": str(item_id)}}).encode() + b"\n"
+                                              for item_id in range(50, 100)), mtime=0)
+    with open(path, "ab") as archive_file:
+        archive_file.write(cut_short_member[:int(len(cut_short_member) * cut_at)])
+    assert archive_ids(path) == [str(item_id) for item_id in range(50)]
+
+    # The next run appends after it
+    writer = BleachArchiveWriter(path)
+    write_items(writer, range(100, 130))
+    writer.close()
+    assert archive_ids(path) == [str(item_id) for item_id in list(range(50)) + list(range(100, 130))]
+
+
+def test_plain_line_cut_short_by_crash(tmp_path):
+    path = str(tmp_path / "archive.jsonl")
+    writer = BleachArchiveWriter(path)
+    write_items(writer, range(5))
+    writer.close()
+    with open(path, "ab") as archive_file:
+        archive_file.write(b'{"bleach_type": "likes", "item": {"id": "5"')
+
+    writer = BleachArchiveWriter(path)
+    write_items(writer, range(6, 8))
+    writer.close()
+    assert archive_ids(path) == ["0", "1", "2", "3", "4", "6", "7"]
@@ -0,0 +1,14 @@
+import pytest
+
+from bleach_engine import BleachPlugin
+
+
+class ListOnlyBleachPlugin(BleachPlugin):
+
+    def list_page(self, api, twitter_user_id, bleach_rule, pagination_token):
+        return {"data": [], "meta": {}}
+
+
+def test_plugin_without_remove_cannot_be_made():
+    with pytest.raises(TypeError):
+        ListOnlyBleachPlugin()
@@ -0,0 +1,47 @@
+import json
+
+from bleach_existence_check import ItemExistenceCache, ItemExistenceCheck, EXISTENCE_LOOKUP_TWEETS
+from bleach_twitter_likes import bleach_likes
+from mock_twitter_api_server import MockTwitterAccount
+
+
+def test_lookups_batched_100_ids_at_a_time(mock_api):
+    api, state = mock_api(MockTwitterAccount(0, 250, 0))
+    gone_ids = set(state.account.liked_tweet_ids[::10])
+    state.account.likes -= gone_ids
+    unknown_ids = {str(i) for i in range(10)}
+    existence_check = ItemExistenceCheck(api, EXISTENCE_LOOKUP_TWEETS)
+
+    assert existence_check.gone_ids(state.account.liked_tweet_ids + sorted(unknown_ids)) == gone_ids | unknown_ids
+    assert existence_check.lookups == 3
+    assert state.stats["requests"]["GET /2/tweets"] == 3
+
+    # Cached, nothing is looked up again
+    assert existence_check.gone_ids(state.account.liked_tweet_ids) == gone_ids
+    assert state.stats["requests"]["GET /2/tweets"] == 3
+
+
+def test_archived_likes_already_gone_are_not_unliked(mock_api, tmp_path):
+    api, state = mock_api(MockTwitterAccount(0, 20, 0))
+    gone_ids = set(state.account.liked_tweet_ids[:5])
+    state.account.likes -= gone_ids
+    like_js = tmp_path / "like.js"
+    like_js.write_text("window.YTD.like.part0 = " + json.dumps([{"like": {"tweetId": liked_tweet_id}}
+                                                              for liked_tweet_id in state.account.liked_tweet_ids]))
+
+    assert bleach_likes(api, twitter_archive_js_file=str(like_js), existence_cache=ItemExistenceCache()) == 15
+    assert not state.account.likes
+    assert state.stats["requests"]["DELETE /2/users/:id/likes/:id"] == 15
+
+
+def test_cache_results_expire():
+    existence_cache = ItemExistenceCache(ttl_seconds=0)
+    existence_cache.put(EXISTENCE_LOOKUP_TWEETS, "1", True)
+    assert existence_cache.get(EXISTENCE_LOOKUP_TWEETS, "1") is None
+
+    existence_cache = ItemExistenceCache(max_cached_ids=2)
+    for item_id in ("1", "2", "3"):
+        existence_cache.put(EXISTENCE_LOOKUP_TWEETS, item_id, False)
+    assert len(existence_cache) == 2
+    assert existence_cache.get(EXISTENCE_LOOKUP_TWEETS, "1") is None
+    assert existence_cache.get(EXISTENCE_LOOKUP_TWEETS, "3") is False
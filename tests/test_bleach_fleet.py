@@ -0,0 +1,75 @@
+import time
+
+from bleach_checkpoint import BleachCheckpointStore, BLEACH_TYPE_LIKES, BLEACH_TYPE_TWEETS
+from bleach_existence_check import ItemExistenceCache
+from bleach_fleet import bleach_fleet
+from bleach_twitter_likes import bleach_likes
+from mock_twitter_api_server import MockTwitterAccount
+
+
+def test_every_account_has_its_own_existence_cache(mock_fleet):
+    account_store, configure_api, _ = mock_fleet({"first": MockTwitterAccount(0, 0, 0, user_id="1"),
+                                                  "second": MockTwitterAccount(0, 0, 0, user_id="2")})
+    shared_existence_cache = ItemExistenceCache(ttl_seconds=5)
+    existence_caches = []
+
+    def record_existence_cache(api, existence_cache=None, **kwargs):
+        existence_caches.append((api, existence_cache))
+        return 0
+
+    kwargs = {"existence_cache": shared_existence_cache}
+    bleach_fleet(account_store, [(BLEACH_TYPE_LIKES, record_existence_cache, kwargs),
+                                 (BLEACH_TYPE_TWEETS, record_existence_cache, kwargs)],
+                 configure_api=configure_api)
+
+    caches_by_api = {}
+    for api, existence_cache in existence_caches:
+        caches_by_api.setdefault(api, set()).add(existence_cache)
+    # The jobs of an account share a cache, the accounts don't
+    assert len(caches_by_api) == 2
+    assert all(len(caches) == 1 for caches in caches_by_api.values())
+    account_caches = [caches.pop() for caches in caches_by_api.values()]
+    assert account_caches[0] is not account_caches[1]
+    assert shared_existence_cache not in account_caches
+    assert all(existence_cache.ttl_seconds == 5 for existence_cache in account_caches)
+
+
+def test_fleet_bleaches_every_account(mock_fleet):
+    account_store, configure_api, states = mock_fleet({"first": MockTwitterAccount(0, 30, 0, user_id="1"),
+                                                       "second": MockTwitterAccount(0, 50, 0, user_id="2")})
+    checkpoint_store = BleachCheckpointStore()
+
+    results = bleach_fleet(account_store, [(BLEACH_TYPE_LIKES, bleach_likes, {})], checkpoint_store=checkpoint_store,
+                           configure_api=configure_api)
+
+    assert results == {"first": {BLEACH_TYPE_LIKES: 30}, "second": {BLEACH_TYPE_LIKES: 50}}
+    assert all(not state.account.likes for state in states.values())
+    # Progress is kept for each account
+    assert checkpoint_store.checkpoint(BLEACH_TYPE_LIKES, "1").processed_count() == 30
+    assert checkpoint_store.checkpoint(BLEACH_TYPE_LIKES, "2").processed_count() == 50
+
+
+def test_fleet_refreshes_expired_tokens_and_saves_them(mock_fleet):
+    account_store, configure_api, states = mock_fleet({"first": MockTwitterAccount(0, 5, 0)})
+    account = account_store.account("first")
+    account.save_tokens(account.access_token, account.refresh_token, expires_at=time.time() - 60)
+
+    assert bleach_fleet(account_store, [(BLEACH_TYPE_LIKES, bleach_likes, {})], configure_api=configure_api) == \
+        {"first": {BLEACH_TYPE_LIKES: 5}}
+
+    saved_account = account_store.account("first")
+    assert saved_account.access_token != account.access_token
+    assert saved_account.expires_in > 0
+    assert states["first"].stats["statuses"].get("401") is None
+
+
+def test_failed_account_does_not_stop_the_others(mock_fleet):
+    account_store, configure_api, _ = mock_fleet({"first": MockTwitterAccount(0, 5, 0, user_id="1"),
+                                                  "second": MockTwitterAccount(0, 5, 0, user_id="2")})
+    account = account_store.account("first")
+    # The server doesn't know the refresh token, so the expired token can't be refreshed
+    account.save_tokens(account.access_token, "unknown-refresh-token", expires_at=time.time() - 60)
+
+    results = bleach_fleet(account_store, [(BLEACH_TYPE_LIKES, bleach_likes, {})], configure_api=configure_api)
+
+    assert results == {"first": None, "second": {BLEACH_TYPE_LIKES: 5}}
@@ -0,0 +1,81 @@
+import logging
+import queue
+import time
+
+import pytest
+
+from bleach_logging import configure_logging, HotPathRateLimitFilter, NonBlockingQueueHandler
+
+
+@pytest.fixture
+def log_file(tmp_path):
+    """
+    :return: Function configuring logging to a file in tmp_path, the root logger is put back afterwards
+    """
+    root_logger = logging.getLogger()
+    level = root_logger.level
+    handlers = list(root_logger.handlers)
+    listeners = []
+
+    def make_log_file(**kwargs):
+        file_name = str(tmp_path / "bleach.log")
+        listeners.append(configure_logging(file_name, **kwargs))
+        return file_name, listeners[-1]
+
+    yield make_log_file
+
+    for listener in listeners:
+        listener.stop()
+    for handler in root_logger.handlers[:]:
+        if handler not in handlers:
+            root_logger.removeHandler(handler)
+    root_logger.setLevel(level)
+
+
+def test_structured_fields_written_at_end_of_line(log_file):
+    file_name, listener = log_file()
+
+    logging.getLogger("test").warning("Unliked %s", "123", extra={"item_id": "123", "status": 200})
+    listener.stop()
+
+    with open(file_name) as log:
+        line = log.read().strip()
+    assert line.endswith("WARNING  Unliked 123 item_id=123 status=200")
+
+
+def test_log_file_rotated(log_file, tmp_path):
+    file_name, listener = log_file(max_bytes=1000, backup_count=2)
+
+    for i in range(100):
+        logging.getLogger("test").info("Line %s of the log", i)
+    listener.stop()
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["bleach.log", "bleach.log.1", "bleach.log.2"]
+    assert all(path.stat().st_size <= 1000 for path in tmp_path.iterdir())
+
+
+def test_full_queue_drops_records():
+    queue_handler = NonBlockingQueueHandler(queue.SimpleQueue(), max_queued_records=3)
+    for i in range(5):
+        queue_handler.handle(logging.LogRecord("test", logging.INFO, __file__, 1, "Line %s", (i,), None))
+
+    assert queue_handler.queue.qsize() == 3
+    assert queue_handler.dropped_records == 2
+    # Left for the writer thread to format
+    assert queue_handler.queue.get().args == (0,)
+
+
+def test_hot_path_messages_rate_limited():
+    hot_path_filter = HotPathRateLimitFilter(records_per_interval=2, interval_seconds=0.1)
+
+    def record(msg):
+        return logging.LogRecord("test", logging.INFO, __file__, 1, msg, (), None)
+
+    assert [hot_path_filter.filter(record("Retry %s")) for _ in range(5)] == [True, True, False, False, False]
+    # Counted separately for each message
+    assert hot_path_filter.filter(record("Waiting %s"))
+
+    time.sleep(0.15)
+    next_record = record("Retry %s")
+    assert hot_path_filter.filter(next_record)
+    assert next_record.msg == "Retry %s (3 similar suppressed)"
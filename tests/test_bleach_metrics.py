@@ -0,0 +1,96 @@
+import re
+import urllib.request
+
+from bleach_checkpoint import BLEACH_TYPE_LIKES
+from bleach_metrics import BleachMetrics, BleachFleetMetrics, start_metrics_server, LATENCY_BUCKET_BOUNDS
+from bleach_twitter_likes import bleach_likes
+from mock_twitter_api_server import MockTwitterAccount
+
+# name{label="value",...} value, see https://prometheus.io/docs/instrumenting/exposition_formats/
+SAMPLE_LINE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{(?:[a-zA-Z_][a-zA-Z0-9_]*="[^"]*",?)*\})? (\S+)$')
+
+
+def parse_exposition(text):
+    """
+    :return: Dictionary of metric name to its type and list of (sample name, labels, value). Asserts every line is
+    well formed and every sample follows the HELP and TYPE of its metric
+    """
+    assert text.endswith("\n")
+    metrics = {}
+    current = None
+    for line in text.splitlines():
+        if line.startswith("# HELP "):
+            current = line.split(" ")[2]
+            assert current not in metrics
+            metrics[current] = {"samples": []}
+        elif line.startswith("# TYPE "):
+            _, _, name, metric_type = line.split(" ")
+            assert name == current and metric_type in ("counter", "gauge", "histogram")
+            metrics[current]["type"] = metric_type
+        else:
+            match = SAMPLE_LINE.match(line)
+            assert match, line
+            sample_name, labels, value = match.groups()
+            assert sample_name == current or sample_name.startswith(current + "_")
+            float(value)
+            metrics[current]["samples"].append((sample_name, dict(re.findall(r'(\w+)="([^"]*)"', labels or "")),
+                                                float(value)))
+    return metrics
+
+
+def test_exposition_format():
+    metrics = BleachMetrics()
+    for latency_seconds in (0.01, 0.2, 0.2, 60):
+        metrics.record_response("DELETE /2/users/:id/likes/:id", 200, latency_seconds)
+    metrics.record_response("DELETE /2/users/:id/likes/:id", 429)
+    metrics.record_rate_limit("DELETE /2/users/:id/likes/:id", 50, 45, 0)
+    metrics.start(BLEACH_TYPE_LIKES, expected_items=10)
+    metrics.record_items(BLEACH_TYPE_LIKES, 4)
+
+    parsed = parse_exposition(metrics.render())
+
+    assert parsed["twitter_bleach_api_calls_total"]["type"] == "counter"
+    assert {(labels["status"], value) for _, labels, value in parsed["twitter_bleach_api_calls_total"]["samples"]} \
+        == {("200", 4), ("429", 1)}
+    buckets = [(labels["le"], value) for name, labels, value in parsed["twitter_bleach_api_latency_seconds"]["samples"]
+               if name.endswith("_bucket")]
+    # Cumulative, ending in +Inf with the count
+    assert [le for le, _ in buckets] == [str(bound) for bound in LATENCY_BUCKET_BOUNDS] + ["+Inf"]
+    assert [value for _, value in buckets] == sorted(value for _, value in buckets)
+    assert buckets[-1][1] == 4
+    assert ("twitter_bleach_api_latency_seconds_count", {"endpoint": "DELETE /2/users/:id/likes/:id"}, 4) in \
+        parsed["twitter_bleach_api_latency_seconds"]["samples"]
+    assert parsed["twitter_bleach_items_processed_total"]["samples"] == \
+        [("twitter_bleach_items_processed_total", {"bleach_type": BLEACH_TYPE_LIKES}, 4)]
+    assert parsed["twitter_bleach_eta_seconds"]["samples"]
+
+
+def test_fleet_metrics_labelled_by_account():
+    fleet_metrics = BleachFleetMetrics()
+    fleet_metrics.account_metrics("first").record_items(BLEACH_TYPE_LIKES, 1)
+    fleet_metrics.account_metrics("second").record_items(BLEACH_TYPE_LIKES, 2)
+
+    parsed = parse_exposition(fleet_metrics.render())
+
+    assert [(labels["account"], value) for _, labels, value in
+            parsed["twitter_bleach_items_processed_total"]["samples"]] == [("first", 1), ("second", 2)]
+
+
+def test_served_during_a_run(mock_api):
+    api, state = mock_api(MockTwitterAccount(0, 20, 0))
+    api.metrics = BleachMetrics()
+    server = start_metrics_server(api.metrics, port=0)
+    try:
+        assert bleach_likes(api) == 20
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            parsed = parse_exposition(response.read().decode())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    unlikes = [value for _, labels, value in parsed["twitter_bleach_api_calls_total"]["samples"]
+               if labels == {"endpoint": "DELETE /2/users/:id/likes/:id", "status": "200"}]
+    assert unlikes == [20]
+    assert parsed["twitter_bleach_items_expected"]["samples"] == \
+        [("twitter_bleach_items_expected", {"bleach_type": BLEACH_TYPE_LIKES}, 20)]
@@ -0,0 +1,35 @@
+from bleach_twitter_blocks import plan_blocks
+from bleach_twitter_likes import plan_likes
+from mock_twitter_api_server import MockTwitterAccount, MockTwitterAPIConfig, twitter_rate_limits
+from retry_policy import RetryPolicy, RETRYABLE_ERROR_SERVICE_UNAVAILABLE
+
+
+def test_plan_reads_first_pages_and_estimates(mock_api):
+    api, state = mock_api(MockTwitterAccount(0, 500, 0))
+
+    plan = plan_likes(api)
+
+    assert plan.items == 500
+    assert plan.planning_calls == 3
+    assert state.stats["requests"]["GET /2/users/:id/liked_tweets"] == 2
+    assert "estimated" in plan.summary()
+
+
+def test_plan_without_a_count_is_a_lower_bound(mock_api):
+    api, state = mock_api(MockTwitterAccount(0, 0, 0, blocking_count=2500))
+
+    plan = plan_blocks(api)
+
+    assert plan.items == 2000
+    assert "at least" in plan.summary()
+
+
+def test_plan_retries_unavailable_pages(mock_api):
+    api, state = mock_api(MockTwitterAccount(0, 500, 0), MockTwitterAPIConfig(
+        rate_limits=twitter_rate_limits(window_seconds=0.2), service_unavailable_rate=0.5, random_seed=0))
+    # One retry in the API object, so pages that fail twice are left to the page retries
+    api.retry_policy = RetryPolicy(retry_budgets={RETRYABLE_ERROR_SERVICE_UNAVAILABLE: 1}, base_delay_seconds=0.01,
+                                   max_delay_seconds=0.05)
+
+    assert plan_likes(api).items == 500
+    assert state.stats["statuses"]["503"] > 0
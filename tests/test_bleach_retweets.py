@@ -0,0 +1,34 @@
+from bleach_checkpoint import BleachCheckpointStore, BLEACH_TYPE_RETWEETS
+from bleach_twitter_retweets import bleach_retweets
+from bleach_twitter_tweets import bleach_tweets
+from mock_twitter_api_server import MockTwitterAccount, MOCK_USER_ID
+
+
+def test_undo_retweets_leaves_own_tweets(mock_api):
+    api, state = mock_api(MockTwitterAccount(25, 0, 0))
+    own_tweet_ids = set(state.account.tweet_ids) - state.account.retweet_ids
+
+    assert bleach_retweets(api) == 5
+    assert state.account.tweets == own_tweet_ids
+    assert state.stats["items_removed"] == 5
+    assert state.stats["redundant_writes"] == 0
+
+
+def test_delete_tweets_undoes_retweets(mock_api):
+    api, state = mock_api(MockTwitterAccount(25, 0, 0))
+
+    assert bleach_tweets(api) == 25
+    assert not state.account.tweets
+    assert state.stats["requests"]["DELETE /2/users/:id/retweets/:id"] == 5
+    assert state.stats["redundant_writes"] == 0
+
+
+def test_archived_retweet_without_retweeted_id_is_left(mock_api, tmp_path):
+    api, state = mock_api(MockTwitterAccount(5, 0, 0))
+    tweets_js = tmp_path / "tweets.js"
+    tweets_js.write_text('window.YTD.tweets.part0 = [{"tweet": {"id_str": "1", "full_text": "RT @someone: hi"}}]')
+    checkpoint_store = BleachCheckpointStore()
+
+    assert bleach_retweets(api, checkpoint_store=checkpoint_store, twitter_archive_js_file=str(tweets_js)) == 0
+    assert state.stats["requests"].get("DELETE /2/users/:id/retweets/:id") is None
+    assert not checkpoint_store.checkpoint(BLEACH_TYPE_RETWEETS, MOCK_USER_ID).is_processed("1")
@@ -0,0 +1,91 @@
+import datetime
+
+import pytest
+
+from bleach_rules import created_before_days_ago, public_metric_below, engagement_below, is_pinned, is_reply, \
+    is_retweet, parse_rule
+
+NOW = datetime.datetime(2022, 2, 10, tzinfo=datetime.timezone.utc)
+
+OLD_UNPOPULAR_TWEET = {"id": "1", "text": "old", "created_at": "2020-01-01T00:00:00.000Z",
+                       "public_metrics": {"like_count": 1}}
+NEW_POPULAR_TWEET = {"id": "2", "text": "new", "created_at": "2022-02-01T00:00:00.000Z",
+                     "public_metrics": {"like_count": 100}}
+# Tweets from a downloaded archive have no public_metrics
+ARCHIVED_TWEET = {"id": "3", "text": "archived", "created_at": "2020-01-01T00:00:00.000Z"}
+
+
+def matches(bleach_rule, item):
+    return bleach_rule.compile({"now": NOW, "pinned_tweet_id": "2"})(item)
+
+
+def test_rule_matches():
+    bleach_rule = created_before_days_ago(365) & public_metric_below("like_count", 5) & ~is_pinned()
+    assert matches(bleach_rule, OLD_UNPOPULAR_TWEET)
+    assert not matches(bleach_rule, NEW_POPULAR_TWEET)
+
+
+def test_negated_rule_keeps_items_missing_the_field():
+    assert not matches(public_metric_below("like_count", 5), ARCHIVED_TWEET)
+    assert not matches(~public_metric_below("like_count", 5), ARCHIVED_TWEET)
+    assert matches(~public_metric_below("like_count", 5), NEW_POPULAR_TWEET)
+
+
+def test_combined_rule_decided_by_one_side():
+    # False and unknown is False, true or unknown is True
+    assert not matches(~(created_before_days_ago(365) & public_metric_below("like_count", 5)), ARCHIVED_TWEET)
+    assert matches(~(~created_before_days_ago(365) & public_metric_below("like_count", 5)), ARCHIVED_TWEET)
+    assert matches(created_before_days_ago(365) | public_metric_below("like_count", 5), ARCHIVED_TWEET)
+    assert not matches(~(created_before_days_ago(365) | public_metric_below("like_count", 5)), ARCHIVED_TWEET)
+
+
+def test_not_reply_matches_tweet_without_referenced_tweets():
+    assert matches(~is_reply(), OLD_UNPOPULAR_TWEET)
+    assert not matches(~is_reply(), {"id": "4", "referenced_tweets": [{"type": "replied_to", "id": "1"}]})
+
+
+def test_retweet_told_by_referenced_tweets_not_text():
+    # An original tweet that happens to start with 'RT '
+    assert not matches(is_retweet(), {"id": "5", "text": "RT is short for retweet"})
+    assert matches(is_retweet(), {"id": "6", "text": "RT @someone: hi",
+                                  "referenced_tweets": [{"type": "retweeted", "id": "1"}]})
+
+
+def test_parse_rule():
+    bleach_rule = parse_rule("created_before_days_ago(365) & public_metric_below('like_count', threshold=5) "
+                             "& ~is_pinned()")
+    assert bleach_rule.tweet_fields == {"created_at", "public_metrics"}
+    assert bleach_rule.needs_pinned_tweet_id
+    assert matches(bleach_rule, OLD_UNPOPULAR_TWEET)
+    assert not matches(bleach_rule, NEW_POPULAR_TWEET)
+
+
+@pytest.mark.parametrize("expression", [
+    "__import__('os').system('true')",
+    "created_before_days_ago(365).__class__",
+    "is_pinned() and is_reply()",
+    "created_before_days_ago(days=open('/etc/passwd'))",
+    "text_contains_any(**{'keywords': ['a']})",
+    "created_before_days_ago(",
+    "unknown_rule()",
+    "created_before_days_ago('a', 'b')",
+    "text_matches('(')",
+    "created_before_days_ago('a')",
+    "created_before_days_ago(-1)",
+    "created_before_days_ago(1e12)",
+    "public_metric_below('like_count', '5')",
+    "public_metric_below(5, 'like_count')",
+    "engagement_below(True)",
+    "~" * 100000 + "is_pinned()",
+])
+def test_parse_rule_rejects(expression):
+    with pytest.raises(ValueError):
+        parse_rule(expression)
+
+
+def test_rule_arguments_checked_when_made():
+    with pytest.raises(ValueError):
+        public_metric_below("like_count", "5")
+    with pytest.raises(ValueError):
+        engagement_below(None)
+    assert matches(engagement_below(2.5), {"id": "7", "public_metrics": {"like_count": 2}})
@@ -0,0 +1,67 @@
+from bleach_checkpoint import BLEACH_TYPE_FOLLOWS, BLEACH_TYPE_LIKES, BLEACH_TYPE_BLOCKS, BLEACH_TYPE_MUTES, \
+    BLEACH_TYPE_LISTS
+from bleach_fleet import bleach_fleet
+from bleach_snapshot import BleachSnapshotStore, take_snapshot, restore_follows, snapshot_bleach_types
+from bleach_twitter_follows import bleach_follows
+from bleach_twitter_likes import bleach_likes
+from mock_twitter_api_server import MockTwitterAccount, MockTwitterAPIConfig, MOCK_USER_ID, twitter_rate_limits
+from retry_policy import RetryPolicy, RETRYABLE_ERROR_SERVICE_UNAVAILABLE
+
+
+def test_restore_follows_after_later_snapshot_without_follows(mock_api):
+    api, state = mock_api(MockTwitterAccount(0, 20, 30))
+    snapshot_store = BleachSnapshotStore()
+
+    take_snapshot(api, snapshot_store, bleach_types=[BLEACH_TYPE_FOLLOWS])
+    assert bleach_follows(api) == 30
+    assert not state.account.following
+
+    # A later snapshot of only the likes must not hide the follows of the earlier one
+    take_snapshot(api, snapshot_store, bleach_types=[BLEACH_TYPE_LIKES])
+    assert restore_follows(api, snapshot_store) == 30
+    assert state.account.following == set(state.account.following_ids)
+
+
+def test_latest_snapshot_of_bleach_type(mock_api):
+    api, _ = mock_api(MockTwitterAccount(5, 5, 5))
+    snapshot_store = BleachSnapshotStore()
+
+    follows_snapshot_id = take_snapshot(api, snapshot_store, bleach_types=[BLEACH_TYPE_FOLLOWS])
+    likes_snapshot_id = take_snapshot(api, snapshot_store, bleach_types=[BLEACH_TYPE_LIKES])
+
+    assert snapshot_store.latest_snapshot_id(MOCK_USER_ID) == likes_snapshot_id
+    assert snapshot_store.latest_snapshot_id(MOCK_USER_ID, BLEACH_TYPE_FOLLOWS) == follows_snapshot_id
+    assert snapshot_store.bleach_types(likes_snapshot_id) == {BLEACH_TYPE_LIKES}
+
+
+def test_snapshot_retries_unavailable_pages(mock_api):
+    api, state = mock_api(MockTwitterAccount(0, 300, 0), MockTwitterAPIConfig(
+        rate_limits=twitter_rate_limits(window_seconds=0.2), service_unavailable_rate=0.5, random_seed=0))
+    # One retry in the API object, so pages that fail twice are left to the page retries
+    api.retry_policy = RetryPolicy(retry_budgets={RETRYABLE_ERROR_SERVICE_UNAVAILABLE: 1}, base_delay_seconds=0.01,
+                                   max_delay_seconds=0.05)
+    snapshot_store = BleachSnapshotStore()
+
+    snapshot_id = take_snapshot(api, snapshot_store, bleach_types=[BLEACH_TYPE_LIKES])
+
+    assert snapshot_store.counts(snapshot_id)[BLEACH_TYPE_LIKES] == 300
+    assert state.stats["statuses"]["503"] > 0
+
+
+def test_fleet_snapshots_every_account(mock_fleet):
+    account_store, configure_api, states = mock_fleet({"first": MockTwitterAccount(0, 5, 0, user_id="1"),
+                                                       "second": MockTwitterAccount(0, 7, 0, user_id="2")})
+    snapshot_store = BleachSnapshotStore()
+
+    bleach_fleet(account_store, [(BLEACH_TYPE_LIKES, bleach_likes, {})], configure_api=configure_api,
+                 snapshot_store=snapshot_store)
+
+    assert all(not state.account.likes for state in states.values())
+    assert snapshot_store.counts(snapshot_store.latest_snapshot_id("1"))[BLEACH_TYPE_LIKES] == 5
+    assert snapshot_store.counts(snapshot_store.latest_snapshot_id("2"))[BLEACH_TYPE_LIKES] == 7
+
+
+def test_no_snapshot_of_kinds_without_one():
+    assert snapshot_bleach_types([BLEACH_TYPE_BLOCKS, BLEACH_TYPE_MUTES, BLEACH_TYPE_LISTS]) == []
+    assert snapshot_bleach_types([BLEACH_TYPE_LIKES, BLEACH_TYPE_FOLLOWS, BLEACH_TYPE_BLOCKS],
+                                 unfinished_bleach_types={BLEACH_TYPE_FOLLOWS}) == [BLEACH_TYPE_LIKES]
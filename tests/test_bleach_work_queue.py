@@ -0,0 +1,34 @@
+from bleach_checkpoint import BleachCheckpointStore, BLEACH_TYPE_BLOCKS, BLEACH_TYPE_LIKES
+from bleach_twitter_blocks import bleach_blocks, MAX_BLOCKED_USERS_PER_PAGE
+from bleach_twitter_likes import bleach_likes
+from mock_twitter_api_server import MockTwitterAccount, MOCK_USER_ID
+
+
+def test_resume_with_pending_items_fits_full_page(mock_api):
+    api, state = mock_api(MockTwitterAccount(0, 0, 0, blocking_count=MAX_BLOCKED_USERS_PER_PAGE + 500))
+    checkpoint_store = BleachCheckpointStore()
+    # A previous run deferred an item and stopped before it was done
+    checkpoint_store.checkpoint(BLEACH_TYPE_BLOCKS, MOCK_USER_ID).add_pending({"id": "999"})
+
+    bleach_blocks(api, checkpoint_store=checkpoint_store)
+
+    checkpoint = checkpoint_store.checkpoint(BLEACH_TYPE_BLOCKS, MOCK_USER_ID)
+    assert state.stats["items_removed"] == MAX_BLOCKED_USERS_PER_PAGE + 500
+    assert checkpoint.pending_items() == []
+    assert checkpoint.finished
+
+
+def test_stopped_run_resumes_without_redoing_items(mock_api):
+    api, state = mock_api(MockTwitterAccount(0, 120, 0))
+    checkpoint_store = BleachCheckpointStore()
+
+    assert bleach_likes(api, unlike_limit=30, checkpoint_store=checkpoint_store) == 30
+    checkpoint = checkpoint_store.checkpoint(BLEACH_TYPE_LIKES, MOCK_USER_ID)
+    # The items done before the limit stopped the run are recorded, not only those of whole pages
+    assert checkpoint.processed_count() == 30
+    assert not checkpoint.finished
+
+    assert bleach_likes(api, checkpoint_store=checkpoint_store) == 90
+    assert state.stats["items_removed"] == 120
+    assert state.stats["redundant_writes"] == 0
+    assert checkpoint.finished
@@ -0,0 +1,56 @@
+import time
+
+import pytest
+
+from rate_limit_scheduler import RateLimitScheduler, rate_limit_endpoint_key
+
+ENDPOINT = "DELETE /2/users/:id/likes/:id"
+
+
+def rate_limit_headers(limit, remaining, reset_at):
+    return {"x-rate-limit-limit": str(limit), "x-rate-limit-remaining": str(remaining),
+            "x-rate-limit-reset": str(reset_at)}
+
+
+def test_endpoint_key_replaces_ids():
+    assert rate_limit_endpoint_key("delete", "https://api.twitter.com/2/users/12/likes/34") == ENDPOINT
+
+
+def test_takes_tokens_until_bucket_is_empty():
+    scheduler = RateLimitScheduler(reset_margin_seconds=0.5)
+    reset_at = time.time() + 60
+    scheduler.update_from_headers(ENDPOINT, rate_limit_headers(50, 2, reset_at))
+
+    assert scheduler.reserve(ENDPOINT) == 0
+    assert scheduler.reserve(ENDPOINT) == 0
+    # Empty, wait for the window to reset plus the margin
+    assert scheduler.reserve(ENDPOINT) == pytest.approx(reset_at - time.time() + 0.5, abs=0.1)
+    assert scheduler.status(ENDPOINT) == (50, 0, reset_at)
+
+
+def test_acquire_waits_for_window_to_reset():
+    scheduler = RateLimitScheduler(reset_margin_seconds=0.01)
+    scheduler.update_from_headers(ENDPOINT, rate_limit_headers(50, 0, time.time() + 0.2))
+
+    started = time.monotonic()
+    waited = scheduler.acquire(ENDPOINT)
+
+    assert 0.15 <= time.monotonic() - started < 1
+    assert waited > 0
+    # The bucket refilled from the limit when the window reset
+    assert scheduler.status(ENDPOINT)[1] == 49
+
+
+def test_unknown_endpoint_is_not_held():
+    scheduler = RateLimitScheduler()
+    assert scheduler.reserve(ENDPOINT) == 0
+    assert scheduler.acquire("GET /2/users/me") == 0
+
+
+def test_429_empties_the_bucket():
+    scheduler = RateLimitScheduler(reset_margin_seconds=0)
+    scheduler.update_from_headers(ENDPOINT, rate_limit_headers(50, 10, time.time() + 60))
+
+    scheduler.mark_exhausted(ENDPOINT, time.time() + 30)
+
+    assert scheduler.reserve(ENDPOINT) == pytest.approx(30, abs=0.5)
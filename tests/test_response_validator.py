@@ -0,0 +1,43 @@
+import pytest
+
+from response_validator import ResponseValidator, ResponseValidationException
+
+LIKED_TWEETS_ENDPOINT = "GET /2/users/:id/liked_tweets"
+
+
+@pytest.mark.parametrize("page", [
+    {"data": [{"id": 1, "text": "id is not a string"}]},
+    {"data": [{"id": "1"}]},
+    {"data": {"id": "1", "text": "not a list"}},
+    {"data": [{"id": "1", "text": "hi", "public_metrics": {"like_count": "5"}}]},
+    {"data": [{"id": "1", "text": "hi"}], "meta": {"next_token": 5}},
+])
+def test_malformed_page_rejected(page):
+    with pytest.raises(ResponseValidationException):
+        ResponseValidator().validate(LIKED_TWEETS_ENDPOINT, page)
+
+
+def test_well_formed_page_accepted():
+    ResponseValidator().validate(LIKED_TWEETS_ENDPOINT, {"data": [{"id": "1", "text": "hi",
+                                                                   "public_metrics": {"like_count": 5}}],
+                                                         "meta": {"result_count": 1, "next_token": "abc"}})
+
+
+def test_empty_page_gets_a_data_list():
+    page = {"meta": {"result_count": 0}}
+    ResponseValidator().validate(LIKED_TWEETS_ENDPOINT, page)
+    assert page["data"] == []
+
+
+def test_unsampled_pages_only_have_their_shape_checked():
+    response_validator = ResponseValidator(sample_rate=0.0)
+
+    # Missing 'text' only fails the full schema
+    response_validator.validate(LIKED_TWEETS_ENDPOINT, {"data": [{"id": "1"}]})
+    with pytest.raises(ResponseValidationException):
+        response_validator.validate(LIKED_TWEETS_ENDPOINT, {"data": [{"id": 1}]})
+    assert (response_validator.responses_checked, response_validator.responses_fully_validated) == (2, 0)
+
+
+def test_endpoint_without_schema_not_checked():
+    ResponseValidator().validate("GET /2/users/me", {"data": "anything"})
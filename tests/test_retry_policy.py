@@ -0,0 +1,48 @@
+import random
+
+import requests
+
+from mock_twitter_api_server import MockTwitterAccount, MockTwitterAPIConfig, MOCK_USER_ID, twitter_rate_limits
+from retry_policy import RetryPolicy, RETRYABLE_ERROR_SERVICE_UNAVAILABLE, RETRYABLE_ERROR_TIMEOUT, \
+    RETRYABLE_ERROR_CONNECTION
+
+
+def test_full_jitter_delays_within_bounds():
+    retry_policy = RetryPolicy(base_delay_seconds=1.0, max_delay_seconds=10.0, random_generator=random.Random(1))
+
+    for retries_so_far, upper_bound in [(0, 1.0), (1, 2.0), (2, 4.0), (3, 8.0), (4, 10.0), (10, 10.0)]:
+        delays = [retry_policy.delay_seconds(retries_so_far) for _ in range(200)]
+        assert all(0 <= delay <= upper_bound for delay in delays)
+        # Spread over the whole range, not bunched at the bound
+        assert min(delays) < upper_bound * 0.1 and max(delays) > upper_bound * 0.9
+
+
+def test_retry_budgets():
+    retry_policy = RetryPolicy(retry_budgets={RETRYABLE_ERROR_SERVICE_UNAVAILABLE: 2})
+
+    assert retry_policy.should_retry(RETRYABLE_ERROR_SERVICE_UNAVAILABLE, 0)
+    assert retry_policy.should_retry(RETRYABLE_ERROR_SERVICE_UNAVAILABLE, 1)
+    assert not retry_policy.should_retry(RETRYABLE_ERROR_SERVICE_UNAVAILABLE, 2)
+    # Kinds without a budget aren't retried
+    assert not retry_policy.should_retry(RETRYABLE_ERROR_TIMEOUT, 0)
+    assert retry_policy.metrics() == {"retries": {RETRYABLE_ERROR_SERVICE_UNAVAILABLE: 2},
+                                      "exhausted": {RETRYABLE_ERROR_SERVICE_UNAVAILABLE: 1,
+                                                    RETRYABLE_ERROR_TIMEOUT: 1}}
+
+
+def test_classify_exception():
+    assert RetryPolicy.classify_exception(requests.ConnectTimeout()) == RETRYABLE_ERROR_TIMEOUT
+    assert RetryPolicy.classify_exception(requests.ConnectionError()) == RETRYABLE_ERROR_CONNECTION
+    assert RetryPolicy.classify_exception(ValueError()) is None
+
+
+def test_api_retries_unavailable_responses(mock_api):
+    api, state = mock_api(MockTwitterAccount(0, 0, 0), MockTwitterAPIConfig(
+        rate_limits=twitter_rate_limits(window_seconds=0.2), service_unavailable_rate=0.5, random_seed=0))
+    api.retry_policy = RetryPolicy(base_delay_seconds=0.01, max_delay_seconds=0.05)
+
+    for _ in range(10):
+        assert api.get_me(return_json=True)["data"]["id"] == MOCK_USER_ID
+
+    assert state.stats["statuses"]["503"] == api.retry_policy.metrics()["retries"][RETRYABLE_ERROR_SERVICE_UNAVAILABLE]
+    assert state.stats["statuses"]["503"] > 0
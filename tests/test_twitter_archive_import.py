@@ -0,0 +1,22 @@
+import json
+
+from twitter_archive_import import archived_tweets
+
+
+def write_archive_file(path, assignment, entries):
+    path.write_text(f"{assignment} = {json.dumps(entries, indent=2)}", encoding="utf-8")
+    return str(path)
+
+
+def test_archived_retweets_and_replies(tmp_path):
+    tweets_js = write_archive_file(tmp_path / "tweets.js", "window.YTD.tweets.part0", [
+        {"tweet": {"id_str": "1", "full_text": "RT @someone: hi", "created_at": "Wed Oct 10 20:19:24 +0000 2018"}},
+        {"tweet": {"id_str": "2", "full_text": "@someone hi", "in_reply_to_status_id_str": "9"}},
+        {"tweet": {"id_str": "3", "full_text": "RT is short for retweet"}},
+    ])
+
+    tweets = list(archived_tweets(tweets_js))
+    assert tweets[0] == {"id": "1", "text": "RT @someone: hi", "created_at": "2018-10-10T20:19:24.000Z",
+                         "referenced_tweets": [{"type": "retweeted"}]}
+    assert tweets[1]["referenced_tweets"] == [{"type": "replied_to", "id": "9"}]
+    assert "referenced_tweets" not in tweets[2]
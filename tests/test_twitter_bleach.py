@@ -0,0 +1,104 @@
+import logging
+
+import pytest
+
+import twitter_bleach
+from bleach_account_store import BleachAccountStore, load_or_create_token_key, TOKEN_KEY_ENVIRONMENT_VARIABLE
+from bleach_checkpoint import BLEACH_TYPE_LIKES
+from bleach_snapshot import BleachSnapshotStore
+from mock_twitter_api_server import MockTwitterAccount, MOCK_USER_ID
+from wrapped_pytwitter_api import WrappedPyTwitterAPI
+
+
+@pytest.fixture
+def state_directory(tmp_path, monkeypatch):
+    """
+    :return: State directory for the command line, the root logger is put back after the commands configured it
+    """
+    for environment_variable in ("TWITTER_CLIENT_ID", "TWITTER_ACCOUNT_NAME", TOKEN_KEY_ENVIRONMENT_VARIABLE):
+        monkeypatch.delenv(environment_variable, raising=False)
+    root_logger = logging.getLogger()
+    level = root_logger.level
+    handlers = list(root_logger.handlers)
+
+    yield tmp_path
+
+    for handler in root_logger.handlers[:]:
+        if handler not in handlers:
+            root_logger.removeHandler(handler)
+    root_logger.setLevel(level)
+
+
+@pytest.fixture
+def saved_account(state_directory, mock_server, monkeypatch):
+    """
+    :return: Function taking a MockTwitterAccount, saving an account authorized against a mock server for it and
+    returning the MockTwitterAPIState of the server
+    """
+    def make_saved_account(account):
+        base_url, state = mock_server(account)
+        monkeypatch.setattr(WrappedPyTwitterAPI, "BASE_URL_V2", base_url)
+        tokens = state.issue_tokens()
+        account_store = BleachAccountStore(
+            str(state_directory / twitter_bleach.ACCOUNT_STORE_FILE_NAME),
+            encryption_key=load_or_create_token_key(str(state_directory / twitter_bleach.TOKEN_KEY_FILE_NAME)))
+        account_store.save_account("mockuser", "mock-client-id", tokens["access_token"], tokens["refresh_token"])
+        account_store.close()
+        return state
+
+    return make_saved_account
+
+
+def run(state_directory, *argv):
+    return twitter_bleach.main(list(argv) + ["--state-dir", str(state_directory)])
+
+
+def test_status_without_progress(state_directory, capsys):
+    assert run(state_directory, "status") == twitter_bleach.EXIT_OK
+    assert capsys.readouterr().out == "No progress saved\n"
+
+
+def test_bad_rule_is_a_usage_error(state_directory):
+    with pytest.raises(SystemExit) as exit_info:
+        run(state_directory, "likes", "--rule", "created_before_days_ago('a')")
+    assert exit_info.value.code == twitter_bleach.EXIT_USAGE
+
+
+def test_no_browser_without_saved_account(state_directory):
+    assert run(state_directory, "likes", "--no-browser", "--client-id", "id") == twitter_bleach.EXIT_AUTH_REQUIRED
+
+
+def test_limited_run_is_resumed(state_directory, saved_account, capsys):
+    state = saved_account(MockTwitterAccount(0, 20, 0))
+
+    assert run(state_directory, "likes", "--limit", "5", "--no-browser") == twitter_bleach.EXIT_INCOMPLETE
+    assert len(state.account.likes) == 15
+    assert run(state_directory, "status") == twitter_bleach.EXIT_INCOMPLETE
+    assert "not finished" in capsys.readouterr().out
+
+    assert run(state_directory, "resume", "--no-browser") == twitter_bleach.EXIT_OK
+    assert not state.account.likes
+    assert run(state_directory, "status") == twitter_bleach.EXIT_OK
+    assert run(state_directory, "resume", "--no-browser") == twitter_bleach.EXIT_OK
+    assert capsys.readouterr().out.endswith("Nothing to resume\n")
+
+    # The snapshot was taken before the first run, not again on resume
+    snapshot_store = BleachSnapshotStore(str(state_directory / twitter_bleach.SNAPSHOT_FILE_NAME))
+    assert snapshot_store.counts(snapshot_store.latest_snapshot_id(MOCK_USER_ID))[BLEACH_TYPE_LIKES] == 20
+
+
+def test_no_snapshot_of_blocks(state_directory, saved_account):
+    state = saved_account(MockTwitterAccount(0, 0, 0, blocking_count=5))
+
+    assert run(state_directory, "blocks", "--no-browser") == twitter_bleach.EXIT_OK
+    assert not state.account.blocking
+    snapshot_store = BleachSnapshotStore(str(state_directory / twitter_bleach.SNAPSHOT_FILE_NAME))
+    assert snapshot_store.latest_snapshot_id(MOCK_USER_ID) is None
+
+
+def test_plan_removes_nothing(state_directory, saved_account, capsys):
+    state = saved_account(MockTwitterAccount(10, 0, 0))
+
+    assert run(state_directory, "plan", "tweets", "--no-browser") == twitter_bleach.EXIT_OK
+    assert capsys.readouterr().out.startswith("tweets: 10 items in 1 pages")
+    assert len(state.account.tweets) == 10
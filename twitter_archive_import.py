@@ -0,0 +1,250 @@
+import datetime
+import itertools
+import json
+import logging
+
+# Read the items to bleach from the archive Twitter lets an account holder download
+# https://help.twitter.com/en/managing-your-account/how-to-download-your-twitter-archive
+#
+# The archive 'data' directory has a JS file per kind of activity. Each file is a single JavaScript assignment of a
+# JSON array, e.g.
+#
+#   window.YTD.like.part0 = [
+#     { "like" : { "tweetId" : "1480985876184420356", "fullText" : "..." } },
+#     ...
+#   ]
+#
+# Using the archive means the bleach loops don't spend read requests paging through the API. It also reaches tweets
+# the timeline endpoint can't return, the API only lists the most recent ~3200 tweets of a user.
+#
+# Archives can be hundreds of MB so the files are parsed one array element at a time instead of loaded whole.
+#
+
+ARCHIVE_TWEETS_FILE_NAME = "tweets.js"
+ARCHIVE_LIKES_FILE_NAME = "like.js"
+ARCHIVE_FOLLOWING_FILE_NAME = "following.js"
+ARCHIVE_BLOCKS_FILE_NAME = "block.js"
+ARCHIVE_MUTES_FILE_NAME = "mute.js"
+
+ARCHIVE_PAGINATION_TOKEN_PREFIX = "archive:"
+
+_read_chunk_size = 64 * 1024
+
+_archive_created_at_format = "%a %b %d %H:%M:%S %z %Y"
+
+
+class TwitterArchiveFormatException(Exception):
+    pass
+
+
+def _read_more(archive_file, buffer):
+    chunk = archive_file.read(_read_chunk_size)
+    return buffer + chunk, len(chunk) > 0
+
+
+def stream_archive_entries(archive_file_path):
+    """
+    Yield the elements of the JSON array in a Twitter archive JS file one at a time
+
+    :param archive_file_path: Path to a JS file from the 'data' directory of the archive
+    :return: Generator of dictionaries, one per array element
+    :raises TwitterArchiveFormatException: If the file isn't a JavaScript assignment of a JSON array
+    """
+    decoder = json.JSONDecoder()
+
+    with open(archive_file_path, encoding="utf-8") as archive_file:
+        buffer = ""
+        more = True
+
+        # Skip the 'window.YTD.xxx.part0 =' assignment to get to the start of the array
+        while "[" not in buffer and more:
+            buffer, more = _read_more(archive_file, buffer)
+        assignment, _, buffer = buffer.partition("[")
+        if "=" not in assignment:
+            raise TwitterArchiveFormatException(f"'{archive_file_path}' does not look like a Twitter archive file")
+
+        position = 0
+        while True:
+            # Skip separators between elements
+            while True:
+                while position < len(buffer) and buffer[position] in " \t\r\n,":
+                    position += 1
+                if position < len(buffer) or not more:
+                    break
+                buffer, more = _read_more(archive_file, buffer[position:])
+                position = 0
+
+            if position >= len(buffer):
+                raise TwitterArchiveFormatException(f"'{archive_file_path}' ended before the end of the array")
+            if buffer[position] == "]":
+                return
+
+            try:
+                entry, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not more:
+                    raise TwitterArchiveFormatException(f"'{archive_file_path}' has an incomplete element at the end")
+                # The element is split over the end of the buffer. Drop what has been consumed and read more
+                buffer, more = _read_more(archive_file, buffer[position:])
+                position = 0
+                continue
+
+            yield entry
+
+
+def _archive_created_at_to_iso(created_at):
+    """
+    Archive dates look like 'Wed Oct 10 20:19:24 +0000 2018', the API uses ISO 8601 '2018-10-10T20:19:24.000Z'
+    """
+    if created_at is None:
+        return None
+    try:
+        parsed = datetime.datetime.strptime(created_at, _archive_created_at_format)
+    except ValueError:
+        logging.warning(f"Archive created_at '{created_at}' is not in the expected format")
+        return None
+    return parsed.astimezone(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def archived_tweets(tweets_js_path):
+    """
+    :param tweets_js_path: Path to tweets.js in the archive
+    :return: Generator of tweet dictionaries with the same keys as the timeline API, 'id', 'text' and 'created_at',
+    and 'referenced_tweets' for replies and retweets. The archive doesn't have the ID of the tweet a retweet retweeted,
+    so the 'retweeted' entry has no 'id'
+    """
+    for entry in stream_archive_entries(tweets_js_path):
+        tweet = entry.get("tweet", entry)
+        archived_tweet = {
+            "id": tweet.get("id_str", tweet.get("id")),
+            "text": tweet.get("full_text", tweet.get("text", "")),
+            "created_at": _archive_created_at_to_iso(tweet.get("created_at"))
+        }
+        in_reply_to_tweet_id = tweet.get("in_reply_to_status_id_str")
+        if in_reply_to_tweet_id:
+            # As the API has it, so the reply rules work on archived tweets
+            archived_tweet["referenced_tweets"] = [{"type": "replied_to", "id": in_reply_to_tweet_id}]
+        elif archived_tweet["text"].startswith("RT @"):
+            # Only the text of an archived tweet shows it is a retweet
+            archived_tweet["referenced_tweets"] = [{"type": "retweeted"}]
+        yield archived_tweet
+
+
+def archived_likes(like_js_path):
+    """
+    :param like_js_path: Path to like.js in the archive
+    :return: Generator of liked tweet dictionaries with the same keys as the liked tweets API, 'id' and 'text'
+    """
+    for entry in stream_archive_entries(like_js_path):
+        like = entry.get("like", entry)
+        yield {
+            "id": like["tweetId"],
+            "text": like.get("fullText", "")
+        }
+
+
+def archived_following(following_js_path):
+    """
+    The archive only has the ID of followed users. The name and username are not known
+
+    :param following_js_path: Path to following.js in the archive
+    :return: Generator of user dictionaries with the 'id' key
+    """
+    for entry in stream_archive_entries(following_js_path):
+        following = entry.get("following", entry)
+        yield {
+            "id": following["accountId"]
+        }
+
+
+def archived_blocking(block_js_path):
+    """
+    The archive only has the ID of blocked users
+
+    :param block_js_path: Path to block.js in the archive
+    :return: Generator of user dictionaries with the 'id' key
+    """
+    for entry in stream_archive_entries(block_js_path):
+        blocking = entry.get("blocking", entry)
+        yield {
+            "id": blocking["accountId"]
+        }
+
+
+def archived_muting(mute_js_path):
+    """
+    The archive only has the ID of muted users
+
+    :param mute_js_path: Path to mute.js in the archive
+    :return: Generator of user dictionaries with the 'id' key
+    """
+    for entry in stream_archive_entries(mute_js_path):
+        muting = entry.get("muting", entry)
+        yield {
+            "id": muting["accountId"]
+        }
+
+
+def is_archive_pagination_token(pagination_token):
+    return pagination_token is not None and pagination_token.startswith(ARCHIVE_PAGINATION_TOKEN_PREFIX)
+
+
+class ArchivePager:
+    """
+    Serves archive items in pages shaped like API responses, {"data": [...], "meta": {...}}, so the bleach loops can
+    use the archive in place of API calls. Like the API, asking for the same pagination token again returns the same
+    page. The 'next_token' of a page is the offset of the next item in the archive so it can be kept in a checkpoint
+    and passed back on a later run.
+    """
+
+    def __init__(self, archive_reader, archive_file_path, page_size=100):
+        """
+        :param archive_reader: Function that yields items from an archive file, e.g. archived_likes
+        :param archive_file_path: Path to the archive file passed to archive_reader
+        :param page_size: Number of items in each page
+        """
+        self.archive_reader = archive_reader
+        self.archive_file_path = archive_file_path
+        self.page_size = page_size
+
+        self._archive_items = None
+        self._offset = 0
+        self._page = None
+
+    def _rewind(self):
+        self._archive_items = iter(self.archive_reader(self.archive_file_path))
+        self._offset = 0
+        self._page = None
+
+    def get_page(self, pagination_token=None):
+        """
+        :param pagination_token: 'next_token' of an earlier page. Default None, the first page
+        :return: Page dictionary, 'next_token' is left out of the 'meta' of the last page
+        """
+        offset = 0
+        if is_archive_pagination_token(pagination_token):
+            offset = int(pagination_token[len(ARCHIVE_PAGINATION_TOKEN_PREFIX):])
+
+        if self._page is not None and offset == self._offset:
+            return self._page
+
+        if self._archive_items is None or offset < self._offset:
+            self._rewind()
+
+        if self._page is not None:
+            self._offset += len(self._page["data"])
+
+        # Skipping still parses the skipped items, but doesn't keep them
+        next(itertools.islice(self._archive_items, offset - self._offset, offset - self._offset), None)
+        self._offset = offset
+
+        # Read one item past the page to know if there is a next page
+        items = list(itertools.islice(self._archive_items, self.page_size + 1))
+        data = items[:self.page_size]
+        meta = {"result_count": len(data)}
+        if len(items) > self.page_size:
+            meta["next_token"] = f"{ARCHIVE_PAGINATION_TOKEN_PREFIX}{offset + self.page_size}"
+            self._archive_items = itertools.chain(items[self.page_size:], self._archive_items)
+
+        self._page = {"data": data, "meta": meta}
+        return self._page
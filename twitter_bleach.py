@@ -1,57 +1,553 @@
-import os
+import argparse
+import importlib
+import json
 import logging
+import os
 import sys
 import time
-import json
-import base64
 
-from wrapped_pytwitter_api import *
-from bleach_twitter_likes import *
-from bleach_twitter_tweets import *
-from bleach_twitter_follows import *
+from bleach_checkpoint import (BleachCheckpointStore, BLEACH_TYPE_LIKES, BLEACH_TYPE_TWEETS, BLEACH_TYPE_FOLLOWS,
+                               BLEACH_TYPE_RETWEETS, BLEACH_TYPE_BLOCKS, BLEACH_TYPE_MUTES, BLEACH_TYPE_LISTS)
+from twitter_archive_import import (ARCHIVE_LIKES_FILE_NAME, ARCHIVE_TWEETS_FILE_NAME, ARCHIVE_FOLLOWING_FILE_NAME,
+                                    ARCHIVE_BLOCKS_FILE_NAME, ARCHIVE_MUTES_FILE_NAME)
+
+# Command line entry point
+#
+#   python twitter_bleach.py likes --limit 500
+#   python twitter_bleach.py all --rule 'created_before_days_ago(365) & ~is_pinned()'
+#   python twitter_bleach.py plan tweets follows
+#   python twitter_bleach.py resume --no-browser
+#   python twitter_bleach.py status
+#
+# Only the modules a command needs are imported, when it runs. The API client, its dependencies and the bleach
+# modules are left out of status and --help, which only read the checkpoint store, so they start in milliseconds.
+#
+# The exit code tells a scheduler what to do next, e.g. run resume again later when a run ends with EXIT_INCOMPLETE.
+#
 
 if sys.version_info < (3, 7):
-    # script uses functools.partial which is a pretty recent capability
     print("Python 3.7 or later required to run")
     sys.exit(-1)
 
+EXIT_OK = 0
+# A bleach job or the command failed, see the log file
+EXIT_FAILED = 1
+# Bad command line, or a bad rule saved for resume
+EXIT_USAGE = 2
+# The run stopped before removing everything, e.g. it reached --limit or the API was unavailable. Run resume
+EXIT_INCOMPLETE = 3
+# The saved tokens can't be used and --no-browser doesn't allow authorizing the app again
+EXIT_AUTH_REQUIRED = 4
+EXIT_INTERRUPTED = 130
+
 LOCAL_HTTPD_SERVER_PORTS_TO_TRY = [8888, 8880, 8080, 9977, 4356, 3307]
 
-TWITTER_CLIENT_ID = os.environ.get("TWITTER_CLIENT_ID")
+DEFAULT_STATE_DIRECTORY = "local"
 
-# P Change this value to log output to a file
-logging_file_name = "local/like-unlike.log"
+# Names of the files kept in the state directory
+LOG_FILE_NAME = "like-unlike.log"
+CHECKPOINT_FILE_NAME = "bleach_checkpoint.sqlite"
+ACCOUNT_STORE_FILE_NAME = "bleach_accounts.sqlite"
+TOKEN_KEY_FILE_NAME = "bleach_token.key"
+ARCHIVE_FILE_NAME = "bleach_archive.jsonl.gz"
+SNAPSHOT_FILE_NAME = "bleach_snapshot.sqlite"
+# Options of the last run of each kind, so resume carries on with the same rule and archive
+LAST_RUN_FILE_NAME = "bleach_last_run.json"
 
-logging.basicConfig(
-    filename=logging_file_name,
-    format='%(asctime)s %(name)s %(levelname)-8s %(message)s',
-    level=logging.DEBUG,
-    datefmt='%Y-%m-%d %H:%M:%S')
+# The scopes requested of the Twitter OAUTH2 API on behalf of the user that will bleach their account
+twitter_api_scopes = ["tweet.read", "tweet.write", "users.read", "like.write", "like.read", "follows.read",
+                      "follows.write", "block.read", "block.write", "mute.read", "mute.write", "list.read",
+                      "list.write", "offline.access"]
 
-BLEACH_FOLLOWS = True
-BLEACH_LIKES = False
-BLEACH_TWEETS = False
+# Kind of bleaching to (bleach type, module, bleach function, plan function, file of a downloaded Twitter archive with
+# the items or None). Every bleach and plan function takes the API object and the limit as its first two arguments
+BLEACH_KINDS = {
+    "likes": (BLEACH_TYPE_LIKES, "bleach_twitter_likes", "bleach_likes", "plan_likes", ARCHIVE_LIKES_FILE_NAME),
+    "tweets": (BLEACH_TYPE_TWEETS, "bleach_twitter_tweets", "bleach_tweets", "plan_tweets", ARCHIVE_TWEETS_FILE_NAME),
+    "follows": (BLEACH_TYPE_FOLLOWS, "bleach_twitter_follows", "bleach_follows", "plan_follows",
+                ARCHIVE_FOLLOWING_FILE_NAME),
+    "retweets": (BLEACH_TYPE_RETWEETS, "bleach_twitter_retweets", "bleach_retweets", "plan_retweets",
+                 ARCHIVE_TWEETS_FILE_NAME),
+    "blocks": (BLEACH_TYPE_BLOCKS, "bleach_twitter_blocks", "bleach_blocks", "plan_blocks", ARCHIVE_BLOCKS_FILE_NAME),
+    "mutes": (BLEACH_TYPE_MUTES, "bleach_twitter_mutes", "bleach_mutes", "plan_mutes", ARCHIVE_MUTES_FILE_NAME),
+    "lists": (BLEACH_TYPE_LISTS, "bleach_twitter_lists", "bleach_lists", "plan_lists", None),
+}
 
-# The scopes requested of the Twitter OAUTH2 API on behalf of the user that will bleach their account
-twitter_api_scopes = ["tweet.read", "tweet.write", "users.read", "tweet.read",
-                      "users.read", "like.write", "like.read", "follows.read",
-                      "follows.write", "offline.access"]
+# Kinds bleached by the 'all' command. Retweets are removed with the tweets, blocks, mutes and lists only on request
+ALL_KINDS = ("likes", "tweets", "follows")
+
+KIND_OF_BLEACH_TYPE = {bleach_type: kind for kind, (bleach_type, _, _, _, _) in BLEACH_KINDS.items()}
+
+
+class BleachAuthenticationRequiredException(Exception):
+    pass
+
+
+def bleach_rule_expression(expression):
+    """
+    argparse type of --rule. The rule is built to check the expression and built again when the command runs
+
+    :param expression: Python expression of bleach_rules functions, e.g. 'created_before_days_ago(365) & ~is_pinned()'
+    :return: The expression
+    """
+    make_bleach_rule(expression)
+    return expression
+
+
+def make_bleach_rule(expression):
+    """
+    :param expression: Python expression of bleach_rules functions. None for no rule
+    :return: BleachRule, None if expression is None
+    :raises argparse.ArgumentTypeError: If the expression isn't a rule
+    """
+    if expression is None:
+        return None
+
+    try:
+        # Parsed, not evaluated. The expression can come from the last run file as well as the command line
+        return importlib.import_module("bleach_rules").parse_rule(expression)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f"invalid rule '{expression}': {e}")
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be 1 or more, not {number}")
+    return number
+
+
+def build_argument_parser():
+    parser = argparse.ArgumentParser(prog="twitter_bleach.py",
+                                     description="Remove likes, tweets, follows and more from Twitter accounts")
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--state-dir", default=DEFAULT_STATE_DIRECTORY, dest="state_directory",
+                        help="Directory of the checkpoint, accounts, archive, snapshots and log file. Default "
+                             f"'{DEFAULT_STATE_DIRECTORY}'")
+    common.add_argument("--log-file", help=f"Log file. Default '{LOG_FILE_NAME}' in the state directory")
+    common.add_argument("--log-level", default="DEBUG", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+
+    account = argparse.ArgumentParser(add_help=False)
+    account.add_argument("--account", default=os.environ.get("TWITTER_ACCOUNT_NAME"),
+                         help="Saved account to use. Default is the only saved account, if there is exactly one")
+    account.add_argument("--client-id", default=os.environ.get("TWITTER_CLIENT_ID"),
+                         help="Client ID of the Twitter application. Default $TWITTER_CLIENT_ID")
+    account.add_argument("--no-browser", action="store_true",
+                         help=f"Never open a browser to authorize the app, exit with {EXIT_AUTH_REQUIRED} instead. "
+                              f"For schedulers")
+
+    selection = argparse.ArgumentParser(add_help=False)
+    selection.add_argument("--limit", type=positive_int, help="Most items of each kind to remove. Default all")
+    selection.add_argument("--rule", type=bleach_rule_expression,
+                           help="Rule choosing what is removed, e.g. "
+                                "'created_before_days_ago(365) & ~is_pinned()'. See bleach_rules.py")
+    selection.add_argument("--archive-dir", dest="archive_directory",
+                           help="'data' directory of a downloaded Twitter archive to take the items from instead of "
+                                "paging through the API")
+
+    run = argparse.ArgumentParser(add_help=False)
+    run.add_argument("--dry-run", action="store_true",
+                     help="Go through the items without removing any. Saved progress isn't changed")
+    run.add_argument("--concurrency", type=positive_int,
+                     help="Most kinds bleached at the same time for each account. Default all")
+    run.add_argument("--fleet", action="store_true", help="Bleach every saved account instead of one")
+    run.add_argument("--max-parallel-accounts", type=positive_int, default=50,
+                     help="Most accounts bleached at the same time with --fleet")
+    run.add_argument("--no-snapshot", action="store_true", help="Don't snapshot the account before bleaching")
+    run.add_argument("--no-archive", action="store_true", help="Don't archive what is removed")
+    run.add_argument("--metrics-port", type=int,
+                     help="Serve counters of the run on http://127.0.0.1:<port>/metrics in the Prometheus format")
+
+    subparsers = parser.add_subparsers(dest="command", metavar="command", required=True)
+
+    for kind in BLEACH_KINDS:
+        kind_parser = subparsers.add_parser(kind, parents=[common, account, selection, run], help=f"Remove {kind}")
+        kind_parser.set_defaults(handler=command_bleach, kinds=[kind])
+
+    all_parser = subparsers.add_parser("all", parents=[common, account, selection, run],
+                                       help=f"Remove {', '.join(ALL_KINDS)} at the same time")
+    all_parser.set_defaults(handler=command_bleach, kinds=list(ALL_KINDS))
+
+    plan_parser = subparsers.add_parser("plan", parents=[common, account, selection],
+                                        help="Count the API calls and time a run would take. Nothing is removed")
+    plan_parser.add_argument("kinds", nargs="+", choices=list(BLEACH_KINDS), metavar="kind",
+                             help=f"One or more of {', '.join(BLEACH_KINDS)}")
+    plan_parser.set_defaults(handler=command_plan)
+
+    resume_parser = subparsers.add_parser("resume", parents=[common, account, run],
+                                          help="Carry on with the kinds whose last run didn't finish, with the same "
+                                               "rule and archive")
+    resume_parser.add_argument("--limit", type=positive_int, help="Most items of each kind to remove. Default all")
+    resume_parser.set_defaults(handler=command_resume)
+
+    status_parser = subparsers.add_parser("status", parents=[common],
+                                          help=f"Show the saved progress. Exits with {EXIT_INCOMPLETE} if there is "
+                                               f"a run to resume")
+    status_parser.set_defaults(handler=command_status)
+
+    restore_parser = subparsers.add_parser("restore-follows", parents=[common, account],
+                                           help="Follow again the users in the latest snapshot of the account")
+    restore_parser.add_argument("--limit", type=positive_int, help="Most users to follow. Default all")
+    restore_parser.set_defaults(handler=command_restore_follows)
+
+    return parser
+
+
+def state_file(args, file_name):
+    return os.path.join(args.state_directory, file_name)
+
+
+def open_checkpoint_store(args):
+    return BleachCheckpointStore(state_file(args, CHECKPOINT_FILE_NAME))
+
+
+def open_account_store(args):
+    bleach_account_store = importlib.import_module("bleach_account_store")
+    return bleach_account_store.BleachAccountStore(
+        state_file(args, ACCOUNT_STORE_FILE_NAME),
+        encryption_key=bleach_account_store.load_or_create_token_key(state_file(args, TOKEN_KEY_FILE_NAME)))
+
+
+def make_configure_api(args):
+    """
+    :return: Function setting up an API object for the run, for bleach_fleet and the single account
+    """
+    fleet_metrics = None
+    if getattr(args, "metrics_port", None) is not None:
+        metrics = importlib.import_module("bleach_metrics")
+        fleet_metrics = metrics.BleachFleetMetrics()
+        metrics.start_metrics_server(fleet_metrics, port=args.metrics_port)
+
+    def configure_api(api, account=None):
+        if fleet_metrics is not None:
+            api.metrics = fleet_metrics.account_metrics(account.account_name if account is not None else None)
+
+    return configure_api
+
+
+def authenticate(args, account_store, configure_api):
+    """
+    Authenticate with the saved account if there is one, otherwise with the browser. The account is saved so it can be
+    bleached again, or as part of a fleet, without authorizing again
+
+    :return: Tuple of the authenticated WrappedPyTwitterAPI and the Twitter ID of the account
+    :raises BleachAuthenticationRequiredException: If the app has to be authorized and --no-browser was given, or there
+    is no client ID to authorize it with
+    """
+    from wrapped_pytwitter_api import WrappedPyTwitterAPI, WrappedPyTwitterAPIOAuth2FlowException
+    from bleach_account_store import BleachAccountStoreDecryptException
+
+    stored_account = None
+    try:
+        if args.account is not None:
+            stored_account = account_store.account(args.account)
+            if stored_account is None:
+                logging.warning(f"No saved account '{args.account}'")
+        else:
+            stored_accounts = account_store.accounts()
+            if len(stored_accounts) == 1:
+                stored_account = stored_accounts[0]
+    except BleachAccountStoreDecryptException as e:
+        logging.warning(f"Saved account can't be used '{e}'")
+
+    client_id = args.client_id or (stored_account.client_id if stored_account is not None else None)
+    if client_id is None:
+        raise BleachAuthenticationRequiredException("No saved account and no Twitter client ID. Set TWITTER_CLIENT_ID "
+                                                    "or pass --client-id")
+    if stored_account is None and args.no_browser:
+        raise BleachAuthenticationRequiredException("No saved account to use without a browser. Run once without "
+                                                    "--no-browser to authorize the app")
+
+    api = WrappedPyTwitterAPI(client_id=client_id, oauth_flow=True, scopes=twitter_api_scopes)
+    configure_api(api)
+
+    if stored_account is not None:
+        # Unattended runs use the saved tokens and only fall back to the browser if they are rejected
+        try:
+            auth_details = api.authenticate_with_stored_tokens(stored_account.access_token,
+                                                               stored_account.refresh_token,
+                                                               stored_account.expires_at,
+                                                               local_ports_to_try=LOCAL_HTTPD_SERVER_PORTS_TO_TRY,
+                                                               interactive=not args.no_browser)
+        except WrappedPyTwitterAPIOAuth2FlowException as e:
+            raise BleachAuthenticationRequiredException(f"Saved tokens of '{stored_account.account_name}' can't be "
+                                                        f"used '{e}'. Run without --no-browser to authorize again")
+    else:
+        auth_details = api.OAuth2AuthenticationFlowHelper(local_ports_to_try=LOCAL_HTTPD_SERVER_PORTS_TO_TRY)
+    # The tokens themselves aren't logged, the log file isn't encrypted
+    logging.info(f"Twitter OAuth2 authenticated. Access token expires in {auth_details.get('expires_in')} seconds")
+
+    twitter_me = api.get_me(return_json=True)
+    bleach_account = account_store.save_account(twitter_me["data"]["username"], client_id,
+                                                auth_details["access_token"], auth_details.get("refresh_token"),
+                                                time.time() + auth_details["expires_in"]
+                                                if auth_details.get("expires_in") is not None else None)
+    api.on_access_token_set = bleach_account.save_tokens
+    return api, twitter_me["data"]["id"]
+
+
+def archive_js_file(archive_directory, kind):
+    archive_file_name = BLEACH_KINDS[kind][4]
+    if archive_directory is None or archive_file_name is None:
+        return None
+    return os.path.join(archive_directory, archive_file_name)
+
+
+def with_limit(function, limit):
+    # The bleach and plan functions each name the limit for what they remove, it is always the second argument
+    def call_with_limit(api, **kwargs):
+        return function(api, limit, **kwargs)
+
+    return call_with_limit
+
+
+def load_last_run_options(args):
+    try:
+        with open(state_file(args, LAST_RUN_FILE_NAME)) as last_run_file:
+            return json.load(last_run_file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_last_run_options(args, options_by_kind):
+    last_run_options = load_last_run_options(args)
+    last_run_options.update(options_by_kind)
+    with open(state_file(args, LAST_RUN_FILE_NAME), "w") as last_run_file:
+        json.dump(last_run_options, last_run_file, indent=2, sort_keys=True)
+
+
+def run_bleach(args, options_by_kind, skip_finished=False):
+    """
+    Bleach the kinds for the authenticated account, or every saved account with --fleet
+
+    :param args: Parsed command line
+    :param options_by_kind: Dictionary of kind to {"rule": rule expression, "archive_directory": path}
+    :param skip_finished: Leave out the kinds whose last run for the account finished
+    :return: EXIT_ code
+    """
+    from bleach_existence_check import ItemExistenceCache
+
+    # Before anything is opened, so a bad rule saved for resume is only a usage error
+    bleach_rules = {kind: make_bleach_rule(options.get("rule")) for kind, options in options_by_kind.items()}
+
+    if args.dry_run:
+        # Progress of a dry run is thrown away so it doesn't count the items it went through as done
+        checkpoint_store = BleachCheckpointStore()
+        archive_writer = None
+    else:
+        checkpoint_store = open_checkpoint_store(args)
+        archive_writer = None
+        if not args.no_archive:
+            archive_writer = importlib.import_module("bleach_archive").BleachArchiveWriter(
+                state_file(args, ARCHIVE_FILE_NAME))
+
+    # Queued items are looked up in batches before they are removed so items already gone don't use up write requests.
+    # A fleet run gives every account its own cache, see bleach_fleet
+    existence_cache = ItemExistenceCache()
+
+    # Each kind of bleaching has its own rate limit window so they are run at the same time
+    bleach_jobs = []
+    for kind, options in options_by_kind.items():
+        bleach_type, module_name, bleach_function_name, _, _ = BLEACH_KINDS[kind]
+        bleach_function = getattr(importlib.import_module(module_name), bleach_function_name)
+        bleach_jobs.append((bleach_type, with_limit(bleach_function, args.limit),
+                            {"archive_writer": archive_writer,
+                             "twitter_archive_js_file": archive_js_file(options.get("archive_directory"), kind),
+                             "bleach_rule": bleach_rules[kind],
+                             "existence_cache": existence_cache,
+                             "_dont_actually_bleach": args.dry_run}))
+    bleach_types = {bleach_type for bleach_type, _, _ in bleach_jobs}
+
+    # Each account is snapshotted before it is bleached, except on resume where the snapshot from before the first run
+    # is the one with everything that was removed
+    snapshot_store = None
+    if not (args.no_snapshot or args.dry_run or skip_finished):
+        snapshot_store = importlib.import_module("bleach_snapshot").BleachSnapshotStore(
+            state_file(args, SNAPSHOT_FILE_NAME))
+
+    configure_api = make_configure_api(args)
+    account_store = open_account_store(args)
+    try:
+        if args.fleet:
+            from bleach_fleet import bleach_fleet
+
+            fleet_results = bleach_fleet(account_store, bleach_jobs, checkpoint_store=checkpoint_store,
+                                         max_parallel_accounts=args.max_parallel_accounts, configure_api=configure_api,
+                                         max_concurrent_jobs=args.concurrency, skip_finished=skip_finished,
+                                         snapshot_store=snapshot_store)
+            logging.info(f"Fleet bleach results '{fleet_results}'")
+            for account_name, results in sorted(fleet_results.items()):
+                print(f"{account_name}: {results if results is not None else 'failed'}")
+            failed = any(results is None or None in results.values() for results in fleet_results.values())
+            unfinished = checkpoint_store.unfinished_bleach_types() & bleach_types
+        else:
+            from bleach_orchestrator import bleach_concurrently
+
+            api, twitter_user_id = authenticate(args, account_store, configure_api)
+            try:
+                if snapshot_store is not None:
+                    from bleach_snapshot import snapshot_bleach_types, take_snapshot
+
+                    bleach_types_to_snapshot = snapshot_bleach_types(
+                        [bleach_type for bleach_type, _, _ in bleach_jobs],
+                        checkpoint_store.unfinished_bleach_types(twitter_user_id))
+                    if bleach_types_to_snapshot:
+                        take_snapshot(api, snapshot_store, bleach_types=bleach_types_to_snapshot,
+                                      twitter_user_id=twitter_user_id)
+
+                bleach_results = bleach_concurrently(api, bleach_jobs, checkpoint_store=checkpoint_store,
+                                                     max_concurrent_jobs=args.concurrency,
+                                                     skip_finished=skip_finished)
+            finally:
+                api.stop_background_refresh()
+            logging.info(f"Bleach results '{bleach_results}'")
+            for bleach_type, result in bleach_results.items():
+                print(f"{KIND_OF_BLEACH_TYPE[bleach_type]}: {result if result is not None else 'failed'}")
+            failed = None in bleach_results.values()
+            unfinished = checkpoint_store.unfinished_bleach_types(twitter_user_id) & bleach_types
+    finally:
+        if archive_writer is not None:
+            archive_writer.close()
+        if snapshot_store is not None:
+            snapshot_store.close()
+        account_store.close()
+        checkpoint_store.close()
+
+    if failed:
+        return EXIT_FAILED
+    if unfinished and not args.dry_run:
+        print(f"Not finished: {', '.join(sorted(KIND_OF_BLEACH_TYPE[bleach_type] for bleach_type in unfinished))}. "
+              f"Run resume to carry on")
+        return EXIT_INCOMPLETE
+    return EXIT_OK
+
+
+def command_bleach(args):
+    options_by_kind = {kind: {"rule": args.rule, "archive_directory": args.archive_directory} for kind in args.kinds}
+    if not args.dry_run:
+        save_last_run_options(args, options_by_kind)
+    return run_bleach(args, options_by_kind)
+
+
+def command_resume(args):
+    checkpoint_store = open_checkpoint_store(args)
+    try:
+        unfinished = checkpoint_store.unfinished_bleach_types()
+    finally:
+        checkpoint_store.close()
+
+    kinds = [kind for kind, (bleach_type, _, _, _, _) in BLEACH_KINDS.items() if bleach_type in unfinished]
+    if not kinds:
+        print("Nothing to resume")
+        return EXIT_OK
+
+    last_run_options = load_last_run_options(args)
+    logging.info(f"Resuming {kinds} with the options of their last runs '{last_run_options}'")
+    return run_bleach(args, {kind: last_run_options.get(kind, {}) for kind in kinds}, skip_finished=True)
+
+
+def command_plan(args):
+    configure_api = make_configure_api(args)
+    checkpoint_store = open_checkpoint_store(args)
+    account_store = open_account_store(args)
+    try:
+        api, _ = authenticate(args, account_store, configure_api)
+        try:
+            for kind in args.kinds:
+                _, module_name, _, plan_function_name, _ = BLEACH_KINDS[kind]
+                plan_function = getattr(importlib.import_module(module_name), plan_function_name)
+                plan = plan_function(api, args.limit, checkpoint_store=checkpoint_store,
+                                     twitter_archive_js_file=archive_js_file(args.archive_directory, kind),
+                                     bleach_rule=make_bleach_rule(args.rule))
+                plan.log()
+                print(f"{kind}: {plan.summary()}")
+        finally:
+            api.stop_background_refresh()
+    finally:
+        account_store.close()
+        checkpoint_store.close()
+    return EXIT_OK
+
+
+def command_status(args):
+    if not os.path.exists(state_file(args, CHECKPOINT_FILE_NAME)):
+        print("No progress saved")
+        return EXIT_OK
+
+    checkpoint_store = open_checkpoint_store(args)
+    try:
+        progress = checkpoint_store.progress()
+    finally:
+        checkpoint_store.close()
+
+    unfinished = False
+    for user_id, bleach_type, processed_count, pending_count, finished in progress:
+        if finished is False or pending_count > 0:
+            unfinished = True
+            state = "not finished"
+        else:
+            state = "finished" if finished else "-"
+        print(f"{user_id:>20} {KIND_OF_BLEACH_TYPE.get(bleach_type, bleach_type):<9} processed {processed_count:>8} "
+              f"pending {pending_count:>6}  {state}")
+    return EXIT_INCOMPLETE if unfinished else EXIT_OK
+
+
+def command_restore_follows(args):
+    from bleach_snapshot import BleachSnapshotStore, restore_follows
+
+    account_store = open_account_store(args)
+    try:
+        api, _ = authenticate(args, account_store, make_configure_api(args))
+        try:
+            restored_follows = restore_follows(api, BleachSnapshotStore(state_file(args, SNAPSHOT_FILE_NAME)),
+                                               follow_limit=args.limit)
+        finally:
+            api.stop_background_refresh()
+    finally:
+        account_store.close()
+    logging.info(f"Restored follows '{restored_follows}'")
+    print(f"Followed {restored_follows} users again")
+    return EXIT_OK
 
 
-api = WrappedPyTwitterAPI(client_id=TWITTER_CLIENT_ID, oauth_flow=True, scopes=twitter_api_scopes)
-auth_details = api.OAuth2AuthenticationFlowHelper(local_ports_to_try=LOCAL_HTTPD_SERVER_PORTS_TO_TRY)
-logging.info(f"Twitter OAuth2 details '{auth_details}'")
+def main(argv=None):
+    """
+    :param argv: Command line arguments. Default sys.argv
+    :return: EXIT_ code
+    """
+    args = build_argument_parser().parse_args(argv)
 
-# Get details about the account. Specifically the Twitter ID for the user that authorized the app.
-twitter_me = api.get_me(return_json=True)
-my_twitter_id = twitter_me["data"]["id"]
+    os.makedirs(args.state_directory, exist_ok=True)
+    log_writer = None
+    if args.handler is not command_status:
+        # Written by a background thread and rotated at 10MB, see bleach_logging.py
+        from bleach_logging import configure_logging
 
-if BLEACH_LIKES:
-    bleach_likes(api)
+        log_writer = configure_logging(args.log_file or state_file(args, LOG_FILE_NAME),
+                                       level=getattr(logging, args.log_level))
+    try:
+        return args.handler(args)
+    except argparse.ArgumentTypeError as e:
+        # e.g. the rule saved for resume in the last run file was edited into something that isn't a rule
+        logging.error(f"'{args.command}' usage error '{e}'")
+        print(f"twitter_bleach.py {args.command}: error: {e}", file=sys.stderr)
+        return EXIT_USAGE
+    except BleachAuthenticationRequiredException as e:
+        logging.error(f"Authentication required '{e}'")
+        print(e, file=sys.stderr)
+        return EXIT_AUTH_REQUIRED
+    except KeyboardInterrupt:
+        logging.info("Interrupted. Progress up to the last page is saved, run resume to carry on")
+        return EXIT_INTERRUPTED
+    except Exception as e:
+        logging.exception(f"'{args.command}' failed")
+        print(f"'{args.command}' failed: {e}", file=sys.stderr)
+        return EXIT_FAILED
+    finally:
+        if log_writer is not None:
+            log_writer.stop()
 
-if BLEACH_TWEETS:
-    bleach_tweets(api)
 
-if BLEACH_FOLLOWS:
-    follows_archive = open("local/follows_archive.csv", "a+")
-    unfollows = bleach_follows(api, follows_archive_csv_file=follows_archive, _dont_actually_bleach=True)
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,7 @@
 import http.server
 import functools
+import threading
+import time
 import webbrowser
 import logging
 
@@ -8,6 +10,13 @@ import authlib.integrations.requests_client
 # noinspection PyPackageRequirements
 import pytwitter  # pip 'package' is python-twitter, module is pytwitter -RDP
 
+from rate_limit_scheduler import RateLimitScheduler, rate_limit_endpoint_key
+from api_call_ledger import ApiCallLedger
+from retry_policy import RetryPolicy
+from response_validator import ResponseValidator
+from bleach_metrics import STATUS_CONNECTION_ERROR
+from bleach_logging import hot_path_log
+
 
 class WrappedPyTwitterAPIRateLimitExceededException(pytwitter.PyTwitterError):
     pass
@@ -21,18 +30,100 @@ class WrappedPyTwitterAPIOAuth2FlowException(pytwitter.PyTwitterError):
     pass
 
 
+class WrappedPyTwitterAPIRefreshTokenInvalidException(WrappedPyTwitterAPIOAuth2FlowException):
+    pass
+
+
 class WrappedPyTwitterAPIServiceUnavailableException(pytwitter.PyTwitterError):
     pass
 
 
+class WrappedPyTwitterAPIConnectionException(WrappedPyTwitterAPIServiceUnavailableException):
+    pass
+
+
+def raise_for_twitter_response(status_code, data):
+    """
+    Raise the expressive exception for an error response from the Twitter API. Shared by the sync and async wrappers.
+    :param status_code: HTTP status code of the response
+    :param data: JSON data of the response
+    :return: None if the response is not an error
+    :raises WrappedPyTwitterAPIRateLimitExceededException: If the request exceeded rate limits. Caller needs to wait
+    :raises WrappedPyTwitterAPIUnauthorizedException: If the request was not authorized. Could be access token has expired
+    :raises WrappedPyTwitterAPIServiceUnavailableException: If the API is temporarily unavailable
+    :raises PyTwitterError: Any other exceptional or error response
+    """
+    if status_code == 429:
+        raise WrappedPyTwitterAPIRateLimitExceededException(data)
+    elif status_code == 401:
+        raise WrappedPyTwitterAPIUnauthorizedException(data)
+    elif status_code == 503:
+        raise WrappedPyTwitterAPIServiceUnavailableException(data)
+    elif status_code >= 400:
+        raise pytwitter.PyTwitterError(data)
+
+    # note:
+    # If only errors will raise
+    if "errors" in data and len(data.keys()) == 1:
+        raise pytwitter.PyTwitterError(data["errors"])
+
+    # v1 token not
+    if "reason" in data:
+        raise pytwitter.PyTwitterError(data)
+
+
 class WrappedPyTwitterAPI(pytwitter.Api):
 
     oauth2_flow_called_back_auth_url = None
 
     _authentication_refresh_token = None
 
-    def __init__(self, *args, **kwargs):
+    _authentication_access_token = None
+
+    _last_refresh_response = None
+
+    _authentication_expires_at = None
+
+    _background_refresh_timer = None
+
+    rate_limit_scheduler = None
+
+    retry_policy = None
+
+    call_ledger = None
+
+    response_validator = None
+
+    # BleachMetrics every response is recorded in. None, the default, records nothing
+    metrics = None
+
+    # Function called with (access_token, refresh_token, expires_at) every time the tokens change, e.g. to save them
+    on_access_token_set = None
+
+    # Seconds before a request is given up on and retried. pytwitter's default is to wait forever
+    DEFAULT_REQUEST_TIMEOUT_SECONDS = 30
+
+    # The access token is refreshed this long before it expires, or a tenth of its lifetime if that is shorter
+    ACCESS_TOKEN_REFRESH_MARGIN_SECONDS = 300
+
+    # Wait before trying again when a background refresh fails
+    BACKGROUND_REFRESH_RETRY_SECONDS = 30
+
+    def __init__(self, *args, retry_policy=None, **kwargs):
+        kwargs.setdefault("timeout", self.DEFAULT_REQUEST_TIMEOUT_SECONDS)
         super(WrappedPyTwitterAPI, self).__init__(*args, **kwargs)
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.rate_limit_scheduler = RateLimitScheduler()
+        self.call_ledger = ApiCallLedger()
+        self.response_validator = ResponseValidator()
+        # pytwitter keeps its own record of the rate limit headers that nothing reads. The scheduler replaces it
+        self.rate_limit = None
+
+        # The API object can be shared by threads bleaching different things at the same time. The lock makes sure
+        # only one of them refreshes the access token. The thread local remembers the access token each thread last
+        # made a request with, so a thread that gets a 401 can tell if another thread has already refreshed it.
+        self._authentication_lock = threading.RLock()
+        self._request_context = threading.local()
 
     class _AuthParametersCaptureRequestHandler(http.server.BaseHTTPRequestHandler):
         """
@@ -115,35 +206,151 @@ class WrappedPyTwitterAPI(pytwitter.Api):
         # The Twitter documentation is kind of confusing. However pytwitter will work fine while the token is valid.
         # After it has expired refresh_token will need to be called.
 
-        self.set_access_token(auth_credentials['access_token'], auth_credentials.get("refresh_token", None))
+        self.set_access_token(auth_credentials['access_token'], auth_credentials.get("refresh_token", None),
+                              expires_in=auth_credentials.get("expires_in", None))
 
         return auth_credentials
 
-    def set_access_token(self, access_token, refresh_token=None):
+    def authenticate_with_stored_tokens(self, access_token, refresh_token, expires_at, local_ports_to_try,
+                                        listen_ip="127.0.0.1", interactive=True):
+        """
+        Authenticate with tokens saved by an earlier run, so unattended runs don't need a browser. An expired access
+        token is refreshed silently. The interactive OAuth2AuthenticationFlowHelper is only run when Twitter rejects the
+        refresh token, or there isn't one.
+
+        :param access_token: Stored access token
+        :param refresh_token: Stored refresh token, None if there isn't one
+        :param expires_at: Epoch time the stored access token expires, None if unknown
+        :param local_ports_to_try: Ports for OAuth2AuthenticationFlowHelper if it has to be run
+        :param listen_ip: IP for OAuth2AuthenticationFlowHelper if it has to be run
+        :param interactive: False to raise instead of running OAuth2AuthenticationFlowHelper, e.g. when run by a
+        scheduler with no one to authorize the app. Default True
+        :return: Auth details with 'access_token', 'refresh_token' and 'expires_in' of the tokens now in use
+        :raises WrappedPyTwitterAPIOAuth2FlowException: If the stored tokens can't be used and interactive is False
+        """
+        expires_in = expires_at - time.time() if expires_at is not None else None
+
+        try:
+            if expires_in is None or expires_in > 0:
+                self.set_access_token(access_token, refresh_token, expires_in=expires_in)
+                try:
+                    # The token may have been revoked even if it hasn't expired
+                    self.get_me(return_json=True)
+                except WrappedPyTwitterAPIUnauthorizedException:
+                    logging.info("Stored access token was not accepted. Refreshing it")
+                    self.refresh_access_token(refresh_token)
+            else:
+                logging.info("Stored access token has expired. Refreshing it")
+                self.set_access_token(access_token, refresh_token)
+                self.refresh_access_token(refresh_token)
+        except WrappedPyTwitterAPIOAuth2FlowException as e:
+            if not interactive:
+                raise
+            logging.warning(f"Stored tokens can't be used '{e}'. Starting interactive authentication")
+            return self.OAuth2AuthenticationFlowHelper(local_ports_to_try, listen_ip=listen_ip)
+
+        with self._authentication_lock:
+            return {"access_token": self._authentication_access_token,
+                    "refresh_token": self._authentication_refresh_token,
+                    "expires_in": self._authentication_expires_at - time.time()
+                    if self._authentication_expires_at is not None else None}
+
+    def set_access_token(self, access_token, refresh_token=None, expires_in=None):
         """
         Sets the API to use the provided access token for authenticated requests
+
+        If the lifetime of the token and a refresh token are known, the token is refreshed in the background shortly
+        before it expires. The swap to the new token is atomic, requests already in flight finish with the old token
+        which is still valid.
+
         :param access_token: Token value from Twitter OAuth2
         :param refresh_token: Token for getting the next access_token
+        :param expires_in: Seconds until the access token expires, 'expires_in' of the OAuth2 token response. Default
+        None, which doesn't refresh in the background
         :return: None
         """
-        self._auth = authlib.integrations.requests_client.OAuth2Auth(
+        auth = authlib.integrations.requests_client.OAuth2Auth(
             token={"access_token": access_token, "token_type": "Bearer"}
         )
 
-        self._authentication_refresh_token = refresh_token
+        with self._authentication_lock:
+            self._auth = auth
+            self._authentication_access_token = access_token
+            self._authentication_refresh_token = refresh_token
+            self._authentication_expires_at = time.time() + expires_in if expires_in is not None else None
+
+            if self.on_access_token_set is not None:
+                # The new tokens are already in use. A failure to save them must not stop the requests using them
+                try:
+                    self.on_access_token_set(access_token, refresh_token, self._authentication_expires_at)
+                except Exception as e:
+                    logging.error(f"Saving the new access token failed '{e}'")
+
+            if refresh_token is not None and expires_in is not None:
+                refresh_margin = min(self.ACCESS_TOKEN_REFRESH_MARGIN_SECONDS, expires_in / 10)
+                self._schedule_background_refresh(max(0, expires_in - refresh_margin))
+            else:
+                self.stop_background_refresh()
+
+    def _schedule_background_refresh(self, delay_seconds):
+        with self._authentication_lock:
+            self.stop_background_refresh()
+            self._background_refresh_timer = threading.Timer(delay_seconds, self._background_refresh)
+            self._background_refresh_timer.daemon = True
+            self._background_refresh_timer.start()
+
+    def stop_background_refresh(self):
+        """
+        Cancel the scheduled background refresh of the access token
+        :return: None
+        """
+        with self._authentication_lock:
+            if self._background_refresh_timer is not None:
+                self._background_refresh_timer.cancel()
+                self._background_refresh_timer = None
 
-    def refresh_access_token(self, refresh_token=None):
+    def _background_refresh(self):
+        with self._authentication_lock:
+            try:
+                logging.debug("Refreshing access token before it expires")
+                self._last_refresh_response = self._refresh_access_token()
+            except Exception as e:
+                # Keep trying while the current token is still good. If it runs out, requests get a 401 and the
+                # bleach loops refresh the token themselves
+                logging.warning(f"Background refresh of access token failed '{e}'")
+                if self._authentication_expires_at is not None \
+                        and time.time() + self.BACKGROUND_REFRESH_RETRY_SECONDS < self._authentication_expires_at:
+                    self._schedule_background_refresh(self.BACKGROUND_REFRESH_RETRY_SECONDS)
+
+    def refresh_access_token(self, refresh_token=None, verify_with_get_me=False):
         """
         Use the refresh_token value to get a new temporary access token. On success the API object will be updated
         to use the new token. set_access_token does not need to be called directly.
 
         To refresh temporary access token "offline.access" MUST be one of the requested scopes
 
+        Safe to call from several threads at once. If another thread already refreshed the access token since this
+        thread last made a request, the refresh is skipped and the details of that refresh are returned.
+
         :param refresh_token: The token provided by the last successful authentication or refresh
+        :param verify_with_get_me: Make a get_me request with the new token to check it works. Default False
         :return: The new auth deatils, including the next refresh token
+        :raises WrappedPyTwitterAPIRefreshTokenInvalidException: If Twitter rejected the refresh token
         :raises PyTwitterError: If refresh request did not return 200 HTTP status code
         """
 
+        with self._authentication_lock:
+            access_token_last_used = getattr(self._request_context, "access_token", None)
+            if refresh_token is None and access_token_last_used is not None \
+                    and access_token_last_used != self._authentication_access_token:
+                logging.info("Access token was already refreshed by another thread")
+                return self._last_refresh_response
+
+            self._last_refresh_response = self._refresh_access_token(refresh_token, verify_with_get_me)
+            return self._last_refresh_response
+
+    def _refresh_access_token(self, refresh_token=None, verify_with_get_me=False):
+
         if self._authentication_refresh_token is None and refresh_token is None:
             raise WrappedPyTwitterAPIOAuth2FlowException("Can't refresh authentication. No refresh token specified")
 
@@ -154,59 +361,115 @@ class WrappedPyTwitterAPI(pytwitter.Api):
         else:
             refresh_token_to_use = self._authentication_refresh_token
 
-        twitter_refresh_url = "https://api.twitter.com/2/oauth2/token"
+        twitter_refresh_url = f"{self.BASE_URL_V2}/oauth2/token"
 
         # https://developer.twitter.com/en/docs/authentication/oauth-2-0/authorization-code
-        refresh_token_response = requests.post(twitter_refresh_url,
-                                               headers={"Content-Type": "application/x-www-form-urlencoded"},
-                                               data={
-                                                   "refresh_token": refresh_token_to_use,
-                                                   "grant_type": "refresh_token",
-                                                   "client_id": self.client_id
-                                               })
+        # Uses the API session so the refresh reuses the pooled keep-alive connection to the API
+        refresh_token_response = self.session.post(twitter_refresh_url,
+                                                   headers={"Content-Type": "application/x-www-form-urlencoded"},
+                                                   data={
+                                                       "refresh_token": refresh_token_to_use,
+                                                       "grant_type": "refresh_token",
+                                                       "client_id": self.client_id
+                                                   },
+                                                   timeout=self.timeout)
 
         if refresh_token_response.status_code == 200:
             self.set_access_token(refresh_token_response.json()['access_token'],
-                                  refresh_token_response.json().get("refresh_token", None))
+                                  refresh_token_response.json().get("refresh_token", None),
+                                  expires_in=refresh_token_response.json().get("expires_in", None))
 
-            self.get_me(return_json=True)
+            if verify_with_get_me:
+                self.get_me(return_json=True)
 
+        elif refresh_token_response.status_code in (400, 401):
+            # Twitter answers 400 'invalid_request' for a refresh token that was revoked, expired or already used
+            raise WrappedPyTwitterAPIRefreshTokenInvalidException(
+                f"Token refresh rejected with status code '{refresh_token_response.status_code}'")
         else:
             raise pytwitter.PyTwitterError(f"Token refresh returned status code '{refresh_token_response.status_code}'")
         return refresh_token_response.json()
 
-    @staticmethod
-    def _parse_response(resp: requests.Response) -> dict:
+    def _request(self, url, verb="GET", *args, **kwargs) -> requests.Response:
         """
-        Overrides default pytwitter.Api behavior to raise more expressive exceptions.
+        Overrides default pytwitter.Api behavior to wait for the endpoint rate limit window to have capacity before
+        making the request, see RateLimitScheduler. Requests that fail with a 5xx status, a dropped connection or a
+        timeout are made again as they were after a backoff, see RetryPolicy. Every request is recorded once in the
+        call ledger, see ApiCallLedger.
+        :raises WrappedPyTwitterAPIConnectionException: If the connection kept failing after all the retries
+        :raises ApiCallLedgerRedundantCallException: If the call ledger rejected the request as redundant
+        """
+        if url:
+            self.call_ledger.record(rate_limit_endpoint_key(verb, url))
+
+        retries = {}
+        while True:
+            if url:
+                self.rate_limit_scheduler.acquire(rate_limit_endpoint_key(verb, url))
+            self._request_context.access_token = self._authentication_access_token
+
+            try:
+                resp = super(WrappedPyTwitterAPI, self)._request(url, verb, *args, **kwargs)
+                error_kind = self.retry_policy.classify_response(resp)
+                if error_kind is None:
+                    return resp
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if self.metrics is not None and url:
+                    self.metrics.record_response(rate_limit_endpoint_key(verb, url), STATUS_CONNECTION_ERROR)
+                error_kind = self.retry_policy.classify_exception(e)
+                if not self.retry_policy.should_retry(error_kind, retries.get(error_kind, 0)):
+                    raise WrappedPyTwitterAPIConnectionException({"status": None, "detail": str(e)})
+            else:
+                if not self.retry_policy.should_retry(error_kind, retries.get(error_kind, 0)):
+                    # Let _parse_response raise the exception for the status code
+                    return resp
+                # The response is retried instead of parsed, record it here
+                if self.metrics is not None and url:
+                    self.metrics.record_response(rate_limit_endpoint_key(verb, url), resp.status_code,
+                                                 resp.elapsed.total_seconds())
+
+            delay_seconds = self.retry_policy.delay_seconds(sum(retries.values()))
+            retries[error_kind] = retries.get(error_kind, 0) + 1
+            hot_path_log.info("Request %s %s failed with '%s'. Retry %s in %.1f seconds", verb, url, error_kind,
+                              retries[error_kind], delay_seconds,
+                              extra={"endpoint": rate_limit_endpoint_key(verb, url) if url else None,
+                                     "status": error_kind})
+            time.sleep(delay_seconds)
+
+    def _parse_response(self, resp: requests.Response) -> dict:
+        """
+        Overrides default pytwitter.Api behavior to raise more expressive exceptions. The rate limit headers of the
+        response are recorded so following calls to the same endpoint are paced by the rate limit scheduler.
         :param resp: Response
         :return: json data
         :raises WrappedPyTwitterAPIRateLimitExceededException: If the request exceeded rate limits. Caller needs to wait
         :raises WrappedPyTwitterAPIUnauthorizedException: If the request was not authorized. Could be access token has expired
+        :raises ResponseValidationException: If the response doesn't match the schema of its endpoint, see
+        ResponseValidator
         :raises PyTwitterError: Any other exceptional or error response
         """
 
+        endpoint = None
+        if resp.request is not None and resp.request.url:
+            endpoint = rate_limit_endpoint_key(resp.request.method, resp.request.url)
+            self.rate_limit_scheduler.update_from_headers(endpoint, resp.headers)
+            if self.metrics is not None:
+                self.metrics.record_response(endpoint, resp.status_code, resp.elapsed.total_seconds())
+                if "x-rate-limit-remaining" in resp.headers:
+                    self.metrics.record_rate_limit(endpoint, *self.rate_limit_scheduler.status(endpoint))
+
         try:
             data = resp.json()
         except ValueError:
             raise pytwitter.PyTwitterError(f"Unknown error: {resp.content}")
 
-        if resp.status_code == 429:
-            raise WrappedPyTwitterAPIRateLimitExceededException(resp.json())
-        elif resp.status_code == 401:
-            raise WrappedPyTwitterAPIUnauthorizedException(resp.json())
-        elif resp.status_code == 503:
-            raise WrappedPyTwitterAPIServiceUnavailableException(resp.json())
-        elif not resp.ok:
-            raise pytwitter.PyTwitterError(data)
-
-        # note:
-        # If only errors will raise
-        if "errors" in data and len(data.keys()) == 1:
-            raise pytwitter.PyTwitterError(data["errors"])
-
-        # v1 token not
-        if "reason" in data:
-            raise pytwitter.PyTwitterError(data)
+        if resp.status_code == 429 and endpoint is not None:
+            reset_at = resp.headers.get("x-rate-limit-reset")
+            self.rate_limit_scheduler.mark_exhausted(endpoint, float(reset_at) if reset_at else None)
+
+        raise_for_twitter_response(resp.status_code, data)
+
+        if self.response_validator is not None and endpoint is not None:
+            self.response_validator.validate(endpoint, data)
 
         return data